@@ -0,0 +1,10 @@
+"""
+Benchmarks of the chat API. Every module is runnable with ``python -m benchmarks.<module>`` from the project folder.
+"""
+import os
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simple_chat.settings')
+    import django
+    django.setup()
@@ -0,0 +1,134 @@
+"""
+Concurrency benchmark of the async read endpoints against their sync counterparts under ASGI.
+
+Seeds a throwaway SQLite database like benchmarks.load and sends the requests of each read scenario through the
+ASGI handler with django.test.AsyncClient, in process and without network overhead, once to the sync endpoint and
+once to its async variant. Requests run as asyncio tasks with at most ``--concurrency`` of them in flight; sync
+views get there through a thread hop each, async views run on the event loop. Reports throughput and p50/p99
+latency for each endpoint, variant and concurrency limit. The response cache is disabled so that both variants
+query the database.
+
+    python -m benchmarks.asgi [--concurrency 1 8 32 128] [--requests 500] [--output results.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import sqlite3
+import time
+
+from benchmarks import setup_django
+from benchmarks.load import add_data_arguments, percentile, Scenarios, seeded_database
+
+# Read scenarios of benchmarks.load and the async variants of their endpoints
+ASYNC_PATHS = {
+    'thread_list': '/api/chat/async/retrieve-thread-list/',
+    'message_list': '/api/chat/async/retrieve-message-list/',
+    'message_list_cursor': '/api/chat/async/retrieve-message-list/',
+    'unread_count': '/api/chat/async/retrieve-number-of-unread-messages/',
+}
+
+
+def build_requests(data, name, count, random_seed):
+    """Return ``count`` requests of a scenario as (path, params, headers), made by random users"""
+    rng = random.Random(random_seed)
+    requests = []
+    for _ in range(count):
+        user_id = rng.choice(data.user_ids)
+        _, path, params = getattr(Scenarios(data, user_id, rng), name)()
+        requests.append((path, params, {'Authorization': f'Token {data.tokens[user_id]}'}))
+    return requests
+
+
+async def run(requests, concurrency):
+    """Send requests with at most ``concurrency`` of them in flight; return latencies, errors and wall time"""
+    from django.test import AsyncClient
+
+    client = AsyncClient(raise_request_exception=False)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(path, params, headers):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(path, params, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(*request) for request in requests))
+    return latencies, errors, time.perf_counter() - start
+
+
+def benchmark(data, args):
+    results = {}
+    for name, async_path in ASYNC_PATHS.items():
+        requests = build_requests(data, name, args.requests, args.seed)
+        async_requests = [(async_path, params, headers) for _, params, headers in requests]
+        for variant, variant_requests in (('sync', requests), ('async', async_requests)):
+            # Warm up caches of the process, e.g. authenticated tokens, before measuring
+            asyncio.run(run(variant_requests[:args.warm_up], args.warm_up))
+            for concurrency in args.concurrency:
+                latencies, errors, wall_time = asyncio.run(run(variant_requests, concurrency))
+                results.setdefault(name, {}).setdefault(variant, {})[concurrency] = {
+                    'requests': len(latencies),
+                    'errors': errors,
+                    'throughput_rps': round(len(latencies) / wall_time, 1),
+                    'p50_ms': round(percentile(latencies, 0.50), 3),
+                    'p99_ms': round(percentile(latencies, 0.99), 3),
+                }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128],
+                        help='Limits of requests in flight to measure')
+    parser.add_argument('--requests', type=int, default=500, help='Number of requests per endpoint and limit')
+    parser.add_argument('--warm-up', type=int, default=50, help='Number of warm-up requests per endpoint')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test.utils import override_settings
+
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    with seeded_database(args) as data, override_settings(CACHES=caches):
+        print(f'Running {args.requests} requests per endpoint at concurrency limits {args.concurrency}...')
+        started = time.perf_counter()
+        results = benchmark(data, args)
+        wall_time = time.perf_counter() - started
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'wall_time_s': round(wall_time, 3),
+            **{key: value for key, value in vars(args).items() if key not in ('database', 'output')},
+        },
+        'endpoints': results,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Results saved to {args.output}')
+
+
+def print_report(report):
+    print(f'{"endpoint":<22}{"variant":>8}{"limit":>7}{"requests":>9}{"errors":>8}{"req/s":>9}{"p50 ms":>9}'
+          f'{"p99 ms":>9}')
+    for name, variants in report['endpoints'].items():
+        for variant, limits in variants.items():
+            for concurrency, row in limits.items():
+                print(f'{name:<22}{variant:>8}{concurrency:>7}{row["requests"]:>9}{row["errors"]:>8}'
+                      f'{row["throughput_rps"]:>9}{row["p50_ms"]:>9}{row["p99_ms"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares two result files of benchmarks.load and fails on regressions.
+
+Prints the change of p50/p99 latency, throughput and queries per request for each endpoint. Exits with
+status 1 when any of them got worse by more than the threshold, so it can be used as a CI gate.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 20]
+"""
+import argparse
+import json
+import sys
+
+# Metric name and whether a higher value is better
+METRICS = (
+    ('p50_ms', False),
+    ('p99_ms', False),
+    ('throughput_rps', True),
+    ('queries_per_request', False),
+)
+
+
+def change(before, after):
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(baseline, candidate, threshold):
+    """Print the comparison and return the list of regressions"""
+    regressions = []
+    print(f'{"endpoint":<26}{"metric":<21}{"baseline":>11}{"candidate":>11}{"change":>9}')
+    for name, before in baseline['endpoints'].items():
+        after = candidate['endpoints'].get(name)
+        if after is None:
+            print(f'{name:<26}missing in candidate')
+            continue
+        for metric, higher_is_better in METRICS:
+            delta = change(before[metric], after[metric])
+            worse = -delta if higher_is_better else delta
+            regressed = worse > threshold
+            if regressed:
+                regressions.append((name, metric))
+            print(f'{name:<26}{metric:<21}{before[metric]:>11}{after[metric]:>11}{delta:>+8.1f}%'
+                  f'{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=20, help='Allowed slowdown in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline, open(args.candidate) as candidate:
+        regressions = compare(json.load(baseline), json.load(candidate), args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s) above {args.threshold}%')
+        sys.exit(1)
+    print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
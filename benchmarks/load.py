@@ -0,0 +1,233 @@
+"""
+Load test of the chat API with concurrent clients.
+
+Creates a throwaway SQLite database, seeds it with benchmarks.seed and drives the api/chat/ and api/user/
+endpoints from concurrent client threads through the Django test client, i.e. in process and without
+network overhead. Reports throughput, p50/p99 latency and SQL queries per request for each endpoint
+and saves them as JSON to be compared with benchmarks.compare.
+
+    python -m benchmarks.load [--clients 8] [--requests 2000] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from benchmarks import setup_django
+
+# Relative weights of the scenarios, roughly following what chat clients do
+SCENARIOS = {
+    'thread_list': 20,
+    'message_list': 25,
+    'message_list_cursor': 10,
+    'message_list_deep_offset': 5,
+    'create_message': 10,
+    'unread_count': 15,
+    'mark_thread_as_read': 5,
+    'user_list': 5,
+    'me': 5,
+}
+
+
+class QueryCounter:
+    """Execute wrapper counting queries run on a connection"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Scenarios:
+    """Requests a client of a particular user makes; each method returns (method, path, data)"""
+
+    def __init__(self, data, user_id, rng):
+        self.data = data
+        self.user_id = user_id
+        self.threads = data.threads_by_user[user_id] or data.thread_ids
+        self.rng = rng
+
+    def thread(self):
+        return self.rng.choice(self.threads)
+
+    def thread_list(self):
+        return 'get', '/api/chat/retrieve-thread-list/', {'user': self.user_id}
+
+    def message_list(self):
+        return 'get', '/api/chat/create-retrieve-message/', {'thread_id': self.thread()}
+
+    def message_list_cursor(self):
+        return 'get', '/api/chat/create-retrieve-message/', {'thread_id': self.thread(), 'mode': 'cursor'}
+
+    def message_list_deep_offset(self):
+        thread = max(self.threads, key=self.data.message_counts.__getitem__)
+        offset = max(self.data.message_counts[thread] - 10, 0)
+        return 'get', '/api/chat/create-retrieve-message/', {'thread_id': thread, 'offset': offset}
+
+    def create_message(self):
+        return 'post', '/api/chat/create-retrieve-message/', {'thread': self.thread(), 'text': 'Benchmark message'}
+
+    def unread_count(self):
+        return 'get', '/api/chat/retrieve-number-of-unread-messages/', {}
+
+    def mark_thread_as_read(self):
+        return 'patch', f'/api/chat/mark-thread-as-read/{self.thread()}/', {'up_to': 2 ** 62}
+
+    def user_list(self):
+        return 'get', '/api/user/list/', {}
+
+    def me(self):
+        return 'get', '/api/user/me/', {}
+
+
+def run_client(data, user_id, requests, random_seed, results):
+    from django.db import connection
+    from django.test import Client
+
+    rng = random.Random(random_seed)
+    scenarios = Scenarios(data, user_id, rng)
+    # Failed requests (e.g. "database is locked" under write contention) are counted as errors
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {data.tokens[user_id]}')
+    names, weights = zip(*SCENARIOS.items())
+    counter = QueryCounter()
+    samples = []
+    with connection.execute_wrapper(counter):
+        for name in rng.choices(names, weights=weights, k=requests):
+            method, path, params = getattr(scenarios, name)()
+            counter.count = 0
+            start = time.perf_counter()
+            if method == 'get':
+                response = client.get(path, params)
+            else:
+                response = getattr(client, method)(path, params, content_type='application/json')
+            elapsed = time.perf_counter() - start
+            samples.append((name, elapsed, counter.count, response.status_code >= 400))
+    connection.close()
+    results.extend(samples)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(samples, wall_time):
+    by_name = defaultdict(list)
+    for sample in samples:
+        by_name[sample[0]].append(sample)
+
+    summary = {}
+    for name, rows in [*sorted(by_name.items()), ('total', samples)]:
+        latencies = [row[1] * 1000 for row in rows]
+        summary[name] = {
+            'requests': len(rows),
+            'errors': sum(row[3] for row in rows),
+            'throughput_rps': round(len(rows) / wall_time, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_per_request': round(statistics.fmean(row[2] for row in rows), 2),
+        }
+    return summary
+
+
+def add_data_arguments(parser):
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request mix')
+    parser.add_argument('--database', help='SQLite file to use, a temporary file by default')
+    parser.add_argument('--output', help='Save results as JSON to this file')
+
+
+@contextmanager
+def seeded_database(args):
+    """Create a throwaway database, seed it as given by the data arguments and destroy it on exit"""
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    from benchmarks.seed import seed
+
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    setup_test_environment()
+    connection.settings_dict['TEST']['NAME'] = database
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        print(f'Seeding {args.users} users, {args.threads} threads and {args.messages} messages...')
+        data = seed(users=args.users, threads=args.threads, messages=args.messages, random_seed=args.seed)
+        connection.close()
+        yield data
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='Total number of requests')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+
+    # Measure the endpoints rather than the throttles, which would turn most of the messages sent into 429 responses
+    settings.THROTTLE_BUCKETS = {}
+    with seeded_database(args) as data:
+        print(f'Running {args.requests} requests from {args.clients} clients...')
+        rng = random.Random(args.seed)
+        results = []
+        per_client = args.requests // args.clients
+        clients = [
+            threading.Thread(
+                target=run_client,
+                args=(data, rng.choice(data.user_ids), per_client, args.seed + i, results),
+            )
+            for i in range(args.clients)
+        ]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        wall_time = time.perf_counter() - start
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'wall_time_s': round(wall_time, 3),
+            **{key: value for key, value in vars(args).items() if key not in ('database', 'output')},
+        },
+        'endpoints': summarize(results, wall_time),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Results saved to {args.output}')
+
+
+def print_report(report):
+    print(f'{"endpoint":<26}{"requests":>9}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"queries":>9}')
+    for name, row in report['endpoints'].items():
+        print(f'{name:<26}{row["requests"]:>9}{row["errors"]:>8}{row["throughput_rps"]:>9}'
+              f'{row["p50_ms"]:>9}{row["p99_ms"]:>9}{row["queries_per_request"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Seeding of realistic chat data for benchmarks, built on the model factories.
+
+Message counts per thread follow a Pareto distribution, so a few threads are very long and most are short,
+and the tail of every thread is left unread to form unread backlogs. Rows are built with the factories and
+inserted with bulk_create; derived state (read marks, last messages) is set from them.
+"""
+import random
+from dataclasses import dataclass, field
+
+DEFAULT_PASSWORD = 'password123'
+
+
+@dataclass
+class SeededData:
+    user_ids: list
+    tokens: dict
+    threads_by_user: dict = field(default_factory=dict)
+    thread_ids: list = field(default_factory=list)
+    message_counts: dict = field(default_factory=dict)
+
+
+def insert_messages(messages):
+    """Insert messages and move read marks past the ones built as read"""
+    from chat.models import Message, Thread
+
+    Message.objects.bulk_create(messages)
+    Thread.objects.advance_read_marks([message for message in messages if message.is_read])
+
+
+def seed(users=200, threads=1000, messages=50000, max_unread=20, batch_size=2000, random_seed=42):
+    import factory
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from rest_framework.authtoken.models import Token
+
+    from chat.factories import MessageFactory, ThreadFactory
+    from chat.models import Thread
+    from user.factories import UserFactory
+    from user.models import User
+
+    rng = random.Random(random_seed)
+    # Hashing is deliberately slow, so all users share one precomputed hash
+    password = make_password(DEFAULT_PASSWORD)
+
+    with transaction.atomic():
+        user_objects = User.objects.bulk_create(
+            UserFactory.build_batch(users, password=factory.Transformer.Force(password)), batch_size=batch_size)
+        user_ids = [user.id for user in user_objects]
+        tokens = {
+            token.user_id: token.key
+            for token in Token.objects.bulk_create(
+                [Token(user_id=user_id, key=Token.generate_key()) for user_id in user_ids], batch_size=batch_size)
+        }
+
+        pairs = set()
+        max_pairs = len(user_ids) * (len(user_ids) - 1) // 2
+        while len(pairs) < min(threads, max_pairs):
+            pairs.add(tuple(sorted(rng.sample(user_ids, 2))))
+        thread_objects = Thread.objects.bulk_create(
+            [
+                ThreadFactory.build(participant_one_id=one, participant_two_id=two,
+                                    participant_one=None, participant_two=None)
+                for one, two in sorted(pairs)
+            ],
+            batch_size=batch_size,
+        )
+
+        weights = [rng.paretovariate(1.2) for _ in thread_objects]
+        message_counts = dict.fromkeys((thread.id for thread in thread_objects), 0)
+        for thread in rng.choices(thread_objects, weights=weights, k=messages):
+            message_counts[thread.id] += 1
+
+        batch = []
+        for thread in thread_objects:
+            count = message_counts[thread.id]
+            unread = rng.randint(0, min(max_unread, count))
+            participants = (thread.participant_one_id, thread.participant_two_id)
+            for position in range(count):
+                batch.append(MessageFactory.build(
+                    thread_id=thread.id, thread=None, sender_id=rng.choice(participants), sender=None,
+                    is_read=position < count - unread,
+                ))
+                if len(batch) >= batch_size:
+                    insert_messages(batch)
+                    batch = []
+        insert_messages(batch)
+        Thread.objects.refresh_last_message()
+
+    threads_by_user = {user_id: [] for user_id in user_ids}
+    for thread in thread_objects:
+        threads_by_user[thread.participant_one_id].append(thread.id)
+        threads_by_user[thread.participant_two_id].append(thread.id)
+    return SeededData(
+        user_ids=user_ids,
+        tokens=tokens,
+        threads_by_user=threads_by_user,
+        thread_ids=[thread.id for thread in thread_objects],
+        message_counts=message_counts,
+    )
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of rendering list pages: ModelSerializers against the lightweight read-only serializers.
+
+Objects are built in memory, so only serializer CPU time is measured.
+
+    python -m benchmarks.serializers [--objects 1000] [--repeat 5]
+"""
+import argparse
+import datetime
+import time
+
+from benchmarks import setup_django
+
+
+def build_objects(count):
+    from chat.models import Message, Thread
+    from user.models import User
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    users = [
+        User(id=i, email=f'user{i}@test.com', first_name=f'first_name{i}', last_name=f'last_name{i}')
+        for i in range(1, count + 2)
+    ]
+    messages, threads = [], []
+    for i in range(count):
+        thread = Thread(
+            id=i + 1, participant_one=users[i], participant_two=users[i + 1], created_at=now, updated_at=now)
+        message = Message(
+            id=i + 1, sender=users[i], thread=thread, text='Lorem ipsum dolor sit amet ' * 4,
+            created_at=now, updated_at=now)
+        thread.last_message, thread.last_message_at, thread.number_of_unread_messages = message, now, i % 5
+        messages.append(message)
+        threads.append(thread)
+    return messages, threads
+
+
+def measure(serializer_class, objects, repeat):
+    """Best of `repeat` runs, in objects per second"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serializer_class(objects, many=True).data
+        best = min(best, time.perf_counter() - start)
+    return len(objects) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from chat import serializers
+
+    messages, threads = build_objects(args.objects)
+    cases = [
+        ('message', messages, serializers.MessageSerializer, serializers.FastMessageSerializer),
+        ('thread', threads, serializers.ThreadReadSerializer, serializers.FastThreadSerializer),
+        ('inbox thread', threads, serializers.InboxThreadSerializer, serializers.FastInboxThreadSerializer),
+    ]
+    print(f'{"object":<14}{"model objects/s":>18}{"fast objects/s":>18}{"speedup":>10}')
+    for name, objects, model_serializer, fast_serializer in cases:
+        model_rate = measure(model_serializer, objects, args.repeat)
+        fast_rate = measure(fast_serializer, objects, args.repeat)
+        print(f'{name:<14}{model_rate:>18,.0f}{fast_rate:>18,.0f}{fast_rate / model_rate:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
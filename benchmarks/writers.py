@@ -0,0 +1,149 @@
+"""
+Benchmark of concurrent writers on SQLite with the default connection setup against the tuned one.
+
+Seeds a throwaway SQLite database like benchmarks.load and runs writer threads sending messages with Message.save,
+i.e. the transaction of the message create endpoint, alongside reader threads loading message pages. After every
+operation the threads close their connection the way Django does at the end of a request, so CONN_MAX_AGE decides
+whether connections are reused. Each configuration is run on the same database:
+
+* ``default`` - rollback journal, full fsync and a new connection per operation, as Django does out of the box
+* ``tuned`` - SQLITE_PRAGMAS of the project settings with the WAL journal and CONN_MAX_AGE set by simple_chat/wsgi.py
+
+Reports throughput, "database is locked" and other errors and p50/p99 latency of writes and reads.
+
+    python -m benchmarks.writers [--writers 8] [--readers 2] [--operations 200] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import threading
+import time
+
+from benchmarks import setup_django
+from benchmarks.load import add_data_arguments, percentile, seeded_database
+
+
+def get_configurations():
+    from django.conf import settings
+
+    return {
+        'default': {'pragmas': {'journal_mode': 'delete', 'synchronous': 'full'}, 'conn_max_age': 0},
+        'tuned': {
+            'pragmas': {'journal_mode': 'wal', **settings.SQLITE_PRAGMAS},
+            'conn_max_age': 60,
+        },
+    }
+
+
+def run_worker(kind, data, operations, random_seed, samples):
+    from django.db import close_old_connections, connection
+    from django.db.utils import OperationalError
+
+    from chat.models import Message, Thread
+
+    rng = random.Random(random_seed)
+    participants = dict(
+        (thread_id, (one, two)) for thread_id, one, two in
+        Thread.objects.filter(pk__in=data.thread_ids).values_list('id', 'participant_one', 'participant_two')
+    )
+    close_old_connections()
+    for _ in range(operations):
+        thread_id = rng.choice(data.thread_ids)
+        start = time.perf_counter()
+        error = None
+        try:
+            if kind == 'write':
+                Message(thread_id=thread_id, sender_id=rng.choice(participants[thread_id]), text='Benchmark').save()
+            else:
+                list(Message.objects.thread_history(thread_id).order_by('-created_at', '-id')[:20])
+        except OperationalError as exc:
+            error = 'locked' if 'locked' in str(exc) else 'other'
+        samples.append((kind, time.perf_counter() - start, error))
+        # End of a request: closes the connection unless CONN_MAX_AGE keeps it
+        close_old_connections()
+    connection.close()
+
+
+def run_configuration(data, configuration, args):
+    from django.db import connection, connections
+    from django.test.utils import override_settings
+
+    connection.close()
+    connections.settings['default']['CONN_MAX_AGE'] = configuration['conn_max_age']
+    samples = []
+    workers = [
+        threading.Thread(target=run_worker, args=(kind, data, args.operations, args.seed + number, samples))
+        for number, kind in enumerate(['write'] * args.writers + ['read'] * args.readers)
+    ]
+    with override_settings(SQLITE_PRAGMAS=configuration['pragmas']):
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall_time = time.perf_counter() - start
+
+    summary = {}
+    for kind in ('write', 'read'):
+        rows = [sample for sample in samples if sample[0] == kind]
+        if not rows:
+            continue
+        latencies = [row[1] * 1000 for row in rows]
+        succeeded = [row for row in rows if row[2] is None]
+        summary[kind] = {
+            'operations': len(rows),
+            'locked_errors': sum(row[2] == 'locked' for row in rows),
+            'other_errors': sum(row[2] == 'other' for row in rows),
+            'throughput_ops': round(len(succeeded) / wall_time, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8, help='Number of concurrent writer threads')
+    parser.add_argument('--readers', type=int, default=2, help='Number of concurrent reader threads')
+    parser.add_argument('--operations', type=int, default=200, help='Number of operations per thread')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    setup_django()
+    results = {}
+    with seeded_database(args) as data:
+        for name, configuration in get_configurations().items():
+            print(f'Running {args.writers} writers and {args.readers} readers with the {name} configuration...')
+            results[name] = run_configuration(data, configuration, args)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            **{key: value for key, value in vars(args).items() if key not in ('database', 'output')},
+        },
+        'configurations': results,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Results saved to {args.output}')
+
+
+def print_report(report):
+    print(f'{"configuration":<15}{"kind":>6}{"ops":>7}{"locked":>8}{"other":>7}{"ops/s":>9}{"p50 ms":>9}{"p99 ms":>9}')
+    for name, kinds in report['configurations'].items():
+        for kind, row in kinds.items():
+            print(f'{name:<15}{kind:>6}{row["operations"]:>7}{row["locked_errors"]:>8}{row["other_errors"]:>7}'
+                  f'{row["throughput_ops"]:>9}{row["p50_ms"]:>9}{row["p99_ms"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
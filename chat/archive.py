@@ -0,0 +1,313 @@
+"""
+Archival of old messages into compressed per-thread blocks and transparent reads through them.
+
+archive_thread() moves the oldest part of the history of a thread from the message table into ArchivedMessageBlock
+rows. Only messages that are read, older than a threshold and not the last message of the thread are archived, so
+unread counts, marking as read and the inbox keep working on the message table alone. MessageHistory joins
+archived and hot messages of a thread back into one history for the message list.
+"""
+import datetime
+import json
+import zlib
+from bisect import bisect_right
+from itertools import accumulate
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, IntegerField, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from chat.constants import ARCHIVE_BLOCK_SIZE
+from chat.models import ArchivedMessageBlock, Message, READ_MESSAGES, Thread
+from user.models import User
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def pack_messages(messages):
+    """Compress messages into block data; archived messages are read, so is_read is not stored"""
+    rows = [
+        [message.id, message.sender_id, message.text,
+         (message.created_at - EPOCH) // MICROSECOND, (message.updated_at - EPOCH) // MICROSECOND]
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(',', ':'), ensure_ascii=False).encode())
+
+
+def set_block_messages(block, messages):
+    """Store messages, oldest first, in a block"""
+    block.first_created_at = messages[0].created_at
+    block.first_message_id = messages[0].id
+    block.min_message_id = min(message.id for message in messages)
+    block.max_message_id = max(message.id for message in messages)
+    block.message_count = len(messages)
+    block.data = pack_messages(messages)
+
+
+def unpack_block(block):
+    """Return messages of a block, oldest first, as Message instances without their senders loaded"""
+    field_names = [field.attname for field in Message._meta.concrete_fields]
+    messages = []
+    for message_id, sender_id, text, created_at, updated_at in json.loads(zlib.decompress(block.data)):
+        values = {
+            'id': message_id,
+            'sender_id': sender_id,
+            'text': text,
+            'thread_id': block.thread_id,
+            'created_at': EPOCH + created_at * MICROSECOND,
+            'updated_at': EPOCH + updated_at * MICROSECOND,
+        }
+        message = Message.from_db(block._state.db, field_names, [values[name] for name in field_names])
+        message.is_read = True
+        messages.append(message)
+    return messages
+
+
+def load_senders(messages):
+    """Attach senders to messages read from the archive with a single query"""
+    senders = User.objects.in_bulk({message.sender_id for message in messages})
+    for message in messages:
+        message.sender = senders[message.sender_id]
+    return messages
+
+
+class ThreadArchive:
+    """
+    Archived messages of a thread, addressed by their position in the archived part of the history.
+
+    Blocks are listed once without their data, which is loaded and decompressed only for the blocks that are read.
+    """
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self._blocks = None
+        self._messages = {}
+
+    @property
+    def blocks(self):
+        if self._blocks is None:
+            self._blocks = list(
+                ArchivedMessageBlock.objects.filter(thread=self.thread_id).defer('data').order_by(
+                    'first_created_at', 'first_message_id'))
+            self._starts = [0, *accumulate(block.message_count for block in self._blocks)]
+        return self._blocks
+
+    def count(self):
+        return self._starts[-1] if self.blocks else 0
+
+    def block_messages(self, index):
+        if index not in self._messages:
+            self._messages[index] = unpack_block(self.blocks[index])
+        return self._messages[index]
+
+    def slice(self, start, stop):
+        """Return archived messages from position start up to stop, oldest first"""
+        start, stop = max(start, 0), min(stop, self.count())
+        messages = []
+        index = bisect_right(self._starts, start) - 1
+        while start < stop:
+            offset = self._starts[index]
+            block = self.block_messages(index)[start - offset:stop - offset]
+            messages += block
+            start += len(block)
+            index += 1
+        return messages
+
+    def find(self, message_id):
+        """Return the position of an archived message or None"""
+        for index, block in enumerate(self.blocks):
+            if block.min_message_id <= message_id <= block.max_message_id:
+                for position, message in enumerate(self.block_messages(index)):
+                    if message.id == message_id:
+                        return self._starts[index] + position
+        return None
+
+    def __iter__(self):
+        """Iterate over all archived messages, oldest first, holding a single block in memory"""
+        blocks = ArchivedMessageBlock.objects.filter(thread=self.thread_id).order_by(
+            'first_created_at', 'first_message_id')
+        for block in blocks.iterator(chunk_size=1):
+            yield from load_senders(unpack_block(block))
+
+
+class MessageHistory:
+    """
+    Messages of a thread in chronological order: the archived ones followed by the hot ones of ``queryset``.
+
+    Supports what the message list pagination needs: count() and slicing for limit/offset and keyset pages.
+    The archive is only read when a page reaches past the hot messages.
+    """
+
+    def __init__(self, queryset, thread_id):
+        self.queryset = queryset
+        self.thread_id = thread_id
+        self.archive = ThreadArchive(thread_id)
+        self._counts = None
+
+    def counts_queryset(self):
+        hot = self.queryset.order_by().values('thread').annotate(count=Count('pk')).values('count')
+        archived = ArchivedMessageBlock.objects.filter(thread=self.thread_id).order_by().values(
+            'thread').annotate(count=Sum('message_count')).values('count')
+        return Thread.objects.filter(pk=self.thread_id).values_list(
+            Coalesce(Subquery(archived), Value(0), output_field=IntegerField()),
+            Coalesce(Subquery(hot), Value(0), output_field=IntegerField()),
+        )
+
+    def counts(self):
+        """Return numbers of archived and hot messages with a single query"""
+        if self._counts is None:
+            self._counts = self.counts_queryset().first() or (0, 0)
+        return self._counts
+
+    async def acounts(self):
+        if self._counts is None:
+            self._counts = await self.counts_queryset().afirst() or (0, 0)
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    async def acount(self):
+        return sum(await self.acounts())
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('MessageHistory supports slices without step only')
+        archived_count = self.counts()[0]
+        start, stop = item.start or 0, item.stop
+        messages = []
+        if archived_count and start < archived_count:
+            messages = load_senders(self.archive.slice(start, stop))
+        if stop > archived_count:
+            messages += list(self.queryset[max(start - archived_count, 0):stop - archived_count])
+        return messages
+
+    async def aslice(self, start, stop):
+        """Async counterpart of slicing; pages reaching into the archive are read by the sync code in a thread"""
+        archived_count = (await self.acounts())[0]
+        if archived_count and start < archived_count:
+            return await sync_to_async(self.__getitem__)(slice(start, stop))
+        return [message async for message in self.queryset[start - archived_count:stop - archived_count]]
+
+    def keyset_page(self, cursor, newer, size):
+        """
+        Return up to ``size`` messages after (newer) or before the message with id ``cursor``, in the direction of
+        paging, i.e. oldest first for newer messages and newest first for older ones. Without a cursor the newest
+        messages are returned. Returns None if there is no such message in the thread.
+        """
+        if cursor is None:
+            anchor = None
+        else:
+            anchor = self.anchor_queryset(cursor).first()
+            if anchor is None:
+                return self.archived_keyset_page(cursor, newer, size)
+
+        messages = list(self.keyset_queryset(anchor, cursor, newer)[:size])
+        if not newer and len(messages) < size:
+            messages += self.archived_tail(size - len(messages))
+        return messages
+
+    async def akeyset_page(self, cursor, newer, size):
+        """Async counterpart of keyset_page(); pages reaching into the archive are read by the sync code in a
+        thread"""
+        if cursor is None:
+            anchor = None
+        else:
+            anchor = await self.anchor_queryset(cursor).afirst()
+            if anchor is None:
+                return await sync_to_async(self.archived_keyset_page)(cursor, newer, size)
+
+        messages = [message async for message in self.keyset_queryset(anchor, cursor, newer)[:size]]
+        if not newer and len(messages) < size:
+            messages += await sync_to_async(self.archived_tail)(size - len(messages))
+        return messages
+
+    def anchor_queryset(self, cursor):
+        return self.queryset.filter(pk=cursor).values_list('created_at', flat=True)
+
+    def keyset_queryset(self, anchor, cursor, newer):
+        queryset = self.queryset
+        if anchor is not None:
+            # The redundant bound on created_at lets the database seek straight into the index range
+            # instead of walking the whole thread to evaluate the OR.
+            if newer:
+                queryset = queryset.filter(
+                    Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=cursor), created_at__gte=anchor)
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=anchor) | Q(created_at=anchor, id__lt=cursor), created_at__lte=anchor)
+        return queryset.order_by(*(('created_at', 'id') if newer else ('-created_at', '-id')))
+
+    def archived_tail(self, size):
+        """Return up to ``size`` newest archived messages, newest first, for scrolling back past the hot ones"""
+        count = self.archive.count()
+        return load_senders(self.archive.slice(count - size, count)[::-1])
+
+    def archived_keyset_page(self, cursor, newer, size):
+        position = self.archive.find(cursor)
+        if position is None:
+            return None
+        if not newer:
+            return load_senders(self.archive.slice(position - size, position)[::-1])
+        messages = load_senders(self.archive.slice(position + 1, position + 1 + size))
+        if len(messages) < size:
+            messages += list(self.queryset.order_by('created_at', 'id')[:size - len(messages)])
+        return messages
+
+
+def archive_thread(thread, older_than, block_size=ARCHIVE_BLOCK_SIZE):
+    """
+    Move read messages of a thread created before ``older_than`` into archived blocks and return their number.
+
+    Only the oldest messages up to the first one that cannot be archived are moved, so that the archive always
+    holds a prefix of the history. The last block of the thread is refilled before new blocks are added.
+    """
+    messages = Message.objects.filter(thread=thread.pk)
+    # The first message that has to stay in the message table ends the archivable part of the history
+    boundary = messages.filter(
+        ~READ_MESSAGES | Q(created_at__gte=older_than) | Q(pk=thread.last_message_id)).order_by(
+        'created_at', 'id').values_list('created_at', 'id').first()
+    if boundary is not None:
+        created_at, message_id = boundary
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id), created_at__lte=created_at)
+    messages = messages.order_by('created_at', 'id')
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            last_block = ArchivedMessageBlock.objects.filter(thread=thread.pk).order_by(
+                '-first_created_at', '-first_message_id').first()
+            if last_block is not None and last_block.message_count < block_size:
+                # Compact the partly filled last block with the newly archived messages
+                archived_messages = unpack_block(last_block)
+                last_block.delete()
+            else:
+                archived_messages = []
+            size = block_size - len(archived_messages)
+            batch = list(messages[:size])
+            if not batch:
+                # Nothing to archive, keep the last block as it was
+                transaction.set_rollback(True)
+                return archived
+            archived_messages += batch
+            block = ArchivedMessageBlock(thread_id=thread.pk)
+            set_block_messages(block, archived_messages)
+            block.save()
+            Message.objects.filter(pk__in=[message.id for message in batch]).delete()
+        archived += len(batch)
+        if len(batch) < size:
+            return archived
+
+
+def archive_messages(older_than, block_size=ARCHIVE_BLOCK_SIZE):
+    """Archive old messages of all threads; return numbers of archived messages and of threads they belong to"""
+    archived = threads = 0
+    thread_ids = Message.objects.filter(created_at__lt=older_than).read().values('thread').distinct()
+    for thread in Thread.objects.filter(pk__in=thread_ids).only('last_message').iterator():
+        count = archive_thread(thread, older_than, block_size)
+        if count:
+            archived += count
+            threads += 1
+    return archived, threads
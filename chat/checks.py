@@ -0,0 +1,29 @@
+from django.core.checks import register, Tags, Warning
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+
+from chat.search import missing_search_index_triggers
+
+SEARCH_INDEX_MIGRATION = ('chat', '0007_message_search_index')
+
+
+@register(Tags.database)
+def check_search_index_triggers(app_configs, databases=None, **kwargs):
+    """Report triggers of the search index dropped by a rebuild of the message table"""
+    warnings = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        # The triggers only exist once the migration installing them has run
+        if SEARCH_INDEX_MIGRATION not in MigrationRecorder(connection).applied_migrations():
+            continue
+        missing = missing_search_index_triggers(alias)
+        if missing:
+            warnings.append(Warning(
+                f'Search index triggers {", ".join(missing)} are missing on the message table of database '
+                f'{alias!r}, so search no longer follows writes',
+                hint='Recreate them with SEARCH_INDEX_TRIGGERS of chat/migrations/0007_message_search_index.py',
+                id='chat.W001',
+            ))
+    return warnings
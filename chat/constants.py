@@ -1 +1,12 @@
 NUM_OF_ITEMS_PER_PAGE = 10
+LONG_POLL_DEFAULT_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 60
+MAX_MESSAGES_PER_BATCH = 500
+EXPORT_CHUNK_SIZE = 2000
+ARCHIVE_BLOCK_SIZE = 500
+ARCHIVE_AFTER_DAYS = 90
+PRESENCE_TIMEOUT = 60
+TYPING_TIMEOUT = 6
+MAX_THREADS_PER_PRESENCE_QUERY = 100
+PURGE_BATCH_SIZE = 1000
+PURGE_PAUSE = 0.1
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Q
+from rest_framework import exceptions
+
+from chat.models import Thread
+from chat.pubsub import get_pubsub, thread_channel
+from user.authentication import CachedTokenAuthentication
+
+# Application specific close codes (4000-4999) mirroring the HTTP status codes
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+
+
+class ThreadConsumer:
+    """
+    ASGI application pushing new messages and read state changes of a thread to a WebSocket client.
+
+    The client authenticates with its API token either in a ``token`` query parameter or in an
+    ``Authorization: Token <key>`` header and must be a participant of the thread.
+    """
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        thread_id = scope['url_route']['kwargs']['thread_id']
+        user = await sync_to_async(self.authenticate)(scope)
+        if user is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+        if not await sync_to_async(self.is_participant)(user, thread_id):
+            await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+            return
+
+        async with get_pubsub().subscribe(thread_channel(thread_id)) as subscription:
+            await send({'type': 'websocket.accept'})
+            disconnect = asyncio.ensure_future(self.wait_for_disconnect(receive))
+            try:
+                while True:
+                    event = asyncio.ensure_future(subscription.get())
+                    await asyncio.wait({event, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                    if disconnect.done():
+                        event.cancel()
+                        break
+                    await send({
+                        'type': 'websocket.send',
+                        'text': json.dumps(event.result(), cls=DjangoJSONEncoder),
+                    })
+            finally:
+                disconnect.cancel()
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        """Consume incoming frames, which carry nothing for us, until the client goes away"""
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+
+    @staticmethod
+    def get_token(scope):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if token:
+            return token[0]
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                keyword, _, key = value.decode().partition(' ')
+                if keyword == CachedTokenAuthentication.keyword and key:
+                    return key
+        return None
+
+    def authenticate(self, scope):
+        close_old_connections()
+        key = self.get_token(scope)
+        if key is None:
+            return None
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
+            return None
+        return user
+
+    @staticmethod
+    def is_participant(user, thread_id):
+        return Thread.objects.filter(Q(participant_one=user) | Q(participant_two=user), pk=thread_id).exists()
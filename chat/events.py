@@ -0,0 +1,37 @@
+from django.db import transaction
+
+from chat.pubsub import get_pubsub, thread_channel
+from chat.serializers import FastMessageSerializer
+
+MESSAGE_CREATED = 'message.created'
+MESSAGE_READ = 'message.read'
+THREAD_READ = 'thread.read'
+
+
+def publish(thread_id, event):
+    """Publish an event to subscribers of a thread once the current transaction is committed"""
+    transaction.on_commit(lambda: get_pubsub().publish(thread_channel(thread_id), event))
+
+
+def publish_message_created(message):
+    publish(message.thread_id, {
+        'type': MESSAGE_CREATED,
+        'thread': message.thread_id,
+        'message': FastMessageSerializer(message).data,
+    })
+
+
+def publish_message_read(message):
+    publish(message.thread_id, {
+        'type': MESSAGE_READ,
+        'thread': message.thread_id,
+        'message': message.id,
+    })
+
+
+def publish_thread_read(thread_id, up_to):
+    publish(thread_id, {
+        'type': THREAD_READ,
+        'thread': thread_id,
+        'up_to': up_to,
+    })
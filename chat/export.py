@@ -0,0 +1,43 @@
+"""
+Streaming export of thread history as NDJSON, one message per line in chronological order.
+
+Messages are read in chunks with QuerySet.iterator() and rendered one chunk at a time, so memory use does not depend
+on the size of the thread. Archived messages are read a block at a time before the ones in the message table.
+"""
+import json
+import zlib
+from itertools import chain
+
+from django.utils import timezone
+
+from chat.archive import ThreadArchive
+from chat.constants import EXPORT_CHUNK_SIZE
+from chat.models import Message
+from chat.serializers import message_serializer
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+GZIP_CONTENT_TYPE = 'application/gzip'
+
+
+def export_thread_messages(thread_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield messages of a thread as NDJSON encoded to bytes, a chunk of lines at a time"""
+    messages = Message.objects.thread_history(thread_id)
+    tz = timezone.get_current_timezone()
+    lines = []
+    for message in chain(ThreadArchive(thread_id), messages.iterator(chunk_size=chunk_size)):
+        lines.append(json.dumps(message_serializer.render(message, tz), ensure_ascii=False))
+        if len(lines) == chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzip_stream(chunks):
+    """Compress a stream of bytes into a gzip stream without holding it in memory"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
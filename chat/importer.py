@@ -0,0 +1,269 @@
+"""
+Bulk import of users, threads and messages from JSONL, one record per line::
+
+    {"type": "user", "id": "u1", "email": "ann@example.com", "first_name": "Ann", "last_name": "Lee",
+     "password": "<Django password hash, optional>"}
+    {"type": "thread", "id": "t1", "participants": ["u1", "u2"], "created_at": "<ISO 8601, optional>"}
+    {"type": "message", "id": "m1", "thread": "t1", "sender": "u1", "text": "Hi", "is_read": false,
+     "created_at": "<ISO 8601, optional>"}
+
+Ids are the ones of the previous system and are only used to resolve references, which must point to records
+earlier in the input. Users whose email already exists and threads whose pair already exists are reused instead
+of being duplicated. Rows are inserted with bulk_create, a batch per transaction, and the number of the last
+committed line is saved to a checkpoint file so that an interrupted import can be resumed.
+"""
+import datetime
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Message, Thread
+from core.cache import bump_versions, USERS_SCOPE
+from core.models import keep_timestamps
+from user.models import User
+
+LOOKUP_BATCH_SIZE = 500
+
+
+class InvalidRecord(Exception):
+    """Invalid input line, reported with its number"""
+
+    def __init__(self, line_number, message):
+        super().__init__(f'Line {line_number}: {message}')
+
+
+def bulk_create_keeping_timestamps(model, objs):
+    """bulk_create objects with the created_at and updated_at they were given instead of the current time"""
+    return model.objects.bulk_create(keep_timestamps(obj) for obj in objs)
+
+
+def chunks(items, size=LOOKUP_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_users(emails):
+    """Return {email: user id} of users that already exist"""
+    users = {}
+    for batch in chunks(emails):
+        users.update(User.objects.filter(email__in=batch).values_list('email', 'id'))
+    return users
+
+
+def existing_threads(pairs):
+    """Return {(participant one id, participant two id): thread id} of canonical pairs that already exist"""
+    pairs = set(pairs)
+    threads = {}
+    for batch in chunks({participant_one for participant_one, _ in pairs}):
+        rows = Thread.objects.filter(participant_one__in=batch).values_list('participant_one', 'participant_two', 'id')
+        threads.update(((one, two), thread_id) for one, two, thread_id in rows if (one, two) in pairs)
+    return threads
+
+
+class Importer:
+    """Import records read from JSONL lines, see the module docstring for the format"""
+
+    def __init__(self, batch_size=5000, checkpoint=None, progress=None):
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+        # Ids of the input mapped to ids in the database
+        self.user_ids = {}
+        self.thread_ids = {}
+        self.imported = 0
+        self.pending = []
+        self.line_number = 0
+
+    def run(self, lines, resume=False):
+        """Import all lines; with ``resume``, skip the lines committed by a previous run"""
+        start_line = self.read_checkpoint() if resume else 0
+        started = time.perf_counter()
+        skipped = []
+        for self.line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            record = self.parse(line)
+            if self.line_number <= start_line:
+                if record['type'] in ('user', 'thread'):
+                    skipped.append((self.line_number, record))
+                continue
+            if skipped:
+                self.restore_ids(skipped)
+                skipped = []
+            self.pending.append((self.line_number, record))
+            if len(self.pending) >= self.batch_size:
+                self.flush(started)
+        if skipped:
+            self.restore_ids(skipped)
+        self.flush(started)
+        return self.imported
+
+    def parse(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise InvalidRecord(self.line_number, f'invalid JSON: {error}')
+        if not isinstance(record, dict) or record.get('type') not in ('user', 'thread', 'message'):
+            raise InvalidRecord(self.line_number, 'type must be one of user, thread and message')
+        return record
+
+    def flush(self, started):
+        """Insert pending records in a single transaction and save the checkpoint after the commit"""
+        if not self.pending:
+            return
+        records = {'user': [], 'thread': [], 'message': []}
+        for line_number, record in self.pending:
+            records[record['type']].append((line_number, record))
+        with transaction.atomic():
+            self.import_users(records['user'])
+            thread_ids = self.import_threads(records['thread']) | self.import_messages(records['message'])
+            # Bulk inserts send no post_save signals, which would invalidate the cached lists
+            for batch in chunks(thread_ids):
+                threads = Thread.objects.filter(pk__in=batch)
+                threads.refresh_last_message()
+                threads.invalidate_cached_responses()
+        self.imported += len(self.pending)
+        self.pending = []
+        self.write_checkpoint(self.line_number)
+        if self.progress:
+            elapsed = time.perf_counter() - started
+            self.progress(self.imported, self.imported / elapsed if elapsed else 0)
+
+    def import_users(self, records):
+        users = {}
+        for line_number, record in records:
+            email = User.objects.normalize_email(self.get(record, 'email', line_number))
+            created_at = self.get_datetime(record, line_number)
+            users[self.get(record, 'id', line_number)] = User(
+                email=email,
+                first_name=record.get('first_name', ''),
+                last_name=record.get('last_name', ''),
+                # Passwords are imported as hashes; users without one have to reset it
+                password=record.get('password') or make_password(None),
+                is_active=record.get('is_active', True),
+                created_at=created_at,
+                updated_at=created_at,
+            )
+        existing = existing_users(user.email for user in users.values())
+        new_users = {}
+        for external_id, user in users.items():
+            if user.email in existing:
+                self.user_ids[external_id] = existing[user.email]
+            else:
+                new_users.setdefault(user.email, []).append(external_id)
+        created = bulk_create_keeping_timestamps(User, (users[external_ids[0]] for external_ids in new_users.values()))
+        for user in created:
+            for external_id in new_users[user.email]:
+                self.user_ids[external_id] = user.id
+        if created:
+            bump_versions([USERS_SCOPE])
+
+    def import_threads(self, records):
+        """Import threads and return ids of the created ones"""
+        threads = {}
+        for line_number, record in records:
+            participants = self.get(record, 'participants', line_number)
+            if not isinstance(participants, list) or len(participants) != 2:
+                raise InvalidRecord(line_number, 'participants must be a list of two users')
+            pair = tuple(sorted(self.resolve(self.user_ids, participant, line_number) for participant in participants))
+            if pair[0] == pair[1]:
+                raise InvalidRecord(line_number, 'participants must be different users')
+            created_at = self.get_datetime(record, line_number)
+            threads.setdefault(pair, (created_at, []))[1].append(self.get(record, 'id', line_number))
+        existing = existing_threads(threads)
+        new_pairs = [pair for pair in threads if pair not in existing]
+        created = bulk_create_keeping_timestamps(Thread, (
+            Thread(participant_one_id=one, participant_two_id=two, created_at=threads[one, two][0],
+                   updated_at=threads[one, two][0])
+            for one, two in new_pairs
+        ))
+        existing.update((pair, thread.id) for pair, thread in zip(new_pairs, created))
+        for pair, (_, external_ids) in threads.items():
+            for external_id in external_ids:
+                self.thread_ids[external_id] = existing[pair]
+        return {thread.id for thread in created}
+
+    def import_messages(self, records):
+        """Import messages and return ids of their threads"""
+        messages = []
+        for line_number, record in records:
+            created_at = self.get_datetime(record, line_number)
+            messages.append(Message(
+                thread_id=self.resolve(self.thread_ids, self.get(record, 'thread', line_number), line_number),
+                sender_id=self.resolve(self.user_ids, self.get(record, 'sender', line_number), line_number),
+                text=record.get('text', ''),
+                is_read=bool(record.get('is_read', False)),
+                created_at=created_at,
+                updated_at=created_at,
+            ))
+        bulk_create_keeping_timestamps(Message, messages)
+        Thread.objects.advance_read_marks([message for message in messages if message.is_read])
+        return {message.thread_id for message in messages}
+
+    def restore_ids(self, records):
+        """Map ids of users and threads imported by a previous run from the skipped part of the input"""
+        emails = {}
+        for line_number, record in records:
+            if record['type'] == 'user':
+                email = self.get(record, 'email', line_number)
+                emails[self.get(record, 'id', line_number)] = User.objects.normalize_email(email)
+        existing = existing_users(emails.values())
+        self.user_ids.update(
+            (external_id, existing[email]) for external_id, email in emails.items() if email in existing)
+
+        pairs = {}
+        for line_number, record in records:
+            if record['type'] == 'thread':
+                participants = self.get(record, 'participants', line_number)
+                pairs[self.get(record, 'id', line_number)] = tuple(sorted(
+                    self.resolve(self.user_ids, participant, line_number) for participant in participants))
+        existing = existing_threads(pairs.values())
+        self.thread_ids.update(
+            (external_id, existing[pair]) for external_id, pair in pairs.items() if pair in existing)
+
+    @staticmethod
+    def get(record, key, line_number):
+        try:
+            return record[key]
+        except KeyError:
+            raise InvalidRecord(line_number, f'{record["type"]} has no {key}')
+
+    @staticmethod
+    def resolve(ids, external_id, line_number):
+        try:
+            return ids[external_id]
+        except KeyError:
+            raise InvalidRecord(line_number, f'unknown id {external_id!r}, records must follow the ones they refer to')
+
+    @staticmethod
+    def get_datetime(record, line_number):
+        value = record.get('created_at')
+        if value is None:
+            return timezone.now()
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+        if parsed is None:
+            raise InvalidRecord(line_number, f'invalid created_at {value!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+        return parsed
+
+    def read_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as checkpoint:
+            return json.load(checkpoint)['line']
+
+    def write_checkpoint(self, line_number):
+        if not self.checkpoint:
+            return
+        # Replace the file atomically so that an interruption never leaves a partial checkpoint behind
+        path = f'{self.checkpoint}.tmp'
+        with open(path, 'w') as checkpoint:
+            json.dump({'line': line_number}, checkpoint)
+        os.replace(path, self.checkpoint)
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_messages
+from chat.constants import ARCHIVE_AFTER_DAYS, ARCHIVE_BLOCK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Move old read messages out of the message table into compressed per-thread archive blocks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help='Archive messages created more than this number of days ago',
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=ARCHIVE_BLOCK_SIZE,
+            help='Number of messages stored per archive block',
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - datetime.timedelta(days=options['older_than_days'])
+        archived, threads = archive_messages(older_than, block_size=options['block_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} messages of {threads} threads'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.constants import EXPORT_CHUNK_SIZE
+from chat.export import export_thread_messages, gzip_stream
+from chat.models import Thread
+
+
+class Command(BaseCommand):
+    help = 'Export all messages of a thread as NDJSON, one message per line in chronological order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('thread_id', type=int)
+        parser.add_argument('--output', help='File to write the export to instead of standard output')
+        parser.add_argument('--gzip', action='store_true', help='Compress the export with gzip, requires --output')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Number of messages read from the database at a time',
+        )
+
+    def handle(self, *args, **options):
+        thread_id = options['thread_id']
+        if options['gzip'] and not options['output']:
+            raise CommandError('--gzip requires --output')
+        if not Thread.objects.filter(pk=thread_id).exists():
+            raise CommandError(f'Thread No.{thread_id} does not exist')
+
+        stream = export_thread_messages(thread_id, chunk_size=options['chunk_size'])
+        if options['gzip']:
+            stream = gzip_stream(stream)
+        if not options['output']:
+            for chunk in stream:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+
+        with open(options['output'], 'wb') as output:
+            for chunk in stream:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Exported thread No.{thread_id} to {options["output"]}'))
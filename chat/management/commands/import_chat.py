@@ -0,0 +1,48 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.importer import Importer, InvalidRecord
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users, threads and messages from a JSONL file (gzip compressed if it ends with .gz). '
+        'See chat/importer.py for the format of the records'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSONL file to import')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of records inserted per transaction',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File to save the last committed line to, <input>.checkpoint by default',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted import after the line saved in the checkpoint',
+        )
+
+    def handle(self, *args, **options):
+        path = options['input']
+        importer = Importer(
+            batch_size=options['batch_size'],
+            checkpoint=options['checkpoint'] or f'{path}.checkpoint',
+            progress=self.report_progress,
+        )
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as lines:
+                imported = importer.run(lines, resume=options['resume'])
+        except (OSError, InvalidRecord) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} records'))
+
+    def report_progress(self, imported, rate):
+        self.stdout.write(f'{imported} records imported, {rate:.0f} rows/s')
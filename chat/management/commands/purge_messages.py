@@ -0,0 +1,64 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.constants import PURGE_BATCH_SIZE, PURGE_PAUSE
+from chat.retention import Purger
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete messages older than the retention period, including archived ones, in short batches that leave '
+        'the database to other writers in between'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=settings.MESSAGE_RETENTION_DAYS,
+            help='Delete messages created more than this number of days ago, MESSAGE_RETENTION_DAYS by default',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PURGE_BATCH_SIZE,
+            help='Number of message ids covered by a transaction',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=PURGE_PAUSE,
+            help='Seconds to sleep after every transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the messages that would be deleted without deleting them',
+        )
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] is None:
+            raise CommandError('Set MESSAGE_RETENTION_DAYS or pass --older-than-days')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+        if options['pause'] < 0:
+            raise CommandError('--pause must not be negative')
+        older_than = timezone.now() - datetime.timedelta(days=options['older_than_days'])
+        purger = Purger(
+            older_than,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            dry_run=options['dry_run'],
+            progress=self.report_progress,
+        )
+        purged = purger.run()
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would purge {purged} messages created before {older_than:%Y-%m-%d}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} messages created before {older_than:%Y-%m-%d}'))
+
+    def report_progress(self, purged, rate):
+        self.stdout.write(f'{purged} messages, {rate:.0f} rows/s')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from chat.search import optimize_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--optimize',
+            action='store_true',
+            help='Only merge the index segments instead of reindexing all messages',
+        )
+
+    def handle(self, *args, **options):
+        if options['optimize']:
+            optimize_search_index()
+            self.stdout.write(self.style.SUCCESS('Optimized the search index'))
+            return
+
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the search index'))
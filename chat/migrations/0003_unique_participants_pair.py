@@ -0,0 +1,35 @@
+# Generated by Django 5.0 on 2026-10-17 06:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def canonicalize_participants(apps, schema_editor):
+    """Store every existing pair with the lower user id as participant one"""
+    Thread = apps.get_model("chat", "Thread")
+    Thread.objects.using(schema_editor.connection.alias).filter(
+        participant_one__gt=models.F("participant_two")
+    ).update(
+        participant_one=models.F("participant_two"),
+        participant_two=models.F("participant_one"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_message_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_participants, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="thread",
+            constraint=models.UniqueConstraint(
+                fields=("participant_one", "participant_two"),
+                name="unique_participants_pair",
+                violation_error_message="The pair of Participant one and Participant two already exists",
+            ),
+        ),
+    ]
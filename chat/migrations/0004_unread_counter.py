@@ -0,0 +1,79 @@
+# Generated by Django 5.0 on 2026-10-17 06:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_unread_counters(apps, schema_editor):
+    """Count unread messages per sender and thread for already existing messages"""
+    Message = apps.get_model("chat", "Message")
+    UnreadCounter = apps.get_model("chat", "UnreadCounter")
+    db_alias = schema_editor.connection.alias
+    rows = (
+        Message.objects.using(db_alias)
+        .filter(is_read=False)
+        .order_by()
+        .values("sender", "thread")
+        .annotate(count=models.Count("id"))
+    )
+    UnreadCounter.objects.using(db_alias).bulk_create(
+        (
+            UnreadCounter(user_id=row["sender"], thread_id=row["thread"], count=row["count"])
+            for row in rows
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0003_unique_participants_pair"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "thread",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="unread_counters",
+                        to="chat.thread",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="unread_counters",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Unread counter",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="unreadcounter",
+            constraint=models.UniqueConstraint(
+                fields=("user", "thread"), name="unique_unread_counter"
+            ),
+        ),
+        migrations.RunPython(populate_unread_counters, migrations.RunPython.noop),
+    ]
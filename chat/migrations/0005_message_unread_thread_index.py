@@ -0,0 +1,21 @@
+# Generated by Django 5.0 on 2026-10-17 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_unread_counter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["thread", "id"],
+                name="message_unread_thread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0 on 2026-10-17 06:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_last_message(apps, schema_editor):
+    """Fill last message of already existing threads"""
+    Message = apps.get_model("chat", "Message")
+    Thread = apps.get_model("chat", "Thread")
+    db_alias = schema_editor.connection.alias
+    last_message = Message.objects.using(db_alias).filter(
+        thread=models.OuterRef("pk")
+    ).order_by("-created_at", "-id")
+    Thread.objects.using(db_alias).update(
+        last_message=models.Subquery(last_message.values("id")[:1]),
+        last_message_at=models.Subquery(last_message.values("created_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_message_unread_thread_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="chat.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0 on 2026-10-17 06:40
+
+from django.db import migrations
+
+# External content FTS5 table: the index stores only the tokens and reads message text from chat_message.
+# Triggers keep it in sync with every write, including bulk_create() and raw SQL. Updates of other columns,
+# e.g. is_read, do not touch the index.
+# Table rebuilds of later migrations (AddField, AlterField on SQLite) drop the triggers; such migrations recreate
+# them with these statements, which are no-ops when the triggers are still there.
+SEARCH_INDEX_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF text ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        text,
+        content='chat_message',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    *SEARCH_INDEX_TRIGGERS,
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TABLE chat_message_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_thread_last_message"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH_INDEX, DROP_SEARCH_INDEX),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0 on 2026-10-17 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_message_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedMessageBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_created_at", models.DateTimeField()),
+                ("first_message_id", models.BigIntegerField()),
+                ("min_message_id", models.BigIntegerField()),
+                ("max_message_id", models.BigIntegerField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                (
+                    "thread",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_message_blocks",
+                        to="chat.thread",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Archived message block",
+                "indexes": [
+                    models.Index(
+                        fields=["thread", "first_created_at", "first_message_id"],
+                        name="archived_block_thread_idx",
+                    )
+                ],
+            },
+        ),
+    ]
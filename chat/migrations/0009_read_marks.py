@@ -0,0 +1,120 @@
+# Generated by Django 5.0 on 2026-10-17 07:43
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Greatest
+
+SEARCH_INDEX_TRIGGERS = import_module("chat.migrations.0007_message_search_index").SEARCH_INDEX_TRIGGERS
+
+
+def populate_read_marks(apps, schema_editor):
+    """
+    Set read marks of participants to their last read message of the other participant. Archived messages are all
+    read, so the marks reach at least the end of the archive.
+    """
+    Message = apps.get_model("chat", "Message")
+    Thread = apps.get_model("chat", "Thread")
+    ArchivedMessageBlock = apps.get_model("chat", "ArchivedMessageBlock")
+    db_alias = schema_editor.connection.alias
+    read = Message.objects.using(db_alias).filter(thread=models.OuterRef("pk"), is_read=True).order_by("-id")
+    archived = ArchivedMessageBlock.objects.using(db_alias).filter(thread=models.OuterRef("pk")).order_by(
+        "-max_message_id"
+    )
+    archived_last_id = Coalesce(models.Subquery(archived.values("max_message_id")[:1]), 0)
+    Thread.objects.using(db_alias).update(
+        participant_one_last_read_id=Greatest(
+            Coalesce(
+                models.Subquery(read.exclude(sender=models.OuterRef("participant_one")).values("id")[:1]), 0
+            ),
+            archived_last_id,
+        ),
+        participant_two_last_read_id=Greatest(
+            Coalesce(
+                models.Subquery(read.exclude(sender=models.OuterRef("participant_two")).values("id")[:1]), 0
+            ),
+            archived_last_id,
+        ),
+    )
+
+
+def populate_read_flags(apps, schema_editor):
+    """Flag messages up to the read marks of the participants other than their senders as read"""
+    Message = apps.get_model("chat", "Message")
+    Thread = apps.get_model("chat", "Thread")
+    db_alias = schema_editor.connection.alias
+    for thread in Thread.objects.using(db_alias).iterator():
+        Message.objects.using(db_alias).filter(
+            models.Q(~models.Q(sender=thread.participant_one_id), id__lte=thread.participant_one_last_read_id)
+            | models.Q(~models.Q(sender=thread.participant_two_id), id__lte=thread.participant_two_last_read_id),
+            thread=thread.pk,
+        ).update(is_read=True)
+
+
+def populate_unread_counters(apps, schema_editor):
+    """Count unread messages per sender and thread"""
+    Message = apps.get_model("chat", "Message")
+    UnreadCounter = apps.get_model("chat", "UnreadCounter")
+    db_alias = schema_editor.connection.alias
+    rows = (
+        Message.objects.using(db_alias)
+        .filter(is_read=False)
+        .order_by()
+        .values("sender", "thread")
+        .annotate(count=models.Count("id"))
+    )
+    UnreadCounter.objects.using(db_alias).bulk_create(
+        (
+            UnreadCounter(user_id=row["sender"], thread_id=row["thread"], count=row["count"])
+            for row in rows
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_archived_message_block"),
+    ]
+
+    operations = [
+        # Unread counts are derived from the read marks; when migrating backwards the counters are recreated
+        # from the read flags, which are restored by then
+        migrations.RunPython(migrations.RunPython.noop, populate_unread_counters),
+        migrations.DeleteModel(
+            name="UnreadCounter",
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="participant_one_last_read_id",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="participant_two_last_read_id",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_read_marks, populate_read_flags),
+        migrations.RemoveIndex(
+            model_name="message",
+            name="message_unread_sender_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="message",
+            name="message_unread_thread_idx",
+        ),
+        # Re-adding is_read when migrating backwards rebuilds the message table, which drops the triggers of the
+        # search index; this recreates them afterwards
+        migrations.RunSQL(migrations.RunSQL.noop, SEARCH_INDEX_TRIGGERS),
+        migrations.RemoveField(
+            model_name="message",
+            name="is_read",
+        ),
+        # Dropping the column does not rebuild the table on SQLite 3.35+, but older versions do
+        migrations.RunSQL(SEARCH_INDEX_TRIGGERS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["thread", "id", "sender"], name="message_thread_id_sender_idx"),
+        ),
+    ]
@@ -1,14 +1,131 @@
-from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import F, Q
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, Max, OuterRef, Q, \
+    Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
 
+from core.cache import bump_versions, user_scope
 from core.models import TimeStampMixin
 from user.models import User
 
 
+class ThreadQuerySet(models.QuerySet):
+
+    def get_or_create_for_pair(self, participant_one, participant_two):
+        """Retrieve the thread of a pair of users or create it, regardless of the order of the users"""
+        participant_one, participant_two = sorted((participant_one, participant_two), key=lambda user: user.pk)
+        # A single indexed lookup for an existing thread; a concurrent create of the same pair is
+        # resolved by the unique constraint and get_or_create retrying the lookup
+        thread, created = self.get_or_create(participant_one=participant_one, participant_two=participant_two)
+        # Reuse the users we already have instead of fetching them again through the relations
+        thread.participant_one, thread.participant_two = participant_one, participant_two
+        return thread, created
+
+    def inbox(self, user_id, viewer):
+        """
+        Threads of a user with their last message and number of unread messages of the viewer, most recently
+        active threads first
+        """
+        return self.filter(Q(participant_one=user_id) | Q(participant_two=user_id)).select_related(
+            'participant_one', 'participant_two', 'last_message__sender', 'last_message__thread').with_unread_count(
+            viewer).order_by(F('last_message_at').desc(nulls_last=True), '-id')
+
+    def with_unread_count(self, user):
+        """
+        Annotate number_of_unread_messages: messages sent by the user that the other participant has not read yet.
+        Only the messages after the read mark are counted, by a range scan of the (thread, id, sender) index.
+        """
+        others_last_read_id = Case(
+            When(participant_one=user, then=F('participant_two_last_read_id')),
+            When(participant_two=user, then=F('participant_one_last_read_id')),
+            default=Greatest('participant_one_last_read_id', 'participant_two_last_read_id'),
+        )
+        unread = Message.objects.filter(
+            thread=OuterRef('pk'), id__gt=OuterRef('others_last_read_id'), sender=user).order_by().values(
+            'thread').annotate(count=Count('id')).values('count')
+        return self.alias(others_last_read_id=others_last_read_id).annotate(
+            number_of_unread_messages=Coalesce(Subquery(unread), 0, output_field=IntegerField()))
+
+    def unread_counts(self, user):
+        """(thread id, number of unread messages sent by the user) of the threads of the user with unread messages"""
+        return self.filter(Q(participant_one=user) | Q(participant_two=user)).with_unread_count(user).filter(
+            number_of_unread_messages__gt=0).order_by('pk').values_list('pk', 'number_of_unread_messages')
+
+    def of_participant(self, user):
+        """Threads the user takes part in"""
+        return self.filter(Q(participant_one=user) | Q(participant_two=user))
+
+    def participants_of(self, thread_ids, user):
+        """Return {thread id: (participant one id, participant two id)} of those of the threads the user is in"""
+        threads = self.of_participant(user).filter(pk__in=thread_ids)
+        return {thread_id: (one, two) for thread_id, one, two in
+                threads.values_list('id', 'participant_one', 'participant_two')}
+
+    def mark_read(self, thread_id, user, up_to):
+        """
+        Move the read mark of a participant of a thread to message ``up_to`` and return the number of messages of
+        others that became read, or None if the user does not take part in the thread.
+
+        The mark only moves forward and never past the last message of others up to ``up_to``, so that messages
+        sent later do not start out read. The state changes with a single-row UPDATE of the thread.
+        """
+        with transaction.atomic(using=self.db):
+            thread = self.filter(Q(participant_one=user) | Q(participant_two=user), pk=thread_id).first()
+            if thread is None:
+                return None
+            field = thread.last_read_field(user.pk)
+            newly_read = Message.objects.using(self.db).filter(
+                thread=thread_id, id__gt=getattr(thread, field), id__lte=up_to).exclude(sender=user).aggregate(
+                count=Count('id'), last=Max('id'))
+            if newly_read['count']:
+                self.filter(pk=thread_id).update(**{field: Greatest(F(field), Value(newly_read['last']))})
+                invalidate_cached_threads([thread])
+        return newly_read['count']
+
+    def advance_read_marks(self, messages):
+        """Move read marks so that messages are read by the participants other than their senders, e.g. to carry
+        read flags of imported messages over"""
+        threads = self.in_bulk({message.thread_id for message in messages})
+        for message in messages:
+            thread = threads[message.thread_id]
+            for participant_id in (thread.participant_one_id, thread.participant_two_id):
+                if participant_id != message.sender_id:
+                    field = thread.last_read_field(participant_id)
+                    setattr(thread, field, max(getattr(thread, field), message.id))
+        self.bulk_update(threads.values(), ['participant_one_last_read_id', 'participant_two_last_read_id'])
+
+    def refresh_last_message(self):
+        """Recompute last message of threads from their messages, e.g. after messages were bulk inserted or deleted"""
+        last_message = Message.objects.filter(thread=OuterRef('pk')).order_by('-created_at', '-id')
+        return self.update(
+            last_message=Subquery(last_message.values('id')[:1]),
+            last_message_at=Subquery(last_message.values('created_at')[:1]),
+        )
+
+    def invalidate_cached_responses(self):
+        """Invalidate cached thread lists of participants of the threads"""
+        bump_versions(user_scope(user_id) for pair in self.values_list('participant_one', 'participant_two')
+                      for user_id in pair)
+
+
+def invalidate_cached_threads(threads):
+    """Invalidate cached thread lists of participants of thread instances without a query"""
+    bump_versions(user_scope(user_id) for thread in threads
+                  for user_id in (thread.participant_one_id, thread.participant_two_id))
+
+
 class Thread(TimeStampMixin):
     participant_one = models.ForeignKey(User, related_name='participant_one_threads', on_delete=models.CASCADE)
     participant_two = models.ForeignKey(User, related_name='participant_two_threads', on_delete=models.CASCADE)
+    # Denormalized from messages so that the inbox needs neither a subquery per thread nor a request per preview
+    last_message = models.ForeignKey(
+        'Message', related_name='+', null=True, blank=True, editable=False, on_delete=models.SET_NULL)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Read marks: a participant has read all messages of others up to the message with this id (0 for none). Not a
+    # foreign key, since the message may be archived.
+    participant_one_last_read_id = models.BigIntegerField(default=0, editable=False)
+    participant_two_last_read_id = models.BigIntegerField(default=0, editable=False)
+
+    objects = ThreadQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -18,32 +135,154 @@ class Thread(TimeStampMixin):
                 check=~Q(participant_one=F('participant_two')),
                 violation_error_message=f'Participant one and Participant two should be different',
             ),
+            # Pairs are stored in canonical order (see save), so this also covers the reversed pair
+            models.UniqueConstraint(
+                fields=['participant_one', 'participant_two'],
+                name='unique_participants_pair',
+                violation_error_message='The pair of Participant one and Participant two already exists',
+            ),
         ]
         verbose_name = 'Thread'
 
     def save(self, *args, **kwargs):
         # To ensure that Participant one and Participant two make a unique pair
-        # participant_one=A and participant_two=B is the same pair as participant_one=B and participant_two=A
-        if (Thread.objects.filter(
-                participant_one=self.participant_one).filter(participant_two=self.participant_two).exists() or
-                Thread.objects.filter(
-                    participant_one=self.participant_two).filter(participant_two=self.participant_one).exists()):
-            raise ValidationError('The pair of Participant one and Participant two already exists')
-        else:
-            super().save(*args, **kwargs)
+        # participant_one=A and participant_two=B is the same pair as participant_one=B and participant_two=A,
+        # so the pair is always stored with the lower user id first
+        if (self.participant_one_id is not None and self.participant_two_id is not None and
+                self.participant_one_id > self.participant_two_id):
+            self.participant_one, self.participant_two = self.participant_two, self.participant_one
+        super().save(*args, **kwargs)
+
+    def last_read_field(self, user_id):
+        """Name of the read mark field of a participant"""
+        if user_id == self.participant_one_id:
+            return 'participant_one_last_read_id'
+        return 'participant_two_last_read_id'
+
+    def has_been_read(self, message):
+        """Whether a participant other than the sender has read the message"""
+        return (
+            (message.sender_id != self.participant_one_id and message.id <= self.participant_one_last_read_id) or
+            (message.sender_id != self.participant_two_id and message.id <= self.participant_two_last_read_id)
+        )
 
     def __str__(self):
         return f'Thread No.{self.id} for {self.participant_one.email} and {self.participant_two.email}'
 
 
+class MessageQuerySet(models.QuerySet):
+
+    def thread_history(self, thread_id):
+        """Messages of a thread with their senders in chronological order"""
+        return self.filter(thread=thread_id).select_related('sender').with_read_state().order_by(
+            'created_at', 'id')
+
+    def with_read_state(self):
+        """Annotate is_read from the read marks of the threads, instead of loading the thread of every message"""
+        return self.annotate(is_read=ExpressionWrapper(READ_MESSAGES, output_field=BooleanField()))
+
+    def read(self):
+        return self.filter(READ_MESSAGES)
+
+    def unread(self):
+        # Unread messages come after the lower read mark, which bounds the scan of the (thread, id, sender) index
+        return self.filter(
+            id__gt=Least('thread__participant_one_last_read_id', 'thread__participant_two_last_read_id')).exclude(
+            READ_MESSAGES)
+
+    def bulk_send(self, messages, batch_size=None):
+        """
+        Insert new messages with bulk_create and update derived state in bulk.
+
+        Last messages of the threads are updated with a query for the whole batch, instead of the query per
+        message run by Message.save. Primary keys are set on the given messages.
+        """
+        with transaction.atomic(using=self.db):
+            messages = self.bulk_create(messages, batch_size=batch_size)
+            threads = Thread.objects.using(self.db).filter(pk__in={message.thread_id for message in messages})
+            threads.refresh_last_message()
+            if all(Message.thread.is_cached(message) for message in messages):
+                invalidate_cached_threads({message.thread for message in messages})
+            else:
+                threads.invalidate_cached_responses()
+        return messages
+
+
+# Messages read by a participant other than their sender, relative to the read marks of their thread
+READ_MESSAGES = (
+    Q(~Q(sender=F('thread__participant_one')), id__lte=F('thread__participant_one_last_read_id')) |
+    Q(~Q(sender=F('thread__participant_two')), id__lte=F('thread__participant_two_last_read_id'))
+)
+
+
 class Message(TimeStampMixin):
     sender = models.ForeignKey(User, related_name='messages', on_delete=models.CASCADE)
     text = models.TextField(blank=True)
-    thread = models.ForeignKey(Thread, related_name='messages', on_delete=models.CASCADE)
-    is_read = models.BooleanField(default=False)
+    # Indexed by message_thread_created_idx, which has thread as its leading column
+    thread = models.ForeignKey(Thread, related_name='messages', on_delete=models.CASCADE, db_index=False)
 
     class Meta:
+        indexes = [
+            # Message list of a thread is filtered by thread and ordered by (created_at, id)
+            models.Index(fields=['thread', 'created_at', 'id'], name='message_thread_created_idx'),
+            # Unread messages and messages marked as read are the ones of a thread after a read mark; covering the
+            # sender as well, counts of unread messages per sender are answered from the index alone
+            models.Index(fields=['thread', 'id', 'sender'], name='message_thread_id_sender_idx'),
+        ]
         verbose_name = 'Message'
 
+    objects = MessageQuerySet.as_manager()
+
+    # Set by MessageQuerySet.with_read_state() or for archived messages, otherwise derived from the thread
+    _is_read = None
+
+    @property
+    def is_read(self):
+        if self._is_read is None:
+            return self.id is not None and self.thread.has_been_read(self)
+        return self._is_read
+
+    @is_read.setter
+    def is_read(self, value):
+        self._is_read = bool(value)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Thread.objects.filter(
+                    Q(last_message_at__isnull=True) | Q(last_message_at__lte=self.created_at), pk=self.thread_id
+                ).update(last_message=self, last_message_at=self.created_at)
+
     def __str__(self):
         return f'Message for thread No.{self.thread} by {self.sender.email}'
+
+
+class ArchivedMessageBlock(models.Model):
+    """
+    Consecutive old messages of a thread moved out of the message table by the archive_messages command.
+
+    Messages are stored in a compressed block (see chat.archive), which keeps the message table and its
+    indexes limited to the recent part of the history that almost all reads hit.
+    """
+    # Indexed by archived_block_thread_idx, which has thread as its leading column
+    thread = models.ForeignKey(
+        Thread, related_name='archived_message_blocks', on_delete=models.CASCADE, db_index=False)
+    # Position of the block in the history of the thread, i.e. of its first message
+    first_created_at = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    # Bounds of ids of the messages in the block, to find the block of a message
+    min_message_id = models.BigIntegerField()
+    max_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'first_created_at', 'first_message_id'], name='archived_block_thread_idx'),
+        ]
+        verbose_name = 'Archived message block'
+
+    def __str__(self):
+        return f'{self.message_count} archived messages of thread No.{self.thread_id}'
@@ -1,7 +1,263 @@
+from base64 import b64decode, b64encode
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from chat.constants import NUM_OF_ITEMS_PER_PAGE
 
 
 class ResultsSetPagination(LimitOffsetPagination):
     default_limit = NUM_OF_ITEMS_PER_PAGE
+
+    async def apaginate_queryset(self, queryset, request):
+        """Async counterpart of paginate_queryset() for async views"""
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.count = await self.aget_count(queryset)
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return await self.aget_slice(queryset, self.offset, self.offset + self.limit)
+
+    async def aget_count(self, queryset):
+        return await queryset.acount()
+
+    async def aget_slice(self, queryset, start, stop):
+        return [item async for item in queryset[start:stop]]
+
+
+class MessagePagination(ResultsSetPagination):
+    """
+    Limit/offset pagination with an additional keyset (cursor) mode for message history.
+
+    Cursor mode is enabled by passing a message id in ``before`` or ``after`` (or ``mode=cursor`` for
+    the latest page) and pages through ``(created_at, id)`` without OFFSET scans and without COUNT(*),
+    so a page costs the same no matter how far back the user has scrolled. Results are always returned
+    in chronological order. Requests without these parameters keep the limit/offset behaviour.
+
+    Paginates a chat.archive.MessageHistory, so pages read through to archived messages.
+    """
+    mode_query_param = 'mode'
+    mode_query_description = _('Set to "cursor" to use keyset pagination instead of limit/offset.')
+    cursor_mode = 'cursor'
+    before_query_param = 'before'
+    before_query_description = _('Return messages older than the message with this id (cursor mode).')
+    after_query_param = 'after'
+    after_query_description = _('Return messages newer than the message with this id (cursor mode).')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode_enabled = self.is_cursor_mode(request)
+        if not self.cursor_mode_enabled:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        after, before = self.get_cursors(request)
+        # Fetch one row more than the limit so that we know whether there is a further page
+        rows = queryset.keyset_page(after if after is not None else before, after is not None, self.limit + 1)
+        return self.get_cursor_page(rows, after, before)
+
+    async def apaginate_queryset(self, queryset, request):
+        self.cursor_mode_enabled = self.is_cursor_mode(request)
+        if not self.cursor_mode_enabled:
+            return await super().apaginate_queryset(queryset, request)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        after, before = self.get_cursors(request)
+        rows = await queryset.akeyset_page(after if after is not None else before, after is not None, self.limit + 1)
+        return self.get_cursor_page(rows, after, before)
+
+    async def aget_slice(self, history, start, stop):
+        return await history.aslice(start, stop)
+
+    def get_cursors(self, request):
+        """Return the ``after`` and ``before`` cursors; ``before`` is ignored when both are given"""
+        after = self.get_cursor(request, self.after_query_param)
+        before = self.get_cursor(request, self.before_query_param) if after is None else None
+        return after, before
+
+    def get_cursor_page(self, rows, after, before):
+        """Return the page of keyset rows in chronological order and remember where it starts and ends"""
+        if rows is None:
+            raise NotFound(self.invalid_cursor_message)
+        if after is not None:
+            self.has_newer, self.has_older = len(rows) > self.limit, True
+            page = rows[:self.limit]
+        else:
+            self.has_older, self.has_newer = len(rows) > self.limit, before is not None
+            page = rows[:self.limit][::-1]
+
+        cursor = after if after is not None else before
+        self.first_id = page[0].id if page else cursor
+        self.last_id = page[-1].id if page else cursor
+        return page
+
+    def is_cursor_mode(self, request):
+        params = request.query_params
+        return (
+            params.get(self.mode_query_param) == self.cursor_mode or
+            self.before_query_param in params or
+            self.after_query_param in params
+        )
+
+    def get_cursor(self, request, query_param):
+        value = request.query_params.get(query_param)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode_enabled:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+    def get_next_link(self):
+        """In cursor mode the next page holds older messages"""
+        if not self.cursor_mode_enabled:
+            return super().get_next_link()
+        if not self.has_older or self.first_id is None:
+            return None
+        return self.get_cursor_link(self.before_query_param, self.after_query_param, self.first_id)
+
+    def get_previous_link(self):
+        """In cursor mode the previous page holds newer messages"""
+        if not self.cursor_mode_enabled:
+            return super().get_previous_link()
+        if not self.has_newer or self.last_id is None:
+            return None
+        return self.get_cursor_link(self.after_query_param, self.before_query_param, self.last_id)
+
+    def get_cursor_link(self, query_param, opposite_query_param, cursor):
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        url = remove_query_param(url, opposite_query_param)
+        return replace_query_param(url, query_param, cursor)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['required'] = ['results']
+        response_schema['properties']['count']['description'] = 'Omitted in cursor mode'
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        for name, description in (
+                (self.mode_query_param, self.mode_query_description),
+                (self.before_query_param, self.before_query_description),
+                (self.after_query_param, self.after_query_description),
+        ):
+            parameters.append({
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': str(description),
+                'schema': {
+                    'type': 'string' if name == self.mode_query_param else 'integer',
+                },
+            })
+        return parameters
+
+
+class SearchPagination(ResultsSetPagination):
+    """
+    Keyset pagination of search results ordered by ``(rank, id)``.
+
+    The cursor is opaque to clients: follow the ``next`` link to get the following page. Ranks depend on
+    the whole index, so results of a search can shift a little while new messages are being indexed.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = _('The pagination cursor value.')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_cursor(self, request):
+        """Return the ``(rank, id)`` of the last result of the previous page, None for the first page"""
+        value = request.query_params.get(self.cursor_query_param)
+        if not value:
+            return None
+        try:
+            rank, message_id = b64decode(value.encode('ascii'), altchars=b'-_').decode('ascii').split(':')
+            return float(rank), int(message_id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, message):
+        return b64encode(f'{message.rank!r}:{message.id}'.encode('ascii'), altchars=b'-_').decode('ascii')
+
+    def paginate_search(self, search, request):
+        """Call ``search(limit, after)`` for one row more than the limit to find out whether there is a next page"""
+        self.request = request
+        self.limit = self.get_limit(request)
+        rows = search(self.limit + 1, self.get_cursor(request))
+        self.next_cursor = self.encode_cursor(rows[self.limit - 1]) if len(rows) > self.limit else None
+        return rows[:self.limit]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.limit_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.limit_query_description),
+                'schema': {
+                    'type': 'integer',
+                },
+            },
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.cursor_query_description),
+                'schema': {
+                    'type': 'string',
+                },
+            },
+        ]
@@ -0,0 +1,104 @@
+"""
+Ephemeral presence ("online") and typing state of users in threads.
+
+The state is written on every heartbeat of every client, so it is kept in a store expiring entries by itself
+instead of the database. A user is online in a thread for PRESENCE_TIMEOUT seconds after their last heartbeat and
+typing for TYPING_TIMEOUT seconds after their last heartbeat reporting typing.
+"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from chat.constants import PRESENCE_TIMEOUT, TYPING_TIMEOUT
+
+
+def presence_key(thread_id, user_id):
+    return f'chat.presence.{thread_id}.{user_id}'
+
+
+class BasePresenceStore:
+    """
+    Store of the last heartbeat of users in threads.
+
+    Entries are ``(last_seen, typing_until)`` timestamps of the ``clock`` of the store. Implementations only have to
+    keep entries for PRESENCE_TIMEOUT seconds; state older than that is ignored when reading anyway.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+    def heartbeat(self, thread_id, user_id, typing=False):
+        now = self.clock()
+        self.set(presence_key(thread_id, user_id), (now, now + TYPING_TIMEOUT if typing else None))
+
+    def get_many(self, pairs):
+        """Return the state of (thread_id, user_id) pairs as {pair: {'online', 'typing', 'last_seen'}}"""
+        now = self.clock()
+        entries = self.get_entries([presence_key(*pair) for pair in pairs])
+        states = {}
+        for pair in pairs:
+            last_seen, typing_until = entries.get(presence_key(*pair)) or (None, None)
+            online = last_seen is not None and now - last_seen < PRESENCE_TIMEOUT
+            states[pair] = {
+                'online': online,
+                'typing': online and typing_until is not None and now < typing_until,
+                'last_seen': last_seen if online else None,
+            }
+        return states
+
+    def set(self, key, entry):
+        raise NotImplementedError('subclasses of BasePresenceStore must provide a set() method')
+
+    def get_entries(self, keys):
+        raise NotImplementedError('subclasses of BasePresenceStore must provide a get_entries() method')
+
+
+class InMemoryPresenceStore(BasePresenceStore):
+    """Presence within a single process; suitable for one worker and as a stand-in in tests"""
+    # Seconds between sweeps of expired entries, so that users who went away do not stay in memory
+    sweep_interval = PRESENCE_TIMEOUT
+
+    def __init__(self, clock=time.time):
+        super().__init__(clock)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.swept_at = clock()
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            if entry[0] - self.swept_at >= self.sweep_interval:
+                self.sweep(entry[0])
+
+    def get_entries(self, keys):
+        with self.lock:
+            return {key: self.entries[key] for key in keys if key in self.entries}
+
+    def sweep(self, now):
+        self.entries = {
+            key: entry for key, entry in self.entries.items() if now - entry[0] < PRESENCE_TIMEOUT
+        }
+        self.swept_at = now
+
+
+class CachePresenceStore(BasePresenceStore):
+    """Presence in the CHAT_PRESENCE_CACHE_ALIAS cache, shared by all workers when the cache backend is"""
+
+    def __init__(self, clock=time.time):
+        super().__init__(clock)
+        self.cache = caches[settings.CHAT_PRESENCE_CACHE_ALIAS]
+
+    def set(self, key, entry):
+        self.cache.set(key, entry, timeout=PRESENCE_TIMEOUT)
+
+    def get_entries(self, keys):
+        return self.cache.get_many(keys)
+
+
+@functools.cache
+def get_presence_store():
+    return import_string(settings.CHAT_PRESENCE_BACKEND)()
@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def thread_channel(thread_id):
+    """Name of the channel events of a particular thread are published to"""
+    return f'chat.thread.{thread_id}'
+
+
+class BasePubSub:
+    """
+    Fan-out of chat events to subscribers.
+
+    ``publish`` is called from synchronous code (views, on commit callbacks) in any thread,
+    ``subscribe`` is used from asynchronous code (WebSocket consumers, long-poll views).
+    Implementations backed by an external broker should subclass this and be set in CHAT_PUBSUB_BACKEND.
+    """
+
+    def publish(self, channel, message):
+        raise NotImplementedError('subclasses of BasePubSub must provide a publish() method')
+
+    def subscribe(self, channel):
+        """Return an async context manager yielding a subscription with an awaitable get()"""
+        raise NotImplementedError('subclasses of BasePubSub must provide a subscribe() method')
+
+
+class InMemorySubscription:
+    """Queue of messages of one channel for one subscriber, bound to the event loop it was created in"""
+
+    def __init__(self, pubsub, channel, max_size):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    async def __aenter__(self):
+        self.pubsub.add_subscription(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.pubsub.remove_subscription(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def put(self, message):
+        """Schedule delivery of a message; safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self.put_nowait, message)
+        except RuntimeError:
+            # The event loop of the subscriber is already closed
+            self.pubsub.remove_subscription(self)
+
+    def put_nowait(self, message):
+        if self.queue.full():
+            # A subscriber that does not keep up loses its oldest messages instead of growing without bound
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class InMemoryPubSub(BasePubSub):
+    """Pub/sub within a single process; suitable for one ASGI worker and as a stand-in in tests"""
+    max_queue_size = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, channel):
+        return InMemorySubscription(self, channel, self.max_queue_size)
+
+    def add_subscription(self, subscription):
+        with self.lock:
+            self.subscriptions[subscription.channel].add(subscription)
+
+    def remove_subscription(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.channel]
+
+
+@functools.cache
+def get_pubsub():
+    return import_string(settings.CHAT_PUBSUB_BACKEND)()
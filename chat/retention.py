@@ -0,0 +1,107 @@
+"""
+Deletion of messages older than the retention period of the deployment (MESSAGE_RETENTION_DAYS).
+
+A single DELETE of all old messages would hold the database write lock, which every sender waits for, for as long as
+it runs, and QuerySet.delete() would first load every row through the deletion collector. Purger deletes with plain
+DELETE statements over bounded ranges of primary keys instead, each in a short transaction, and pauses between them so
+that other writers get the lock. Archived messages are purged by dropping or rewriting their blocks.
+
+Since the statements bypass the ORM, no pre_delete or post_delete signals are sent for purged messages. Their only
+effects on other rows, the last messages of threads and the cached thread lists, are refreshed by Purger itself.
+"""
+import time
+
+from django.db import connections, router, transaction
+from django.db.models import Max, Min
+
+from chat.archive import set_block_messages, unpack_block
+from chat.constants import ARCHIVE_BLOCK_SIZE, PURGE_BATCH_SIZE, PURGE_PAUSE
+from chat.models import ArchivedMessageBlock, Message, Thread
+
+
+class Purger:
+    """
+    Delete messages created before ``older_than`` in batches of ``batch_size`` ids, pausing ``pause`` seconds after
+    every batch that deleted messages. With ``dry_run`` nothing is deleted and the messages that would be are counted.
+    """
+
+    def __init__(self, older_than, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE, dry_run=False, progress=None):
+        self.older_than = older_than
+        self.batch_size = batch_size
+        self.pause = pause
+        self.dry_run = dry_run
+        self.progress = progress
+        self.purged = 0
+
+    def run(self):
+        """Purge old messages of the message table and of the archive and return their number"""
+        started = time.perf_counter()
+        bounds = Message.objects.filter(created_at__lt=self.older_than).aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is not None:
+            for start in range(bounds['first'], bounds['last'] + 1, self.batch_size):
+                self.run_batch(started, self.purge_messages, start, start + self.batch_size)
+        # Archived messages are older than the ones in the message table, so only blocks starting before the end of
+        # the retention period hold messages to purge
+        block_ids = list(ArchivedMessageBlock.objects.filter(
+            first_created_at__lt=self.older_than).order_by('id').values_list('id', flat=True))
+        blocks_per_batch = max(self.batch_size // ARCHIVE_BLOCK_SIZE, 1)
+        for index in range(0, len(block_ids), blocks_per_batch):
+            self.run_batch(started, self.purge_blocks, block_ids[index:index + blocks_per_batch])
+        return self.purged
+
+    def run_batch(self, started, purge, *args):
+        with transaction.atomic():
+            purged = purge(*args)
+        if not purged:
+            return
+        self.purged += purged
+        if self.progress:
+            elapsed = time.perf_counter() - started
+            self.progress(self.purged, self.purged / elapsed if elapsed else 0)
+        if not self.dry_run:
+            time.sleep(self.pause)
+
+    def purge_messages(self, start, stop):
+        """Purge old messages with ids from start up to stop and return their number"""
+        messages = Message.objects.filter(id__gte=start, id__lt=stop, created_at__lt=self.older_than)
+        if self.dry_run:
+            return messages.count()
+        thread_ids = set(messages.order_by().values_list('thread', flat=True).distinct())
+        if not thread_ids:
+            return 0
+        # QuerySet.delete() would load the messages to clear last_message of their threads, which refreshing the
+        # last messages below does with a single query before the foreign key is checked at commit
+        deleted = self.delete_messages(start, stop)
+        threads = Thread.objects.filter(pk__in=thread_ids)
+        threads.filter(last_message_at__lt=self.older_than).refresh_last_message()
+        # Previews and unread counts in the thread lists may have changed
+        threads.invalidate_cached_responses()
+        return deleted
+
+    def delete_messages(self, start, stop):
+        """Delete old messages with ids from start up to stop with a single statement and return their number"""
+        connection = connections[router.db_for_write(Message)]
+        table, id_column, created_at_column = map(connection.ops.quote_name, (
+            Message._meta.db_table, Message._meta.pk.column, Message._meta.get_field('created_at').column))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {id_column} >= %s AND {id_column} < %s AND {created_at_column} < %s',
+                [start, stop, connection.ops.adapt_datetimefield_value(self.older_than)],
+            )
+            return cursor.rowcount
+
+    def purge_blocks(self, block_ids):
+        """Purge old messages of archived blocks and return their number"""
+        purged = 0
+        for block in ArchivedMessageBlock.objects.filter(pk__in=block_ids):
+            messages = unpack_block(block)
+            kept = [message for message in messages if message.created_at >= self.older_than]
+            purged += len(messages) - len(kept)
+            if self.dry_run or len(kept) == len(messages):
+                continue
+            if kept:
+                set_block_messages(block, kept)
+                block.save()
+            else:
+                block.delete()
+        return purged
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from chat.consumers import ThreadConsumer
+
+websocket_urlpatterns = [
+    path('ws/chat/thread/<int:thread_id>/', ThreadConsumer(), name='thread_updates'),
+]
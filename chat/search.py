@@ -0,0 +1,111 @@
+"""
+Full-text search of messages backed by the ``chat_message_fts`` FTS5 table.
+
+The table and the triggers keeping it in sync with ``chat_message`` are installed by migration
+0007_message_search_index. Results are ranked with BM25, best match first.
+
+Snippets are HTML: FTS5 marks matches with control characters, and the fragment is HTML-escaped before the marks
+become ``<mark>`` tags, so that clients can render the highlight without rendering markup of the message text.
+"""
+import html
+import re
+
+from django.db import connection, connections
+from django.db.models import prefetch_related_objects
+
+from chat.models import Message, Thread
+
+SEARCH_INDEX_TABLE = 'chat_message_fts'
+SEARCH_INDEX_TRIGGERS = ('chat_message_fts_insert', 'chat_message_fts_delete', 'chat_message_fts_update')
+# Start and end of text in the snippets of FTS5, replaced with HIGHLIGHT_START and HIGHLIGHT_END after escaping
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+SNIPPET_ELLIPSIS = '…'
+SNIPPET_TOKENS = 12
+
+TERM_REGEX = re.compile(r'\w+')
+
+SEARCH_SQL = f"""
+    SELECT message.*,
+        {SEARCH_INDEX_TABLE}.rank AS rank,
+        snippet({SEARCH_INDEX_TABLE}, 0, %s, %s, %s, %s) AS snippet,
+        (message.sender_id != thread.participant_one_id AND message.id <= thread.participant_one_last_read_id) OR
+        (message.sender_id != thread.participant_two_id AND message.id <= thread.participant_two_last_read_id)
+            AS is_read
+    FROM {SEARCH_INDEX_TABLE}
+        INNER JOIN {Message._meta.db_table} AS message ON message.id = {SEARCH_INDEX_TABLE}.rowid
+        INNER JOIN {Thread._meta.db_table} AS thread ON thread.id = message.thread_id
+    WHERE {SEARCH_INDEX_TABLE} MATCH %s
+        AND (thread.participant_one_id = %s OR thread.participant_two_id = %s)
+        {{after}}
+    ORDER BY {SEARCH_INDEX_TABLE}.rank, message.id
+    LIMIT %s
+"""
+AFTER_SQL = f'AND ({SEARCH_INDEX_TABLE}.rank > %s OR ({SEARCH_INDEX_TABLE}.rank = %s AND message.id > %s))'
+
+
+def build_match_expression(query):
+    """
+    Turn user input into an FTS5 query matching messages that contain all of its words.
+
+    Every word is quoted, so operators and special characters of the FTS5 query syntax are searched
+    for literally instead of causing syntax errors. Returns None when the input has no words.
+    """
+    terms = TERM_REGEX.findall(query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def search_messages(user, query, limit, after=None):
+    """
+    Return up to ``limit`` messages of threads of ``user`` matching ``query``, best match first.
+
+    Messages get ``rank`` (lower is better) and ``snippet`` (HTML) attributes. ``after`` is the ``(rank, id)``
+    of the last message of the previous page.
+    """
+    expression = build_match_expression(query)
+    if expression is None:
+        return []
+    params = [SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, SNIPPET_TOKENS, expression, user.pk, user.pk]
+    if after is not None:
+        rank, message_id = after
+        params += [rank, rank, message_id]
+    params.append(limit)
+    sql = SEARCH_SQL.format(after=AFTER_SQL if after is not None else '')
+    messages = list(Message.objects.raw(sql, params))
+    for message in messages:
+        message.snippet = highlight(message.snippet)
+    prefetch_related_objects(messages, 'sender')
+    return messages
+
+
+def highlight(snippet):
+    """HTML-escape a snippet of FTS5 and wrap its matches in <mark></mark>"""
+    return html.escape(snippet).replace(SNIPPET_START, HIGHLIGHT_START).replace(SNIPPET_END, HIGHLIGHT_END)
+
+
+def missing_search_index_triggers(using='default'):
+    """
+    Return names of the triggers keeping the index in sync that are missing on the message table. SQLite drops them
+    when a migration rebuilds the table, after which the index silently stops following writes.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [Message._meta.db_table])
+        existing = {name for name, in cursor.fetchall()}
+    return [name for name in SEARCH_INDEX_TRIGGERS if name not in existing]
+
+
+def rebuild_search_index():
+    """Reindex all messages, e.g. after loading data with the triggers disabled"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+
+
+def optimize_search_index():
+    """Merge the b-trees of the index into one, which makes queries faster after many writes"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('optimize')")
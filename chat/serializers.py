@@ -1,7 +1,10 @@
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
 
+from chat.constants import MAX_MESSAGES_PER_BATCH, MAX_THREADS_PER_PRESENCE_QUERY
 from chat.models import Message, Thread
-from user.serializers import UserSerializer
+from user.serializers import FastUserSerializer, UserSerializer
 
 
 class ThreadReadSerializer(serializers.ModelSerializer):
@@ -28,6 +31,13 @@ class ThreadWriteSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
         ]
+        # An existing pair is not an error: the view returns the existing thread instead
+        validators = []
+
+    def validate(self, attrs):
+        if attrs['participant_one'] == attrs['participant_two']:
+            raise serializers.ValidationError('Participant one and Participant two should be different')
+        return attrs
 
     def to_representation(self, data):
         return ThreadReadSerializer(context=self.context).to_representation(data)
@@ -35,6 +45,7 @@ class ThreadWriteSerializer(serializers.ModelSerializer):
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    is_read = serializers.BooleanField(read_only=True, help_text='Whether the other participant has read the message')
 
     class Meta:
         model = Message
@@ -48,6 +59,123 @@ class MessageSerializer(serializers.ModelSerializer):
         ]
 
 
+class MessageSearchResultSerializer(MessageSerializer):
+    rank = serializers.FloatField(read_only=True, help_text='BM25 rank of the message, lower is a better match')
+    snippet = serializers.CharField(
+        read_only=True,
+        help_text='HTML-escaped fragment of the text with matches wrapped in <mark></mark>',
+    )
+
+    class Meta:
+        model = Message
+        fields = MessageSerializer.Meta.fields + [
+            'rank',
+            'snippet',
+        ]
+
+
+class InboxThreadSerializer(ThreadReadSerializer):
+    last_message = MessageSerializer(read_only=True)
+    number_of_unread_messages = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Thread
+        fields = ThreadReadSerializer.Meta.fields + [
+            'last_message',
+            'last_message_at',
+            'number_of_unread_messages',
+        ]
+
+
+# Read-only serializers below render the same output as their ModelSerializer counterparts above.
+# They skip field introspection and per-object field binding, which dominate rendering time of list pages.
+
+user_serializer = FastUserSerializer()
+
+
+def format_datetime(value, tz):
+    """Render datetime like serializers.DateTimeField with the default ISO 8601 format"""
+    if value is None:
+        return None
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """Looks the current time zone up once per page instead of once per datetime"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        tz = timezone.get_current_timezone()
+        return [self.child.render(item, tz) for item in iterable]
+
+
+class FastReadSerializer(serializers.BaseSerializer):
+
+    class Meta:
+        list_serializer_class = FastListSerializer
+
+    def to_representation(self, instance):
+        return self.render(instance, timezone.get_current_timezone())
+
+    def render(self, instance, tz):
+        raise NotImplementedError('subclasses of FastReadSerializer must provide a render() method')
+
+
+class FastMessageSerializer(FastReadSerializer):
+    """Read-only serializer rendering the same output as MessageSerializer"""
+
+    def render(self, instance, tz):
+        return {
+            'id': instance.id,
+            'sender': user_serializer.to_representation(instance.sender),
+            'text': instance.text,
+            'thread': instance.thread_id,
+            'created_at': format_datetime(instance.created_at, tz),
+            'is_read': instance.is_read,
+        }
+
+
+message_serializer = FastMessageSerializer()
+
+
+class FastMessageSearchResultSerializer(FastMessageSerializer):
+    """Read-only serializer rendering the same output as MessageSearchResultSerializer"""
+
+    def render(self, instance, tz):
+        data = super().render(instance, tz)
+        data['rank'] = instance.rank
+        data['snippet'] = instance.snippet
+        return data
+
+
+class FastThreadSerializer(FastReadSerializer):
+    """Read-only serializer rendering the same output as ThreadReadSerializer"""
+
+    def render(self, instance, tz):
+        return {
+            'id': instance.id,
+            'participant_one': user_serializer.to_representation(instance.participant_one),
+            'participant_two': user_serializer.to_representation(instance.participant_two),
+            'created_at': format_datetime(instance.created_at, tz),
+            'updated_at': format_datetime(instance.updated_at, tz),
+        }
+
+
+class FastInboxThreadSerializer(FastThreadSerializer):
+    """Read-only serializer rendering the same output as InboxThreadSerializer"""
+
+    def render(self, instance, tz):
+        data = super().render(instance, tz)
+        last_message = instance.last_message
+        data['last_message'] = message_serializer.render(last_message, tz) if last_message else None
+        data['last_message_at'] = format_datetime(instance.last_message_at, tz)
+        data['number_of_unread_messages'] = instance.number_of_unread_messages
+        return data
+
+
 class SwaggerCreateMessageSerializer(MessageSerializer):
     class Meta:
         model = Message
@@ -58,3 +186,92 @@ class SwaggerCreateMessageSerializer(MessageSerializer):
             'thread',
             'created_at',
         ]
+
+
+class MarkThreadAsReadSerializer(serializers.Serializer):
+    up_to = serializers.IntegerField(
+        min_value=1,
+        help_text='Id of the last message to mark as read; all earlier messages of the thread are marked too',
+    )
+
+
+class SendMessagesSerializer(serializers.Serializer):
+    """Many messages to one thread (thread and texts) or one message to many threads (threads and text)"""
+    thread = serializers.IntegerField(required=False, help_text='Thread to send all texts to')
+    texts = serializers.ListField(
+        child=serializers.CharField(allow_blank=True, trim_whitespace=False),
+        required=False,
+        min_length=1,
+        max_length=MAX_MESSAGES_PER_BATCH,
+        help_text='Texts of the messages to send to the thread',
+    )
+    threads = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        min_length=1,
+        max_length=MAX_MESSAGES_PER_BATCH,
+        help_text='Threads to broadcast the text to',
+    )
+    text = serializers.CharField(
+        required=False, allow_blank=True, trim_whitespace=False, help_text='Text of the message to broadcast')
+
+    def validate(self, attrs):
+        batch = 'thread' in attrs and 'texts' in attrs
+        broadcast = 'threads' in attrs and 'text' in attrs
+        if batch == broadcast or len(attrs) != 2:
+            raise serializers.ValidationError('Provide either thread and texts or threads and text')
+        thread_ids = attrs['threads'] if broadcast else [attrs['thread']]
+        # A single query for the whole batch instead of one per thread. Threads of other users are unknown, like
+        # for participants_of() in MessageThreadThrottle
+        threads = Thread.objects.of_participant(self.context['request'].user).in_bulk(thread_ids)
+        unknown = [thread_id for thread_id in thread_ids if thread_id not in threads]
+        if unknown:
+            raise serializers.ValidationError({'threads' if broadcast else 'thread': f'Unknown threads: {unknown}'})
+        if broadcast:
+            attrs['messages'] = [(threads[thread_id], attrs['text']) for thread_id in attrs['threads']]
+        else:
+            attrs['messages'] = [(threads[attrs['thread']], text) for text in attrs['texts']]
+        return attrs
+
+
+def get_presence_participants(serializer, thread_ids, field):
+    """Return participants of the threads, which the authenticated user must take part in"""
+    participants = Thread.objects.participants_of(thread_ids, serializer.context['request'].user)
+    unknown = [thread_id for thread_id in thread_ids if thread_id not in participants]
+    if unknown:
+        raise serializers.ValidationError({field: f'Unknown threads: {unknown}'})
+    return participants
+
+
+class PresenceHeartbeatSerializer(serializers.Serializer):
+    thread = serializers.IntegerField(help_text='Thread the user is looking at')
+    typing = serializers.BooleanField(default=False, help_text='Whether the user is typing a message')
+
+    def validate(self, attrs):
+        get_presence_participants(self, [attrs['thread']], 'thread')
+        return attrs
+
+
+class PresenceQuerySerializer(serializers.Serializer):
+    thread_id = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1,
+        max_length=MAX_THREADS_PER_PRESENCE_QUERY,
+        help_text='Threads to return the presence of participants of; repeat the parameter for several threads',
+    )
+
+    def validate(self, attrs):
+        attrs['participants'] = get_presence_participants(self, attrs['thread_id'], 'thread_id')
+        return attrs
+
+
+class PresenceSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    online = serializers.BooleanField()
+    typing = serializers.BooleanField()
+    last_seen = serializers.DateTimeField(allow_null=True)
+
+
+class ThreadPresenceSerializer(serializers.Serializer):
+    thread = serializers.IntegerField()
+    participants = PresenceSerializer(many=True)
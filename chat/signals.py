@@ -0,0 +1,31 @@
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat.models import invalidate_cached_threads, Message, Thread
+from user.models import User
+from user.signals import is_login_update
+
+
+@receiver(post_save, sender=Thread)
+@receiver(post_delete, sender=Thread)
+def invalidate_cached_thread(sender, instance, **kwargs):
+    invalidate_cached_threads([instance])
+
+
+@receiver(post_save, sender=Message)
+def invalidate_cached_message(sender, instance, **kwargs):
+    # Messages created through the API come with their thread, other ones cost a query for the participants
+    if Message.thread.is_cached(instance):
+        invalidate_cached_threads([instance.thread])
+    else:
+        Thread.objects.filter(pk=instance.thread_id).invalidate_cached_responses()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_threads(sender, instance, created, update_fields=None, **kwargs):
+    # Thread lists show both participants, so only those of the user and their partners change. New users have no
+    # threads yet, and the threads of deleted users are deleted with them, which invalidates the lists.
+    if created or is_login_update(update_fields):
+        return
+    Thread.objects.filter(Q(participant_one=instance) | Q(participant_two=instance)).invalidate_cached_responses()
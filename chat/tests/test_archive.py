@@ -0,0 +1,130 @@
+import datetime
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from chat.archive import archive_messages, archive_thread
+from chat.export import export_thread_messages
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import ArchivedMessageBlock, Message, Thread
+from user.factories import UserFactory
+
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+
+
+class ArchiveTests(TestCase):
+    """Test archival of old messages and reading message lists through the archive"""
+
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.thread = ThreadFactory(participant_one=self.user)
+        start = timezone.now() - datetime.timedelta(days=365)
+        self.messages = []
+        for number in range(12):
+            message = MessageFactory(
+                thread=self.thread, sender=(self.thread.participant_one, self.thread.participant_two)[number % 2])
+            # Timestamps with microseconds to check that they are archived exactly
+            created_at = start + datetime.timedelta(days=number, microseconds=number)
+            Message.objects.filter(pk=message.pk).update(created_at=created_at)
+            self.messages.append(message)
+        self.ids = [message.id for message in self.messages]
+        self.set_read_marks(self.ids[-1], self.ids[-1])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def set_read_marks(self, participant_one_last_read_id, participant_two_last_read_id):
+        Thread.objects.filter(pk=self.thread.pk).update(
+            participant_one_last_read_id=participant_one_last_read_id,
+            participant_two_last_read_id=participant_two_last_read_id)
+
+    def get_messages(self, **params):
+        res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': self.thread.id, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.json()
+
+    def archive(self, days=30, block_size=5):
+        self.thread.refresh_from_db()
+        return archive_thread(self.thread, timezone.now() - datetime.timedelta(days=days), block_size)
+
+    def test_archive_thread(self):
+        """Test that old read messages except the last one are moved into blocks"""
+        self.assertEqual(self.archive(), 11)
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), self.ids[-1:])
+        self.assertEqual(
+            list(ArchivedMessageBlock.objects.order_by('id').values_list('message_count', flat=True)), [5, 5, 1])
+
+    def test_archive_stops_at_unread_and_recent_messages(self):
+        """Test that only the history before the first unread or recent message is archived"""
+        # The 7th message is sent by participant one and the read mark of participant two is before it
+        self.set_read_marks(self.ids[-1], self.ids[5])
+        self.assertEqual(self.archive(), 6)
+        self.set_read_marks(self.ids[-1], self.ids[-1])
+        # Messages from the 8th day on are recent
+        self.assertEqual(self.archive(days=365 - 6.5), 1)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_archive_compacts_last_block(self):
+        """Test that archiving again refills the partly filled last block"""
+        self.archive(days=365 - 2.5)
+        self.archive()
+        self.assertEqual(
+            list(ArchivedMessageBlock.objects.order_by('id').values_list('message_count', flat=True)), [5, 5, 1])
+        self.assertEqual(self.archive(), 0)
+        self.assertEqual(ArchivedMessageBlock.objects.count(), 3)
+
+    def test_archive_messages(self):
+        """Test archiving old messages of all threads"""
+        MessageFactory(thread=ThreadFactory())
+        self.assertEqual(archive_messages(timezone.now() - datetime.timedelta(days=30)), (11, 1))
+
+    def test_message_list_reads_through_archive(self):
+        """Test that limit/offset pages render archived messages as before archiving"""
+        expected = self.get_messages(limit=100)
+        self.archive()
+        self.assertEqual(self.get_messages(limit=100), expected)
+        page = self.get_messages(limit=4, offset=3)
+        self.assertEqual(page['count'], 12)
+        self.assertEqual([message['id'] for message in page['results']], self.ids[3:7])
+        page = self.get_messages(limit=4, offset=9)
+        self.assertEqual([message['id'] for message in page['results']], self.ids[9:])
+
+    def test_message_list_cursor_reads_through_archive(self):
+        """Test scrolling back through archived messages and forward again with cursors"""
+        self.archive()
+        ids = []
+        page = self.get_messages(mode='cursor', limit=5)
+        while True:
+            ids = [message['id'] for message in page['results']] + ids
+            if page['next'] is None:
+                break
+            page = self.client.get(page['next']).json()
+        self.assertEqual(ids, self.ids)
+
+        page = self.get_messages(after=self.ids[3], limit=10)
+        self.assertEqual([message['id'] for message in page['results']], self.ids[4:])
+        self.assertIsNone(page['previous'])
+        page = self.get_messages(before=self.ids[3], limit=10)
+        self.assertEqual([message['id'] for message in page['results']], self.ids[:3])
+
+    def test_message_list_cursor_from_other_thread_fail(self):
+        """Test that archived messages of another thread are not valid cursors"""
+        self.archive()
+        res = self.client.get(
+            CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': ThreadFactory().id, 'before': self.ids[0]})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_reads_through_archive(self):
+        """Test that exports contain archived messages"""
+        expected = b''.join(export_thread_messages(self.thread.id))
+        self.archive()
+        self.assertEqual(b''.join(export_thread_messages(self.thread.id)), expected)
+
+    def test_delete_thread_deletes_archive(self):
+        """Test that archived messages are deleted with their thread"""
+        self.archive()
+        Thread.objects.filter(pk=self.thread.pk).delete()
+        self.assertEqual(ArchivedMessageBlock.objects.count(), 0)
@@ -0,0 +1,104 @@
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from chat.archive import archive_thread
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import Message, Thread
+
+RETRIEVE_THREAD_LIST_URL = reverse('chat:retrieve_thread_list')
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL = reverse('chat:retrieve_number_of_unread_messages')
+ASYNC_RETRIEVE_THREAD_LIST_URL = reverse('chat:async_retrieve_thread_list')
+ASYNC_RETRIEVE_MESSAGE_LIST_URL = reverse('chat:async_retrieve_message_list')
+ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL = reverse('chat:async_retrieve_number_of_unread_messages')
+
+
+class AsyncViewsTests(TestCase):
+    """Test that async read endpoints respond like their sync counterparts"""
+
+    def setUp(self) -> None:
+        self.thread = ThreadFactory()
+        self.user = self.thread.participant_one
+        ThreadFactory(participant_one=self.user)
+        participants = (self.thread.participant_one, self.thread.participant_two)
+        self.messages = [MessageFactory(thread=self.thread, sender=participants[number % 2]) for number in range(15)]
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    async def assertSameResponse(self, url, async_url, params):
+        res = await self.async_client.get(async_url, params, headers=self.headers)
+        expected = await self.async_client.get(url, params, headers=self.headers)
+        self.assertEqual(res.status_code, expected.status_code)
+        self.assertEqual(res['Content-Type'], expected['Content-Type'])
+        self.assertEqual(res.content, expected.content.replace(url.encode(), async_url.encode()))
+        return res
+
+    async def test_thread_list(self):
+        """Test the async thread list"""
+        res = await self.assertSameResponse(
+            RETRIEVE_THREAD_LIST_URL, ASYNC_RETRIEVE_THREAD_LIST_URL, {'user': self.user.id, 'limit': 1})
+        self.assertEqual(res.json()['count'], 2)
+        self.assertIsNotNone(res.json()['next'])
+
+    async def test_message_list(self):
+        """Test limit/offset and cursor pages of the async message list"""
+        for params in ({'limit': 4, 'offset': 2}, {'mode': 'cursor', 'limit': 4},
+                       {'before': self.messages[5].id, 'limit': 4}, {'after': self.messages[5].id, 'limit': 4},
+                       {'offset': 100}):
+            with self.subTest(params=params):
+                await self.assertSameResponse(CREATE_RETRIEVE_MESSAGE_URL, ASYNC_RETRIEVE_MESSAGE_LIST_URL,
+                                              {'thread_id': self.thread.id, **params})
+
+    async def test_message_list_reads_through_archive(self):
+        """Test that async message list pages reach into archived messages"""
+        await sync_to_async(self.archive)()
+        for params in ({'limit': 6, 'offset': 3}, {'before': self.messages[-1].id, 'limit': 20},
+                       {'before': self.messages[4].id, 'limit': 3}, {'after': self.messages[4].id, 'limit': 20}):
+            with self.subTest(params=params):
+                res = await self.assertSameResponse(CREATE_RETRIEVE_MESSAGE_URL, ASYNC_RETRIEVE_MESSAGE_LIST_URL,
+                                                    {'thread_id': self.thread.id, **params})
+                self.assertTrue(res.json()['results'])
+
+    def archive(self):
+        Message.objects.filter(thread=self.thread).update(created_at=timezone.now() - datetime.timedelta(days=365))
+        last_id = self.thread.messages.latest('id').id
+        Thread.objects.filter(pk=self.thread.pk).update(
+            participant_one_last_read_id=last_id, participant_two_last_read_id=last_id)
+        self.thread.refresh_from_db()
+        self.assertEqual(archive_thread(self.thread, timezone.now(), block_size=5), 14)
+
+    async def test_invalid_cursor(self):
+        """Test that an unknown cursor is not found"""
+        res = await self.async_client.get(
+            ASYNC_RETRIEVE_MESSAGE_LIST_URL, {'thread_id': self.thread.id, 'before': 10 ** 6}, headers=self.headers)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res.json(), {'detail': 'Invalid cursor'})
+
+    async def test_number_of_unread_messages(self):
+        """Test the async number of unread messages"""
+        res = await self.assertSameResponse(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL,
+                                            ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL, {'per_thread': 'true'})
+        self.assertEqual(res.json()['number_of_unread_messages'], 8)
+
+    async def test_authentication(self):
+        """Test that missing, invalid and inactive users' tokens are rejected like by the sync views"""
+        self.user.is_active = False
+        await self.user.asave()
+        for headers in ({}, {'Authorization': 'Token invalid'}, {'Authorization': 'Token'}, self.headers):
+            with self.subTest(headers=headers):
+                res = await self.async_client.get(ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL, headers=headers)
+                expected = await self.async_client.get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL, headers=headers)
+                self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+                self.assertEqual(res.json(), expected.json())
+                self.assertEqual(res['WWW-Authenticate'], 'Token')
+
+    async def test_method_not_allowed(self):
+        """Test that the async views are read-only"""
+        res = await self.async_client.post(ASYNC_RETRIEVE_MESSAGE_LIST_URL, headers=self.headers)
+        self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(res.json(), {'detail': 'Method "POST" not allowed.'})
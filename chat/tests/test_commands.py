@@ -0,0 +1,250 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from chat.archive import archive_thread, unpack_block
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import ArchivedMessageBlock, Message, Thread
+from core.cache import get_versions, user_scope
+from user.factories import UserFactory
+from user.models import User
+
+
+class RebuildSearchIndexCommandTests(TestCase):
+    """Test rebuild_search_index management command"""
+
+    def test_rebuild(self):
+        """Test rebuilding the search index"""
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Rebuilt', out.getvalue())
+
+    def test_optimize(self):
+        """Test optimizing the search index"""
+        out = StringIO()
+        call_command('rebuild_search_index', '--optimize', stdout=out)
+        self.assertIn('Optimized', out.getvalue())
+
+
+class ExportThreadCommandTests(TestCase):
+    """Test export_thread management command"""
+
+    def setUp(self) -> None:
+        self.thread = ThreadFactory()
+        self.messages = MessageFactory.create_batch(3, thread=self.thread, sender=self.thread.participant_one)
+
+    def test_export_to_stdout(self):
+        """Test exporting a thread to standard output"""
+        out = StringIO()
+        call_command('export_thread', self.thread.id, '--chunk-size', '2', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [message.id for message in self.messages])
+
+    def test_export_to_gzip_file(self):
+        """Test exporting a thread to a gzip compressed file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ndjson.gz')
+            call_command('export_thread', self.thread.id, '--gzip', '--output', path, stderr=StringIO())
+            with gzip.open(path, 'rt') as export:
+                self.assertEqual(len(export.readlines()), 3)
+
+    def test_export_unknown_thread(self):
+        """Test exporting a thread that does not exist"""
+        with self.assertRaises(CommandError):
+            call_command('export_thread', self.thread.id + 1, stdout=StringIO())
+
+
+class ImportChatCommandTests(TestCase):
+    """Test import_chat management command"""
+
+    records = [
+        {'type': 'user', 'id': 'u1', 'email': 'ann@example.com', 'first_name': 'Ann', 'last_name': 'Lee',
+         'password': make_password('secret')},
+        {'type': 'user', 'id': 'u2', 'email': 'bob@example.com', 'first_name': 'Bob', 'last_name': 'Ray'},
+        {'type': 'thread', 'id': 't1', 'participants': ['u2', 'u1'], 'created_at': '2020-01-01T10:00:00Z'},
+        {'type': 'message', 'id': 'm1', 'thread': 't1', 'sender': 'u1', 'text': 'Hi', 'is_read': True,
+         'created_at': '2020-01-01T10:01:00Z'},
+        {'type': 'message', 'id': 'm2', 'thread': 't1', 'sender': 'u2', 'text': 'Hello',
+         'created_at': '2020-01-01T10:02:00'},
+        {'type': 'thread', 'id': 't2', 'participants': ['u1', 'u2']},
+        {'type': 'message', 'id': 'm3', 'thread': 't2', 'sender': 'u2', 'text': 'Same thread',
+         'created_at': '2020-01-01T10:03:00Z'},
+    ]
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'import.jsonl')
+
+    def write_input(self, lines):
+        with open(self.path, 'w') as input_file:
+            input_file.write('\n'.join(lines) + '\n')
+
+    def import_chat(self, *args):
+        out = StringIO()
+        call_command('import_chat', self.path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import(self):
+        """Test importing users, threads and messages keeping timestamps and rebuilding derived state"""
+        self.write_input(json.dumps(record) for record in self.records)
+        out = self.import_chat('--batch-size', '3')
+        self.assertIn('Imported 7 records', out)
+        self.assertIn('rows/s', out)
+
+        ann, bob = User.objects.get(email='ann@example.com'), User.objects.get(email='bob@example.com')
+        self.assertTrue(ann.check_password('secret'))
+        self.assertFalse(bob.has_usable_password())
+        thread = Thread.objects.get()
+        self.assertEqual((thread.participant_one, thread.participant_two), (ann, bob))
+        self.assertEqual(thread.created_at.isoformat(), '2020-01-01T10:00:00+00:00')
+        messages = list(Message.objects.order_by('id'))
+        self.assertEqual([message.text for message in messages], ['Hi', 'Hello', 'Same thread'])
+        self.assertEqual(messages[1].created_at.isoformat(), '2020-01-01T10:02:00+00:00')
+        self.assertEqual(thread.last_message, messages[2])
+        self.assertEqual([message.is_read for message in messages], [True, False, False])
+        self.assertEqual(list(Thread.objects.unread_counts(bob)), [(thread.id, 2)])
+
+    def test_import_writes_rows_once(self):
+        """Test that a batch inserts its rows with their timestamps without rewriting them"""
+        self.write_input(json.dumps(record) for record in self.records)
+        # Savepoint, lookup and insert of users and of threads, insert of messages, read marks (lookup and update),
+        # last messages, participants to invalidate and release
+        with self.assertNumQueries(11):
+            self.import_chat()
+        self.assertEqual(Thread.objects.get().created_at.isoformat(), '2020-01-01T10:00:00+00:00')
+        self.assertEqual(Message.objects.order_by('id').first().created_at.isoformat(), '2020-01-01T10:01:00+00:00')
+
+    def test_import_only_refreshes_imported_threads(self):
+        """Test that last messages and cached lists are only refreshed for the threads of the imported messages"""
+        other_thread = ThreadFactory()
+        MessageFactory(thread=other_thread)
+        Thread.objects.filter(pk=other_thread.pk).update(last_message=None, last_message_at=None)
+        ann = UserFactory(email='ann@example.com')
+        scopes = [user_scope(ann.id), user_scope(other_thread.participant_one_id)]
+        versions = get_versions(scopes)
+        self.write_input(json.dumps(record) for record in self.records)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_chat()
+        new_versions = get_versions(scopes)
+        self.assertGreater(new_versions[0], versions[0])
+        self.assertEqual(new_versions[1], versions[1])
+        other_thread.refresh_from_db()
+        self.assertIsNone(other_thread.last_message)
+
+    def test_import_reuses_existing_users(self):
+        """Test that users whose email already exists are not duplicated"""
+        user = UserFactory(email='ann@example.com')
+        self.write_input(json.dumps(record) for record in self.records)
+        self.import_chat()
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Message.objects.filter(sender=user).count(), 1)
+
+    def test_import_resume(self):
+        """Test resuming an import after the last committed batch"""
+        lines = [json.dumps(record) for record in self.records]
+        self.write_input(lines[:5] + ['not json'] + lines[5:])
+        with self.assertRaisesRegex(CommandError, 'Line 6'):
+            self.import_chat('--batch-size', '2')
+        self.assertEqual(Message.objects.count(), 1)
+
+        self.write_input(lines[:5] + [''] + lines[5:])
+        self.import_chat('--batch-size', '2', '--resume')
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Thread.objects.count(), 1)
+        self.assertEqual(list(Message.objects.values_list('text', flat=True)), ['Hi', 'Hello', 'Same thread'])
+
+    def test_import_unknown_reference(self):
+        """Test importing a record referring to a record that is not in the input before it"""
+        self.write_input(json.dumps(record) for record in self.records[2:])
+        with self.assertRaisesRegex(CommandError, "Line 1: unknown id 'u2'"):
+            self.import_chat()
+
+
+class ArchiveMessagesCommandTests(TestCase):
+    """Test archive_messages management command"""
+
+    def test_archive(self):
+        """Test archiving messages older than a number of days"""
+        thread = ThreadFactory()
+        Thread.objects.advance_read_marks(MessageFactory.create_batch(3, thread=thread))
+        Message.objects.update(created_at=timezone.now() - datetime.timedelta(days=100))
+        out = StringIO()
+        call_command('archive_messages', '--older-than-days', '30', stdout=out)
+        self.assertIn('Archived 2 messages of 1 threads', out.getvalue())
+
+
+class PurgeMessagesCommandTests(TestCase):
+    """Test purge_messages management command"""
+
+    def setUp(self) -> None:
+        self.thread = ThreadFactory()
+        self.messages = MessageFactory.create_batch(6, thread=self.thread, sender=self.thread.participant_one)
+        now = timezone.now()
+        for message, days in zip(self.messages, (400, 300, 200, 100, 10, 1)):
+            Message.objects.filter(pk=message.pk).update(created_at=now - datetime.timedelta(days=days))
+        Thread.objects.advance_read_marks(self.messages)
+        Thread.objects.refresh_last_message()
+        self.ids = [message.id for message in self.messages]
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_messages', '--older-than-days', '150', '--batch-size', '2', '--pause', '0', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_purge(self):
+        """Test deleting old messages in batches and reporting the rate"""
+        out = self.purge()
+        self.assertIn('rows/s', out)
+        self.assertIn('Purged 3 messages', out)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('id', flat=True)), self.ids[3:])
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.last_message_id, self.ids[-1])
+
+    def test_purge_last_message(self):
+        """Test that threads whose messages are all purged are left without last message"""
+        call_command('purge_messages', '--older-than-days', '0', '--pause', '0', stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 0)
+        self.thread.refresh_from_db()
+        self.assertIsNone(self.thread.last_message)
+        self.assertIsNone(self.thread.last_message_at)
+
+    def test_purge_archive(self):
+        """Test that archived blocks are dropped or rewritten without the old messages"""
+        self.thread.refresh_from_db()
+        self.assertEqual(archive_thread(self.thread, timezone.now() - datetime.timedelta(days=50), block_size=3), 4)
+
+        self.assertIn('Purged 3 messages', self.purge())
+        block = ArchivedMessageBlock.objects.get()
+        self.assertEqual((block.first_message_id, block.min_message_id, block.max_message_id, block.message_count),
+                         (self.ids[3], self.ids[3], self.ids[3], 1))
+        self.assertEqual([message.id for message in unpack_block(block)], [self.ids[3]])
+
+    def test_dry_run(self):
+        """Test counting the messages to purge without deleting them"""
+        self.thread.refresh_from_db()
+        archive_thread(self.thread, timezone.now() - datetime.timedelta(days=250), block_size=3)
+
+        self.assertIn('Would purge 3 messages', self.purge('--dry-run'))
+        self.assertEqual(Message.objects.count() + ArchivedMessageBlock.objects.get().message_count, 6)
+
+    @override_settings(MESSAGE_RETENTION_DAYS=None)
+    def test_without_retention_period(self):
+        """Test purging without a retention period"""
+        with self.assertRaises(CommandError):
+            call_command('purge_messages', stdout=StringIO())
+
+    def test_invalid_batch_size(self):
+        """Test purging with a batch size that is not positive"""
+        for batch_size in ('0', '-1'):
+            with self.assertRaisesRegex(CommandError, '--batch-size'):
+                call_command('purge_messages', '--older-than-days', '30', '--batch-size', batch_size, stdout=StringIO())
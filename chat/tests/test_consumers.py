@@ -0,0 +1,93 @@
+import json
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from chat.consumers import CLOSE_NOT_FOUND, CLOSE_UNAUTHORIZED
+from chat.events import MESSAGE_CREATED, THREAD_READ
+from chat.factories import ThreadFactory
+from simple_chat.asgi import application
+
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+
+
+class ThreadConsumerTests(TestCase):
+    """Test pushing thread events over WebSocket"""
+
+    def setUp(self) -> None:
+        self.thread = ThreadFactory()
+        self.user = self.thread.participant_one
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.thread.participant_two)
+
+    def connect(self, thread_id, query_string):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'websocket',
+            'path': f'/ws/chat/thread/{thread_id}/',
+            'query_string': query_string.encode(),
+            'headers': [],
+        })
+        return communicator
+
+    def request(self, method, *args, **kwargs):
+        """Send API request and run on commit callbacks, which publish events, as a real request would"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(*args, **kwargs)
+
+    async def test_push_created_message_and_read_state(self):
+        """Test that subscribers of a thread receive created messages and read state changes"""
+        communicator = self.connect(self.thread.id, f'token={self.token.key}')
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(timeout=1))['type'], 'websocket.accept')
+
+        await sync_to_async(self.request)(
+            'post', CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Test message', 'thread': self.thread.id})
+        output = await communicator.receive_output(timeout=1)
+        event = json.loads(output['text'])
+        self.assertEqual(event['type'], MESSAGE_CREATED)
+        self.assertEqual(event['message']['text'], 'Test message')
+        self.assertEqual(event['message']['sender']['id'], self.thread.participant_two_id)
+
+        message_id = event['message']['id']
+        # Only the recipient of a message can read it
+        self.client.force_authenticate(user=self.user)
+        await sync_to_async(self.request)(
+            'patch', reverse('chat:mark_thread_as_read', kwargs={'pk': self.thread.id}), {'up_to': message_id})
+        event = json.loads((await communicator.receive_output(timeout=1))['text'])
+        self.assertEqual(event, {'type': THREAD_READ, 'thread': self.thread.id, 'up_to': message_id})
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=1)
+
+    async def test_events_of_other_threads_are_not_pushed(self):
+        """Test that subscribers do not receive events of other threads"""
+        other_thread = await sync_to_async(ThreadFactory)(participant_one=self.user)
+        communicator = self.connect(self.thread.id, f'token={self.token.key}')
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output(timeout=1)
+
+        await sync_to_async(self.request)(
+            'post', CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Test message', 'thread': other_thread.id})
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=1)
+
+    async def test_connect_without_token_fail(self):
+        """Test that a WebSocket without a valid token is rejected"""
+        communicator = self.connect(self.thread.id, 'token=invalid')
+        await communicator.send_input({'type': 'websocket.connect'})
+        output = await communicator.receive_output(timeout=1)
+        self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+
+    async def test_connect_to_foreign_thread_fail(self):
+        """Test that only participants may subscribe to a thread"""
+        thread = await sync_to_async(ThreadFactory)()
+        communicator = self.connect(thread.id, f'token={self.token.key}')
+        await communicator.send_input({'type': 'websocket.connect'})
+        output = await communicator.receive_output(timeout=1)
+        self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from chat.export import export_thread_messages
+from chat.factories import ThreadFactory, MessageFactory
+from chat.serializers import MessageSerializer
+from user.factories import UserFactory
+
+
+def export_thread_url(thread_id):
+    return reverse('chat:export_thread', kwargs={'pk': thread_id})
+
+
+class ExportThreadApiTests(TestCase):
+    """Test streaming export of thread history"""
+
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.thread = ThreadFactory(participant_one=self.user)
+        self.messages = [
+            MessageFactory(thread=self.thread, sender=sender, text=f'Message {number} ✓')
+            for number, sender in enumerate((self.thread.participant_one, self.thread.participant_two) * 3)
+        ]
+        MessageFactory(text='Message of another thread')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_export_thread_unauthenticated_fail(self):
+        """Test exporting a thread with an unauthenticated user"""
+        res = APIClient().get(export_thread_url(self.thread.id))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export_thread_success(self):
+        """Test exporting a thread as NDJSON in chronological order"""
+        res = self.client.get(export_thread_url(self.thread.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(res['Content-Disposition'], f'attachment; filename="thread-{self.thread.id}.ndjson"')
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], MessageSerializer(self.messages, many=True).data)
+
+    def test_export_thread_gzip_success(self):
+        """Test exporting a thread compressed with gzip"""
+        res = self.client.get(export_thread_url(self.thread.id), {'gzip': 'true'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        self.assertEqual(res['Content-Disposition'], f'attachment; filename="thread-{self.thread.id}.ndjson.gz"')
+        lines = gzip.decompress(b''.join(res.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [message.id for message in self.messages])
+
+    def test_export_thread_of_other_users_fail(self):
+        """Test exporting a thread the user does not participate in"""
+        res = self.client.get(export_thread_url(ThreadFactory().id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_thread_of_other_users_by_staff_success(self):
+        """Test exporting any thread by a staff user"""
+        self.client.force_authenticate(UserFactory(is_staff=True))
+        res = self.client.get(export_thread_url(self.thread.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_export_in_chunks(self):
+        """Test that messages are read and written a chunk at a time"""
+        chunks = list(export_thread_messages(self.thread.id, chunk_size=4))
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [4, 2])
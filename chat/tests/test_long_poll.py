@@ -0,0 +1,81 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from chat.factories import ThreadFactory, MessageFactory
+
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+WAIT_FOR_MESSAGES_URL = reverse('chat:wait_for_messages')
+
+
+class WaitForMessagesTests(TestCase):
+    """Test long-polling for new messages of a thread"""
+
+    def setUp(self) -> None:
+        self.thread = ThreadFactory()
+        self.message = MessageFactory(thread=self.thread, sender=self.thread.participant_one)
+        self.token = Token.objects.create(user=self.thread.participant_two)
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.thread.participant_one)
+
+    def post_message(self):
+        """Post message and run on commit callbacks, which publish events, as a real request would"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'New message', 'thread': self.thread.id})
+
+    async def wait_for_messages(self, **params):
+        params = {'thread_id': self.thread.id, 'after': self.message.id, **params}
+        return await self.async_client.get(WAIT_FOR_MESSAGES_URL, params, headers=self.headers)
+
+    async def test_wakes_up_on_new_message(self):
+        """Test that a waiting request returns the message posted while it waits"""
+        request = asyncio.ensure_future(self.wait_for_messages(timeout=5))
+        await asyncio.sleep(0.1)
+        self.assertFalse(request.done())
+
+        await sync_to_async(self.post_message)()
+        res = await asyncio.wait_for(request, timeout=1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['text'] for m in res.json()['results']], ['New message'])
+
+    async def test_returns_at_once_if_newer_messages_exist(self):
+        """Test that the request does not wait if there already are newer messages"""
+        newer = await sync_to_async(MessageFactory)(thread=self.thread)
+        res = await asyncio.wait_for(self.wait_for_messages(timeout=5), timeout=1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['id'] for m in res.json()['results']], [newer.id])
+
+    async def test_returns_empty_list_on_timeout(self):
+        """Test that the request returns an empty message list when nothing is posted before the timeout"""
+        res = await self.wait_for_messages(timeout=0.1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['results'], [])
+
+    async def test_wait_without_after_fail(self):
+        """Test waiting for messages without the last known message"""
+        res = await self.async_client.get(WAIT_FOR_MESSAGES_URL, {'thread_id': self.thread.id}, headers=self.headers)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_wait_invalid_timeout_fail(self):
+        """Test waiting for messages with a timeout that is not a finite number"""
+        for timeout in ('nan', 'inf', '-inf', '1e999', 'soon', ''):
+            with self.subTest(timeout=timeout):
+                res = await self.wait_for_messages(timeout=timeout)
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_negative_timeout_returns_at_once(self):
+        """Test that a negative timeout is clamped to not waiting at all"""
+        res = await asyncio.wait_for(self.wait_for_messages(timeout=-5), timeout=1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['results'], [])
+
+    async def test_wait_unauthenticated_fail(self):
+        """Test waiting for messages with an unauthenticated user"""
+        res = await self.async_client.get(WAIT_FOR_MESSAGES_URL, {'thread_id': self.thread.id, 'after': self.message.id})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,21 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from chat.search import missing_search_index_triggers
+
+
+class ReadMarksMigrationTests(TransactionTestCase):
+    """Test migrating read marks backwards and forwards"""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+
+    def test_search_index_triggers_survive_round_trip(self):
+        """Test that rebuilding the message table when migrating backwards keeps the search index triggers"""
+        self.migrate(('chat', '0008_archived_message_block'))
+        self.assertEqual(missing_search_index_triggers(), [])
+        self.migrate(('chat', '0009_read_marks'))
+        self.assertEqual(missing_search_index_triggers(), [])
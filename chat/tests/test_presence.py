@@ -0,0 +1,125 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from chat.constants import PRESENCE_TIMEOUT, TYPING_TIMEOUT
+from chat.factories import ThreadFactory
+from chat.presence import CachePresenceStore, InMemoryPresenceStore
+from core.testing import FakeClock
+
+PRESENCE_HEARTBEAT_URL = reverse('chat:presence_heartbeat')
+RETRIEVE_PRESENCE_URL = reverse('chat:retrieve_presence')
+
+
+class PresenceTests(TestCase):
+    """Test presence and typing heartbeats and queries"""
+    store_class = InMemoryPresenceStore
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.clock = FakeClock()
+        patcher = patch('chat.views.get_presence_store', return_value=self.store_class(clock=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.thread = ThreadFactory()
+        self.user = self.thread.participant_one
+        self.other_user = self.thread.participant_two
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def heartbeat(self, typing=False, thread=None):
+        return self.client.post(PRESENCE_HEARTBEAT_URL, {'thread': (thread or self.thread).id, 'typing': typing})
+
+    def get_presence(self, *threads):
+        res = self.client.get(RETRIEVE_PRESENCE_URL, {'thread_id': [thread.id for thread in threads or [self.thread]]})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.json()
+
+    def get_state(self, user):
+        participants = self.get_presence()[0]['participants']
+        return next(state for state in participants if state['user'] == user.id)
+
+    def test_heartbeat_does_not_write_to_database(self):
+        """Test that a heartbeat only reads the participants of the thread"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.heartbeat(typing=True)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('SELECT'))
+
+    def test_presence_of_participants(self):
+        """Test that participants are online and typing after their heartbeats only"""
+        self.heartbeat(typing=True)
+
+        self.assertEqual(self.get_presence(), [{
+            'thread': self.thread.id,
+            'participants': [
+                {'user': self.user.id, 'online': True, 'typing': True, 'last_seen': '2023-11-14T22:13:20Z'},
+                {'user': self.other_user.id, 'online': False, 'typing': False, 'last_seen': None},
+            ],
+        }])
+
+    def test_expiry(self):
+        """Test that typing and then presence expire without heartbeats"""
+        self.heartbeat(typing=True)
+
+        self.clock.now += TYPING_TIMEOUT
+        self.assertEqual(self.get_state(self.user)['typing'], False)
+        self.assertEqual(self.get_state(self.user)['online'], True)
+
+        self.heartbeat(typing=True)
+        self.heartbeat(typing=False)
+        self.assertEqual(self.get_state(self.user)['typing'], False)
+
+        self.clock.now += PRESENCE_TIMEOUT
+        self.assertEqual(self.get_state(self.user)['online'], False)
+
+    def test_batch_query(self):
+        """Test querying several threads at once"""
+        thread = ThreadFactory(participant_one=self.user)
+        self.heartbeat(thread=thread)
+
+        with self.assertNumQueries(1):
+            presence = self.get_presence(self.thread, thread)
+
+        self.assertEqual([item['thread'] for item in presence], [self.thread.id, thread.id])
+        self.assertEqual([state['online'] for item in presence for state in item['participants']],
+                         [False, False, True, False])
+
+    def test_other_threads_rejected(self):
+        """Test that heartbeats and queries are limited to threads of authenticated user"""
+        thread = ThreadFactory()
+
+        res = self.heartbeat(thread=thread)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {'thread': [f'Unknown threads: [{thread.id}]']})
+
+        res = self.client.get(RETRIEVE_PRESENCE_URL, {'thread_id': [self.thread.id, thread.id]})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {'thread_id': [f'Unknown threads: [{thread.id}]']})
+
+
+class CachePresenceTests(PresenceTests):
+    """Test presence kept in the cache"""
+    store_class = CachePresenceStore
+
+
+class InMemoryPresenceStoreTests(TestCase):
+    """Test the in-memory presence store"""
+
+    def test_sweep(self):
+        """Test that entries of users who went away are dropped"""
+        clock = FakeClock()
+        store = InMemoryPresenceStore(clock=clock)
+        store.heartbeat(1, 1)
+        clock.now += PRESENCE_TIMEOUT
+        store.heartbeat(1, 2)
+
+        self.assertEqual(list(store.entries), ['chat.presence.1.2'])
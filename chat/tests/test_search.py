@@ -0,0 +1,131 @@
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from chat.checks import check_search_index_triggers
+from chat.factories import ThreadFactory, MessageFactory
+from chat.search import build_match_expression, missing_search_index_triggers, rebuild_search_index, search_messages
+from user.factories import UserFactory
+
+SEARCH_MESSAGES_URL = reverse('chat:search_messages')
+
+
+class SearchMessagesApiTests(TestCase):
+    """Test full-text search of messages"""
+
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.thread = ThreadFactory(participant_one=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query, **params):
+        return self.client.get(SEARCH_MESSAGES_URL, {'q': query, **params})
+
+    def test_search_unauthenticated_fail(self):
+        """Test searching messages with an unauthenticated user"""
+        res = APIClient().get(SEARCH_MESSAGES_URL, {'q': 'hello'})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_search_success(self):
+        """Test that messages containing all words are found with a snippet, best match first"""
+        weak = MessageFactory(thread=self.thread, text='Lunch tomorrow? The pizza place near the office is good')
+        strong = MessageFactory(thread=self.thread, text='Pizza, pizza and more pizza for lunch')
+        MessageFactory(thread=self.thread, text='Pizza is overrated')
+        res = self.search('pizza LUNCH')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = res.json()['results']
+        self.assertEqual([result['id'] for result in results], [strong.id, weak.id])
+        self.assertEqual(results[0]['sender']['id'], strong.sender_id)
+        self.assertIn('<mark>Pizza</mark>', results[0]['snippet'])
+        self.assertLess(results[0]['rank'], results[1]['rank'])
+
+    def test_snippet_is_escaped(self):
+        """Test that markup of the message text is escaped in the snippet while matches are highlighted"""
+        MessageFactory(thread=self.thread, text='<img src=x onerror=alert(1)> pizza & <b>beer</b>')
+        res = self.search('pizza')
+        self.assertEqual(res.json()['results'][0]['snippet'],
+                         '&lt;img src=x onerror=alert(1)&gt; <mark>pizza</mark> &amp; &lt;b&gt;beer&lt;/b&gt;')
+
+    def test_search_only_own_threads(self):
+        """Test that messages of threads the user does not participate in are not found"""
+        own = MessageFactory(thread=ThreadFactory(participant_two=self.user), text='Secret plan')
+        MessageFactory(text='Secret plan')
+        res = self.search('secret')
+        self.assertEqual([result['id'] for result in res.json()['results']], [own.id])
+
+    def test_search_follows_updates_and_deletes(self):
+        """Test that the index is kept in sync with edited and deleted messages"""
+        edited = MessageFactory(thread=self.thread, text='Meet at noon')
+        deleted = MessageFactory(thread=self.thread, text='Meet at the station')
+        edited.text = 'See you at eight'
+        edited.save()
+        deleted.delete()
+        self.assertEqual(self.search('meet').json()['results'], [])
+        self.assertEqual(len(self.search('eight').json()['results']), 1)
+
+    def test_search_special_characters(self):
+        """Test that FTS5 query syntax in user input is searched for literally"""
+        message = MessageFactory(thread=self.thread, text='Is it "NOT" AND or OR?')
+        res = self.search('"not" AND (or*')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['id'] for result in res.json()['results']], [message.id])
+
+    def test_search_without_words_fail(self):
+        """Test searching without any word to search for"""
+        for query in ('', '  ', '?!'):
+            res = self.search(query)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_pagination(self):
+        """Test following next links through all results"""
+        messages = MessageFactory.create_batch(5, thread=self.thread, text='Same text')
+        found = []
+        res = self.search('same', limit=2)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            found += [result['id'] for result in res.json()['results']]
+            if res.json()['next'] is None:
+                break
+            res = self.client.get(res.json()['next'])
+        self.assertEqual(found, [message.id for message in messages])
+
+    def test_search_invalid_cursor_fail(self):
+        """Test searching with a cursor that was not returned by the API"""
+        res = self.search('same', cursor='not-a-cursor')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SearchIndexTests(TestCase):
+    """Test maintenance of the search index"""
+
+    def test_build_match_expression(self):
+        """Test that words of user input are quoted"""
+        self.assertEqual(build_match_expression('hello, "world" OR*'), '"hello" "world" "OR"')
+        self.assertIsNone(build_match_expression('***'))
+
+    def test_rebuild_search_index(self):
+        """Test that rebuilding indexes messages missing from the index"""
+        thread = ThreadFactory()
+        message = MessageFactory(thread=thread, text='Hello world')
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('delete-all')")
+        self.assertEqual(search_messages(thread.participant_one, 'hello', 10), [])
+        rebuild_search_index()
+        self.assertEqual(search_messages(thread.participant_one, 'hello', 10), [message])
+
+    def test_search_index_triggers(self):
+        """Test that the triggers keeping the index in sync survived the migrations rebuilding the message table"""
+        self.assertEqual(missing_search_index_triggers(), [])
+        self.assertEqual(check_search_index_triggers(None, databases=['default']), [])
+
+    def test_missing_search_index_trigger_warning(self):
+        """Test that the system check reports a dropped trigger"""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER chat_message_fts_update')
+        warnings = check_search_index_triggers(None, databases=['default'])
+        self.assertEqual([warning.id for warning in warnings], ['chat.W001'])
+        self.assertIn('chat_message_fts_update', warnings[0].msg)
@@ -0,0 +1,101 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from chat.constants import MAX_MESSAGES_PER_BATCH
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import Message, Thread
+from chat.pubsub import thread_channel
+from user.factories import UserFactory
+
+SEND_MESSAGES_URL = reverse('chat:send_messages')
+
+
+class SendMessagesApiTests(TestCase):
+    """Test sending messages in batches"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = UserFactory()
+        self.threads = ThreadFactory.create_batch(3, participant_one=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_send_messages_unauthenticated_fail(self):
+        """Test sending messages with an unauthenticated user"""
+        res = APIClient().post(SEND_MESSAGES_URL, {'thread': self.threads[0].id, 'texts': ['Hi']}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_send_many_messages_to_thread_success(self):
+        """Test sending many messages to a thread with a constant number of queries"""
+        thread = self.threads[0]
+        MessageFactory(thread=thread, sender=self.user)
+        texts = [f'Message {number}' for number in range(20)]
+        # Participants lookup of the thread throttle, thread lookup, insert, last message update and a savepoint
+        with self.assertNumQueries(6):
+            res = self.client.post(SEND_MESSAGES_URL, {'thread': thread.id, 'texts': texts}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        ids = res.json()['ids']
+        self.assertEqual(list(Message.objects.filter(id__in=ids).order_by('id').values_list('text', flat=True)), texts)
+        self.assertEqual(sorted(ids), ids)
+        thread.refresh_from_db()
+        self.assertEqual(thread.last_message_id, ids[-1])
+        self.assertEqual(list(Thread.objects.unread_counts(self.user)), [(thread.id, 21)])
+
+    def test_broadcast_message_success(self):
+        """Test sending a message to many threads, ids being returned in request order"""
+        thread_ids = [thread.id for thread in reversed(self.threads)]
+        MessageFactory(thread=self.threads[1], sender=self.user)
+        # Same queries as for a batch to one thread, the thread throttle looking up all threads at once
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(6):
+            res = self.client.post(SEND_MESSAGES_URL, {'threads': thread_ids, 'text': 'Hello all'}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        ids = res.json()['ids']
+        self.assertEqual(list(Message.objects.filter(id__in=ids).values_list('thread', flat=True)), thread_ids)
+        self.assertEqual(
+            dict(Thread.objects.filter(id__in=thread_ids).values_list('id', 'last_message')), dict(zip(thread_ids, ids)))
+
+    def test_broadcast_message_publishes_events(self):
+        """Test that every sent message is published to subscribers of its thread"""
+        with patch('chat.events.get_pubsub') as get_pubsub, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                SEND_MESSAGES_URL, {'threads': [thread.id for thread in self.threads], 'text': 'Hi'}, format='json')
+        published = [
+            (channel, event['message']['id']) for (channel, event), _ in get_pubsub().publish.call_args_list]
+        self.assertEqual(published, [
+            (thread_channel(thread.id), message_id) for thread, message_id in zip(self.threads, res.json()['ids'])])
+
+    def test_send_messages_invalid_payload_fail(self):
+        """Test sending messages with payloads mixing or missing modes, unknown threads or too many messages"""
+        thread_id = self.threads[0].id
+        for payload in (
+                {},
+                {'thread': thread_id},
+                {'thread': thread_id, 'texts': []},
+                {'thread': thread_id, 'texts': ['Hi'], 'text': 'Hi'},
+                {'threads': [thread_id], 'texts': ['Hi']},
+                {'threads': [thread_id, 0], 'text': 'Hi'},
+                {'thread': 0, 'texts': ['Hi']},
+                {'thread': thread_id, 'texts': ['Hi'] * (MAX_MESSAGES_PER_BATCH + 1)},
+        ):
+            res = self.client.post(SEND_MESSAGES_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, payload)
+        self.assertEqual(Message.objects.count(), 0)
+
+
+    def test_send_messages_to_threads_of_others_fail(self):
+        """Test sending messages to threads the user does not take part in"""
+        foreign = ThreadFactory.create_batch(2)
+        res = self.client.post(SEND_MESSAGES_URL, {'threads': [self.threads[0].id, *(thread.id for thread in foreign)],
+                                                   'text': 'Hi'}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json(), {'threads': [f'Unknown threads: {[thread.id for thread in foreign]}']})
+
+        res = self.client.post(SEND_MESSAGES_URL, {'thread': foreign[0].id, 'texts': ['Hi']}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Message.objects.count(), 0)
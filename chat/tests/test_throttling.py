@@ -0,0 +1,156 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from chat.factories import ThreadFactory
+from core.testing import FakeClock
+from core.throttling import get_rejected_counts, TokenBucketThrottle
+
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+SEND_MESSAGES_URL = reverse('chat:send_messages')
+
+
+@override_settings(THROTTLE_BUCKETS={
+    'message_user': {'capacity': 3, 'refill_rate': 0.5},
+    'message_thread': {'capacity': 4, 'refill_rate': 1},
+})
+class MessageThrottleTests(TestCase):
+    """Test token-bucket throttling of sending messages"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.clock = FakeClock()
+        patcher = patch.object(TokenBucketThrottle, 'timer', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.thread = ThreadFactory()
+        self.user = self.thread.participant_one
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, thread=None):
+        return self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Hi', 'thread': (thread or self.thread).id})
+
+    def test_user_bucket(self):
+        """Test that a burst up to the capacity is allowed and then requests are allowed at the refill rate"""
+        for _ in range(3):
+            self.assertEqual(self.send(thread=ThreadFactory(participant_one=self.user)).status_code,
+                             status.HTTP_201_CREATED)
+
+        res = self.send()
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '2')
+
+        # Rejected requests do not take tokens
+        self.clock.now += 1.5
+        self.assertEqual(self.send().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.clock.now += 0.5
+        self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.send().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.clock.now += 60
+        for _ in range(3):
+            self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+
+    def test_thread_bucket(self):
+        """Test that both participants of a thread share its bucket"""
+        other_client = APIClient()
+        other_client.force_authenticate(self.thread.participant_two)
+        for client in (self.client, self.client, other_client, other_client):
+            res = client.post(SEND_MESSAGES_URL, {'thread': self.thread.id, 'texts': ['Hi']}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = other_client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Hi', 'thread': self.thread.id})
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '1')
+        self.assertEqual(self.send(thread=ThreadFactory(participant_one=self.user)).status_code,
+                         status.HTTP_201_CREATED)
+
+    def test_batch_takes_token_per_message(self):
+        """Test that a batch takes a token per message, also beyond the capacity of the buckets"""
+        res = self.client.post(SEND_MESSAGES_URL, {'thread': self.thread.id, 'texts': ['Hi'] * 3}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = self.send()
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '2')
+
+        # A batch beyond the capacity is allowed with full buckets and empties them for longer
+        self.clock.now += 6
+        res = self.client.post(SEND_MESSAGES_URL, {'thread': self.thread.id, 'texts': ['Hi'] * 10}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        # The batch took 10 tokens, 20 seconds of refill of the sender bucket and 10 of the thread bucket
+        res = self.send()
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '16')
+        self.clock.now += 16
+        self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+
+    def test_broadcast_takes_token_of_every_thread(self):
+        """Test that a broadcast takes a token from the bucket of every thread and none if one of them is empty"""
+        other_thread = ThreadFactory(participant_one=self.user)
+        other_client = APIClient()
+        other_client.force_authenticate(self.thread.participant_two)
+        res = other_client.post(SEND_MESSAGES_URL, {'thread': self.thread.id, 'texts': ['Hi'] * 4}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.client.post(SEND_MESSAGES_URL, {'threads': [other_thread.id, self.thread.id], 'text': 'Hi'},
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '1')
+        self.assertEqual(get_rejected_counts(), {'message_user': 0, 'message_thread': 1})
+
+        # The token taken from the bucket of the other thread was given back
+        self.clock.now += 10
+        res = self.client.post(SEND_MESSAGES_URL, {'threads': [other_thread.id, self.thread.id], 'text': 'Hi'},
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        other_client.force_authenticate(other_thread.participant_two)
+        res = other_client.post(SEND_MESSAGES_URL, {'thread': other_thread.id, 'texts': ['Hi'] * 3}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = other_client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Hi', 'thread': other_thread.id})
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_other_users_do_not_use_up_thread_bucket(self):
+        """Test that requests to threads of other users do not take tokens of their buckets"""
+        other_thread = ThreadFactory()
+        for _ in range(3):
+            self.send(thread=other_thread)
+            self.clock.now += 2
+
+        other_client = APIClient()
+        other_client.force_authenticate(other_thread.participant_one)
+        res = other_client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Hi', 'thread': other_thread.id})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_rejected_counts(), {'message_user': 0, 'message_thread': 0})
+
+    def test_reading_messages_is_not_throttled(self):
+        """Test that retrieving the message list takes no tokens"""
+        for _ in range(5):
+            res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': self.thread.id})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+
+    def test_rejected_counts(self):
+        """Test counting rejected requests per scope and reporting them"""
+        for _ in range(5):
+            self.send()
+
+        # Every throttle of a view checks every request, so the thread bucket runs out at the fifth request
+        self.assertEqual(get_rejected_counts(), {'message_user': 2, 'message_thread': 1})
+        out = StringIO()
+        call_command('throttle_stats', '--reset', stdout=out)
+        self.assertEqual(out.getvalue(), 'message_user: 2 rejected\nmessage_thread: 1 rejected\n')
+        self.assertEqual(get_rejected_counts(), {'message_user': 0, 'message_thread': 0})
+
+    @override_settings(THROTTLE_BUCKETS={})
+    def test_unconfigured_scopes_are_not_throttled(self):
+        """Test that scopes missing from the settings do not limit requests"""
+        for _ in range(10):
+            self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
@@ -1,5 +1,8 @@
+from django.db import IntegrityError
+from django.db.models import Q, Value
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -7,6 +10,15 @@ from rest_framework import status
 from chat.constants import NUM_OF_ITEMS_PER_PAGE
 from chat.factories import ThreadFactory, MessageFactory
 from chat.models import Thread, Message
+from chat.serializers import (
+    FastInboxThreadSerializer,
+    FastMessageSerializer,
+    FastThreadSerializer,
+    InboxThreadSerializer,
+    MessageSerializer,
+    ThreadReadSerializer,
+)
+from core.testing import QueryBudgetMixin
 from user.factories import UserFactory
 
 CREATE_RETRIEVE_THREAD_URL = reverse('chat:create_retrieve_thread')
@@ -69,6 +81,13 @@ class PublicChatApiTests(TestCase):
         res = self.client.patch(reverse('chat:mark_message_as_read', kwargs={'pk': message.id}))
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_mark_thread_as_read_fail(self):
+        """Test marking a thread as read with an unauthenticated user"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        message = MessageFactory(thread=thread)
+        res = self.client.patch(reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id}), {'up_to': message.id})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_retrieve_number_of_unread_messages_fail(self):
         """Test retrieving number of unread messages with an unauthenticated user"""
         thread = ThreadFactory()
@@ -115,6 +134,33 @@ class PrivateChatApiTests(TestCase):
         self.assertEqual(res.json().get('participant_one').get('id'), participant_one.id)
         self.assertEqual(res.json().get('participant_two').get('id'), participant_two.id)
 
+    def test_retrieve_thread_reversed_pair_success(self):
+        """Test retrieving already existing thread when trying to create it
+        with the same pair of members in reversed order with an authenticated user"""
+        participant_one = UserFactory.create()
+        participant_two = UserFactory.create()
+        thread = ThreadFactory(participant_one=participant_one, participant_two=participant_two)
+        payload = {
+            'participant_one': participant_two.id,
+            'participant_two': participant_one.id,
+        }
+        # Two queries to validate the participants and a single one to find the thread
+        with self.assertNumQueries(3):
+            res = self.client.post(CREATE_RETRIEVE_THREAD_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Thread.objects.count(), 1)
+        self.assertEqual(res.json().get('id'), thread.id)
+
+    def test_create_thread_with_same_participants_fail(self):
+        """Test creating a thread for a user with themselves with an authenticated user"""
+        payload = {
+            'participant_one': self.user.id,
+            'participant_two': self.user.id,
+        }
+        res = self.client.post(CREATE_RETRIEVE_THREAD_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Thread.objects.count(), 0)
+
     def test_remove_thread_success(self):
         """Test removing a thread with an authenticated user"""
         ThreadFactory.create()
@@ -142,6 +188,26 @@ class PrivateChatApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.json()['results']), 1)
 
+    def test_retrieve_thread_list_inbox_success(self):
+        """Test retrieving thread list with last messages and number of unread messages,
+        most recently active thread first, with an authenticated user"""
+        quiet_thread, active_thread, empty_thread = ThreadFactory.create_batch(3, participant_one=self.user)
+        MessageFactory.create(thread=active_thread, sender=self.user)
+        MessageFactory.create(thread=quiet_thread, sender=self.user)
+        last_message = MessageFactory.create(thread=active_thread, sender=self.user)
+        with self.assertNumQueries(2):
+            res = self.client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.user.id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = res.json()['results']
+        self.assertEqual([t['id'] for t in results], [active_thread.id, quiet_thread.id, empty_thread.id])
+        self.assertEqual(results[0]['last_message']['id'], last_message.id)
+        self.assertEqual(results[0]['last_message']['sender']['id'], self.user.id)
+        self.assertEqual(results[0]['number_of_unread_messages'], 2)
+        self.assertEqual(results[1]['number_of_unread_messages'], 1)
+        self.assertIsNone(results[2]['last_message'])
+        self.assertIsNone(results[2]['last_message_at'])
+        self.assertEqual(results[2]['number_of_unread_messages'], 0)
+
     def test_create_message_success(self):
         """Test creating a message with an authenticated user"""
         thread = ThreadFactory.create()
@@ -175,6 +241,39 @@ class PrivateChatApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.json()['results']), 1)
 
+    def test_retrieve_message_list_cursor_mode_success(self):
+        """Test scrolling back through message list with before cursors with an authenticated user"""
+        thread = ThreadFactory.create()
+        messages = MessageFactory.create_batch(NUM_OF_ITEMS_PER_PAGE + 1, thread=thread)
+        MessageFactory.create(thread=ThreadFactory.create())
+        res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': thread.id, 'mode': 'cursor'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', res.json())
+        self.assertEqual([m['id'] for m in res.json()['results']], [m.id for m in messages[1:]])
+        self.assertIsNone(res.json()['previous'])
+
+        res = self.client.get(res.json()['next'])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['id'] for m in res.json()['results']], [messages[0].id])
+        self.assertIsNone(res.json()['next'])
+        self.assertIsNotNone(res.json()['previous'])
+
+    def test_retrieve_message_list_after_cursor_success(self):
+        """Test retrieving messages newer than a particular message with an authenticated user"""
+        thread = ThreadFactory.create()
+        messages = MessageFactory.create_batch(3, thread=thread)
+        res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': thread.id, 'after': messages[0].id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['id'] for m in res.json()['results']], [m.id for m in messages[1:]])
+        self.assertIsNone(res.json()['previous'])
+
+    def test_retrieve_message_list_invalid_cursor_fail(self):
+        """Test retrieving message list with a cursor from another thread with an authenticated user"""
+        thread = ThreadFactory.create()
+        message = MessageFactory.create()
+        res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': thread.id, 'before': message.id})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_mark_message_as_read_success(self):
         """Test marking message as read with an authenticated user"""
         thread = ThreadFactory.create(participant_one=self.user)
@@ -187,9 +286,249 @@ class PrivateChatApiTests(TestCase):
 
     def test_retrieve_number_of_unread_messages_success(self):
         """Test retrieving number of unread messages with an authenticated user"""
-        thread = ThreadFactory()
+        thread = ThreadFactory(participant_one=self.user)
+        Thread.objects.advance_read_marks(MessageFactory.create_batch(2, thread=thread, sender=self.user))
         MessageFactory.create_batch(2, thread=thread, sender=self.user)
-        MessageFactory.create_batch(2, thread=thread, sender=self.user, is_read=True)
         res = self.client.get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.json().get('number_of_unread_messages'), 2)
+
+    def test_retrieve_number_of_unread_messages_per_thread_success(self):
+        """Test retrieving number of unread messages for each thread with an authenticated user"""
+        thread_one, thread_two = ThreadFactory.create_batch(2, participant_one=self.user)
+        MessageFactory.create_batch(2, thread=thread_one, sender=self.user)
+        MessageFactory.create(thread=thread_two, sender=self.user)
+        MessageFactory.create(thread=thread_two)
+        with self.assertNumQueries(1):
+            res = self.client.get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES, {'per_thread': 'true'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json().get('number_of_unread_messages'), 3)
+        self.assertEqual(res.json().get('threads'), [
+            {'thread': thread_one.id, 'number_of_unread_messages': 2},
+            {'thread': thread_two.id, 'number_of_unread_messages': 1},
+        ])
+
+    def test_unread_counter_follows_created_and_read_messages(self):
+        """Test that number of unread messages is updated when messages are created and marked as read"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Test message', 'thread': thread.id})
+        self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'text': 'Test message', 'thread': thread.id})
+        res = self.client.get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES)
+        self.assertEqual(res.json().get('number_of_unread_messages'), 2)
+
+        message = Message.objects.first()
+        self.client.force_authenticate(thread.participant_two)
+        self.client.patch(reverse('chat:mark_message_as_read', kwargs={'pk': message.id}))
+        self.client.patch(reverse('chat:mark_message_as_read', kwargs={'pk': message.id}))
+        self.client.force_authenticate(self.user)
+        res = self.client.get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES)
+        self.assertEqual(res.json().get('number_of_unread_messages'), 1)
+
+    def test_mark_own_message_as_read(self):
+        """Test that marking a message of the authenticated user as read leaves it unread"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        message = MessageFactory(thread=thread, sender=self.user)
+        res = self.client.patch(reverse('chat:mark_message_as_read', kwargs={'pk': message.id}))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['is_read'], False)
+        self.assertEqual(list(Thread.objects.unread_counts(self.user)), [(thread.id, 1)])
+
+    def test_mark_message_of_other_thread_as_read_fail(self):
+        """Test marking a message of a thread of other users as read with an authenticated user"""
+        message = MessageFactory()
+        res = self.client.patch(reverse('chat:mark_message_as_read', kwargs={'pk': message.id}))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_mark_thread_as_read_success(self):
+        """Test marking all messages of a thread up to a particular message as read with an authenticated user"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        messages = MessageFactory.create_batch(3, thread=thread, sender=thread.participant_two)
+        other_message = MessageFactory.create(sender=thread.participant_two)
+        res = self.client.patch(
+            reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id}), {'up_to': messages[1].id})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), {
+            'thread': thread.id,
+            'number_of_marked_messages': 2,
+            'number_of_unread_messages': 1,
+        })
+        self.assertEqual(
+            list(Message.objects.with_read_state().order_by('id').values_list('is_read', flat=True)),
+            [True, True, False, False])
+        self.assertEqual(list(Thread.objects.unread_counts(thread.participant_two)), [(thread.id, 1)])
+
+    def test_mark_thread_as_read_keeps_read_mark(self):
+        """Test that the read mark neither moves backwards nor past messages sent after the given message"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        messages = MessageFactory.create_batch(2, thread=thread, sender=thread.participant_two)
+        url = reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id})
+        self.client.patch(url, {'up_to': messages[1].id})
+        res = self.client.patch(url, {'up_to': messages[0].id})
+        self.assertEqual(res.json()['number_of_marked_messages'], 0)
+        own_message = MessageFactory(thread=thread, sender=self.user)
+        later_message = MessageFactory(thread=thread, sender=thread.participant_two)
+        res = self.client.patch(url, {'up_to': own_message.id})
+        self.assertEqual(res.json()['number_of_marked_messages'], 0)
+        # Own messages unread by the other participant are not unread messages of the user
+        self.assertEqual(res.json()['number_of_unread_messages'], 1)
+        later_message.refresh_from_db()
+        self.assertEqual(later_message.is_read, False)
+
+    def test_mark_whole_thread_as_read(self):
+        """Test that no messages are unread after marking a thread as read while the own ones are still unread"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        MessageFactory.create_batch(2, thread=thread, sender=self.user)
+        last_message = MessageFactory(thread=thread, sender=thread.participant_two)
+        res = self.client.patch(
+            reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id}), {'up_to': last_message.id})
+        self.assertEqual(res.json()['number_of_marked_messages'], 1)
+        self.assertEqual(res.json()['number_of_unread_messages'], 0)
+
+    def test_mark_thread_of_other_users_as_read_fail(self):
+        """Test marking a thread of other users as read with an authenticated user"""
+        thread = ThreadFactory.create()
+        message = MessageFactory.create(thread=thread, sender=thread.participant_one)
+        res = self.client.patch(reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id}), {'up_to': message.id})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_mark_thread_as_read_without_message_fail(self):
+        """Test marking a thread as read without the last message to mark with an authenticated user"""
+        thread = ThreadFactory.create(participant_one=self.user)
+        res = self.client.patch(reverse('chat:mark_thread_as_read', kwargs={'pk': thread.id}), {})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test that list endpoints run a constant number of queries no matter the page contents"""
+
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retrieve_thread_list_query_budget(self):
+        """Test retrieving a full page of threads with different participants and last messages"""
+        for thread in ThreadFactory.create_batch(NUM_OF_ITEMS_PER_PAGE, participant_one=self.user):
+            MessageFactory.create(thread=thread, sender=thread.participant_two)
+        with self.assertMaxNumQueries(2):
+            res = self.client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.user.id})
+        self.assertEqual(len(res.json()['results']), NUM_OF_ITEMS_PER_PAGE)
+
+    def test_retrieve_message_list_query_budget(self):
+        """Test retrieving a full page of messages from both participants"""
+        thread = ThreadFactory(participant_one=self.user)
+        for sender in (thread.participant_one, thread.participant_two) * (NUM_OF_ITEMS_PER_PAGE // 2):
+            MessageFactory.create(thread=thread, sender=sender)
+        with self.assertMaxNumQueries(2):
+            res = self.client.get(CREATE_RETRIEVE_MESSAGE_URL, {'thread_id': thread.id})
+        self.assertEqual(len(res.json()['results']), NUM_OF_ITEMS_PER_PAGE // 2 * 2)
+
+
+class MessageQueryPlanTests(TestCase):
+    """Test that message hot paths are served by indexes and not by full table scans"""
+
+    def setUp(self) -> None:
+        self.message = MessageFactory()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'SEARCH chat_message USING (COVERING )?INDEX {index_name}\b')
+        self.assertNotRegex(plan, r'SCAN (TABLE )?chat_message\b')
+
+    def test_message_list_query_plan(self):
+        """Test that message list of a thread is read in index order"""
+        queryset = Message.objects.filter(thread=self.message.thread).order_by('created_at', 'id')
+        self.assertUsesIndex(queryset, 'message_thread_created_idx')
+        self.assertNotIn('USE TEMP B-TREE', queryset.explain())
+
+    def test_message_list_cursor_query_plan(self):
+        """Test that a cursor page of a thread seeks into the index range"""
+        created_at = self.message.created_at
+        queryset = Message.objects.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=self.message.id),
+            thread=self.message.thread,
+            created_at__lte=created_at,
+        ).order_by('-created_at', '-id')[:NUM_OF_ITEMS_PER_PAGE + 1]
+        self.assertUsesIndex(queryset, 'message_thread_created_idx')
+        self.assertIn('created_at<?', queryset.explain())
+
+    def test_number_of_unread_messages_query_plan(self):
+        """Test that counting unread messages only looks at the messages of a thread after the read mark"""
+        thread = Thread.objects.with_unread_count(self.message.sender).filter(pk=self.message.thread_id)
+        self.assertIn('USING COVERING INDEX message_thread_id_sender_idx (thread_id=? AND id>?)', thread.explain())
+
+    def test_mark_thread_as_read_query_plan(self):
+        """Test that marking a thread as read only looks at the messages between the read mark and the message"""
+        queryset = Message.objects.filter(thread=self.message.thread, id__gt=0, id__lte=self.message.id)
+        self.assertUsesIndex(queryset, 'message_thread_id_sender_idx')
+
+
+class ThreadModelTests(TestCase):
+    """Test thread model"""
+
+    def test_pair_is_stored_in_canonical_order(self):
+        """Test that the participant with the lower id is always stored as participant one"""
+        participant_one = UserFactory()
+        participant_two = UserFactory()
+        thread = ThreadFactory(participant_one=participant_two, participant_two=participant_one)
+        thread.refresh_from_db()
+        self.assertEqual(thread.participant_one_id, participant_one.id)
+        self.assertEqual(thread.participant_two_id, participant_two.id)
+
+    def test_reversed_pair_violates_unique_constraint(self):
+        """Test that the database rejects a second thread for the same pair in reversed order"""
+        thread = ThreadFactory()
+        with self.assertRaises(IntegrityError):
+            Thread.objects.create(participant_one=thread.participant_two, participant_two=thread.participant_one)
+
+    def test_get_or_create_for_pair(self):
+        """Test that a pair of users always resolves to the same thread"""
+        participant_one = UserFactory()
+        participant_two = UserFactory()
+        thread, created = Thread.objects.get_or_create_for_pair(participant_two, participant_one)
+        self.assertTrue(created)
+        with self.assertNumQueries(1):
+            same_thread, created = Thread.objects.get_or_create_for_pair(participant_one, participant_two)
+        self.assertFalse(created)
+        self.assertEqual(same_thread.id, thread.id)
+
+    def test_refresh_last_message(self):
+        """Test that last message of threads can be recomputed from messages"""
+        thread = ThreadFactory()
+        message = MessageFactory(thread=thread)
+        Thread.objects.update(last_message=None, last_message_at=None)
+        Thread.objects.refresh_last_message()
+        thread.refresh_from_db()
+        self.assertEqual(thread.last_message_id, message.id)
+        self.assertEqual(thread.last_message_at, message.created_at)
+
+
+class FastSerializerTests(TestCase):
+    """Test that read-only serializers render the same output as the ModelSerializers"""
+
+    def setUp(self) -> None:
+        self.message = MessageFactory()
+        self.thread = Thread.objects.select_related(
+            'participant_one', 'participant_two', 'last_message__sender').annotate(
+            number_of_unread_messages=Value(1)).get()
+
+    def test_message(self):
+        self.assertEqual(FastMessageSerializer(self.message).data, MessageSerializer(self.message).data)
+
+    def test_thread(self):
+        self.assertEqual(FastThreadSerializer(self.thread).data, ThreadReadSerializer(self.thread).data)
+
+    def test_inbox_thread(self):
+        self.assertEqual(FastInboxThreadSerializer(self.thread).data, InboxThreadSerializer(self.thread).data)
+        self.thread.last_message = None
+        self.thread.last_message_at = None
+        self.assertEqual(FastInboxThreadSerializer(self.thread).data, InboxThreadSerializer(self.thread).data)
+
+    def test_many(self):
+        messages = MessageFactory.create_batch(2, thread=self.message.thread)
+        self.assertEqual(
+            FastMessageSerializer(messages, many=True).data, MessageSerializer(messages, many=True).data)
+
+    def test_message_in_other_time_zone(self):
+        with timezone.override('Europe/Berlin'):
+            self.assertEqual(FastMessageSerializer(self.message).data, MessageSerializer(self.message).data)
@@ -0,0 +1,47 @@
+from collections import Counter
+
+from core.throttling import TokenBucketThrottle, UserTokenBucketThrottle
+from chat.constants import MAX_MESSAGES_PER_BATCH
+from chat.models import Thread
+
+
+def count_messages_per_thread(request):
+    """
+    Return {thread id: number of messages} the request sends, for a single message ({"thread", "text"}), a batch to a
+    thread ({"thread", "texts"}) or a broadcast ({"threads", "text"}). Invalid data, which the serializers reject,
+    counts as a single message or as no messages at all.
+    """
+    data = request.data
+    try:
+        threads = data.get('threads')
+        if threads is not None:
+            if not isinstance(threads, list) or len(threads) > MAX_MESSAGES_PER_BATCH:
+                return {}
+            return Counter(int(thread_id) for thread_id in threads)
+        thread_id = int(data.get('thread'))
+    except (AttributeError, TypeError, ValueError):
+        return {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not texts:
+        return {thread_id: 1}
+    return {thread_id: len(texts)} if len(texts) <= MAX_MESSAGES_PER_BATCH else {}
+
+
+class MessageUserThrottle(UserTokenBucketThrottle):
+    """Messages sent per sender, a token per message"""
+    scope = 'message_user'
+
+    def get_cost(self, request, view):
+        return max(sum(count_messages_per_thread(request).values()), 1)
+
+
+class MessageThreadThrottle(TokenBucketThrottle):
+    """Messages sent to a thread by both of its participants, a token per message. Broadcasts take from every thread"""
+    scope = 'message_thread'
+
+    def get_buckets(self, request, view):
+        counts = count_messages_per_thread(request)
+        if not counts:
+            return {}
+        # Other users must not be able to use up the bucket of a thread
+        return {thread_id: counts[thread_id] for thread_id in Thread.objects.participants_of(counts, request.user)}
@@ -9,14 +9,33 @@ urlpatterns = [
     path('remove-thread/<int:pk>/', views.DeleteThreadView.as_view(), name='remove_thread'),
     path('retrieve-thread-list/', views.RetrieveListOfThreadsView.as_view(), name='retrieve_thread_list'),
     path('create-retrieve-message/', views.CreateRetrieveMessage.as_view(), name='create_retrieve_message'),
+    path('send-messages/', views.SendMessagesView.as_view(), name='send_messages'),
+    path('search-messages/', views.SearchMessagesView.as_view(), name='search_messages'),
+    path('wait-for-messages/', views.WaitForMessagesView.as_view(), name='wait_for_messages'),
     path(
         'mark-message-as-read/<int:pk>/',
         views.MarkMessageAsReadView.as_view(),
         name='mark_message_as_read'
     ),
+    path('export-thread/<int:pk>/', views.ExportThreadView.as_view(), name='export_thread'),
+    path('mark-thread-as-read/<int:pk>/', views.MarkThreadAsReadView.as_view(), name='mark_thread_as_read'),
     path(
         'retrieve-number-of-unread-messages/',
         views.RetrieveNumberOfUnreadMessages.as_view(),
         name='retrieve_number_of_unread_messages'
     ),
+    path('presence-heartbeat/', views.PresenceHeartbeatView.as_view(), name='presence_heartbeat'),
+    path('retrieve-presence/', views.RetrievePresenceView.as_view(), name='retrieve_presence'),
+    # Async variants of the read endpoints above, for ASGI deployments
+    path(
+        'async/retrieve-thread-list/',
+        views.AsyncRetrieveListOfThreadsView.as_view(),
+        name='async_retrieve_thread_list'
+    ),
+    path('async/retrieve-message-list/', views.AsyncRetrieveMessageList.as_view(), name='async_retrieve_message_list'),
+    path(
+        'async/retrieve-number-of-unread-messages/',
+        views.AsyncRetrieveNumberOfUnreadMessages.as_view(),
+        name='async_retrieve_number_of_unread_messages'
+    ),
 ]
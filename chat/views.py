@@ -1,7 +1,12 @@
-from django.db import IntegrityError
+import asyncio
+import datetime
+import math
+
+from asgiref.sync import sync_to_async
 from django.db.models import Q
-from django.core.exceptions import ValidationError
-from rest_framework import generics, status, serializers
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions, generics, status, serializers
 from drf_spectacular.utils import (
     extend_schema,
     extend_schema_view,
@@ -9,16 +14,41 @@ from drf_spectacular.utils import (
     OpenApiParameter,
     OpenApiTypes,
 )
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from chat import events
+from core.api.views import AsyncAPIView
+from core.cache import user_scope, VersionedCacheMixin
+from core.replicas import primary_reads, ReplicaReadMixin
+from chat.archive import MessageHistory
+from chat.constants import LONG_POLL_DEFAULT_TIMEOUT, LONG_POLL_MAX_TIMEOUT
+from chat.export import export_thread_messages, gzip_stream, GZIP_CONTENT_TYPE, NDJSON_CONTENT_TYPE
 from chat.models import Message, Thread
-from chat.pagination import ResultsSetPagination
+from chat.pagination import MessagePagination, ResultsSetPagination, SearchPagination
+from chat.presence import get_presence_store
+from chat.pubsub import get_pubsub, thread_channel
+from chat.search import build_match_expression, search_messages
+from chat.throttling import MessageThreadThrottle, MessageUserThrottle
 from chat.serializers import MessageSerializer, ThreadReadSerializer, SwaggerCreateMessageSerializer, \
-    ThreadWriteSerializer
+    ThreadWriteSerializer, MarkThreadAsReadSerializer, InboxThreadSerializer, FastInboxThreadSerializer, \
+    FastMessageSerializer, MessageSearchResultSerializer, FastMessageSearchResultSerializer, SendMessagesSerializer, \
+    PresenceHeartbeatSerializer, PresenceQuerySerializer, ThreadPresenceSerializer
 from user.serializers import UserSerializer
 
 
+class FastReadSerializerMixin:
+    """Render responses of safe requests with a lightweight read-only serializer; serializer_class is still used
+    for writes and for the schema"""
+    read_serializer_class = None
+
+    def get_serializer_class(self):
+        if self.request.method in SAFE_METHODS and not getattr(self, 'swagger_fake_view', False):
+            return self.read_serializer_class
+        return super().get_serializer_class()
+
+
 @extend_schema_view(
     post=extend_schema(
         responses={
@@ -36,18 +66,14 @@ class CreateOrRetrieveThreadView(generics.RetrieveAPIView, generics.CreateAPIVie
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        try:
-            self.perform_create(serializer)
-        except (IntegrityError, ValidationError) as e:
-            if e.args[0] == 'The pair of Participant one and Participant two already exists':
-                participant_one = serializer.validated_data['participant_one']
-                participant_two = serializer.validated_data['participant_two']
-                thread = Thread.objects.filter(participant_one=participant_one,
-                                               participant_two=participant_two).first() or Thread.objects.filter(
-                    participant_one=participant_two, participant_two=participant_one).first()
-                return Response(ThreadReadSerializer(thread).data, status=status.HTTP_200_OK)
-            return Response({'message': e.args[0]}, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        thread, created = Thread.objects.get_or_create_for_pair(
+            serializer.validated_data['participant_one'],
+            serializer.validated_data['participant_two'],
+        )
+        return Response(
+            ThreadReadSerializer(thread, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
 
 
 class DeleteThreadView(generics.DestroyAPIView):
@@ -68,16 +94,21 @@ class DeleteThreadView(generics.DestroyAPIView):
         ],
     )
 )
-class RetrieveListOfThreadsView(generics.ListAPIView):
-    """Retrieve list of threads for any user"""
-    serializer_class = ThreadReadSerializer
+class RetrieveListOfThreadsView(ReplicaReadMixin, VersionedCacheMixin, FastReadSerializerMixin,
+                                generics.ListAPIView):
+    """Retrieve list of threads for any user with their last message and number of unread messages of
+    authenticated user, most recently active threads first"""
+    serializer_class = InboxThreadSerializer
+    read_serializer_class = FastInboxThreadSerializer
     pagination_class = ResultsSetPagination
 
+    def get_cache_scopes(self):
+        # Writes to a thread and updates of its participants bump the scopes of both participants, so the scope of
+        # the listed user covers the read marks of the authenticated user in the listed threads as well
+        return [user_scope(self.request.query_params.get('user'))]
+
     def get_queryset(self):
-        user = self.request.query_params.get('user')
-        return Thread.objects.filter(
-            Q(participant_one=user) | Q(participant_two=user)).select_related(
-            'participant_one', 'participant_two')
+        return Thread.objects.inbox(self.request.query_params.get('user'), self.request.user)
 
 
 @extend_schema_view(
@@ -111,19 +142,179 @@ class RetrieveListOfThreadsView(generics.ListAPIView):
         ],
     )
 )
-class CreateRetrieveMessage(generics.CreateAPIView, generics.ListAPIView):
+class CreateRetrieveMessage(ReplicaReadMixin, FastReadSerializerMixin, generics.CreateAPIView,
+                            generics.ListAPIView):
     """Create message and retrieve message list for particular thread"""
     serializer_class = MessageSerializer
-    pagination_class = ResultsSetPagination
+    read_serializer_class = FastMessageSerializer
+    pagination_class = MessagePagination
+    throttle_classes = [MessageUserThrottle, MessageThreadThrottle]
+
+    def get_throttles(self):
+        # Only sending messages is throttled
+        if self.request.method in SAFE_METHODS:
+            return []
+        return super().get_throttles()
 
     def get_queryset(self):
-        thread_id = self.request.query_params.get('thread_id')
-        return Message.objects.filter(thread=thread_id).select_related('sender')
+        return Message.objects.thread_history(self.request.query_params.get('thread_id'))
+
+    def paginate_queryset(self, queryset):
+        # Scrolling past the messages in the message table continues with the archived ones
+        return super().paginate_queryset(MessageHistory(queryset, self.request.query_params.get('thread_id')))
 
     def perform_create(self, serializer):
-        serializer.save(
+        message = serializer.save(
             sender=self.request.user
         )
+        events.publish_message_created(message)
+
+
+@extend_schema_view(
+    post=extend_schema(
+        responses={
+            status.HTTP_201_CREATED: inline_serializer(
+                name='SendMessagesResponseSerializer',
+                fields={
+                    'ids': serializers.ListField(child=serializers.IntegerField()),
+                }
+            ),
+        },
+    )
+)
+class SendMessagesView(generics.GenericAPIView):
+    """Send many messages to particular thread or one message to many threads at once. Ids of the created
+    messages are returned in request order"""
+    serializer_class = SendMessagesSerializer
+    # Every message of the batch takes a token of the sender and of its thread
+    throttle_classes = [MessageUserThrottle, MessageThreadThrottle]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        messages = Message.objects.bulk_send([
+            Message(thread=thread, sender=request.user, text=text)
+            for thread, text in serializer.validated_data['messages']
+        ])
+        for message in messages:
+            events.publish_message_created(message)
+        return Response({'ids': [message.id for message in messages]}, status=status.HTTP_201_CREATED)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='q',
+                location=OpenApiParameter.QUERY,
+                required=True,
+                type=OpenApiTypes.STR,
+                description='Words to search for; messages containing all of them are returned',
+            ),
+        ],
+    )
+)
+class SearchMessagesView(ReplicaReadMixin, FastReadSerializerMixin, generics.ListAPIView):
+    """Search messages of threads of authenticated user, best match first"""
+    serializer_class = MessageSearchResultSerializer
+    read_serializer_class = FastMessageSearchResultSerializer
+    pagination_class = SearchPagination
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        if build_match_expression(query) is None:
+            raise serializers.ValidationError({'q': 'Enter at least one word to search for'})
+        page = self.paginator.paginate_search(
+            lambda limit, after: search_messages(request.user, query, limit, after), request)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class WaitForMessagesView(View):
+    """
+    Long-poll variant of the message list of particular thread.
+
+    Takes the same query parameters as the message list in cursor mode, ``after`` being required, plus a ``timeout``
+    in seconds. Messages newer than ``after`` are returned at once; if there are none, the request waits for a
+    message to be posted to the thread or for the timeout and then returns the list as it is. Waiting costs no
+    database queries and, under ASGI, no worker thread.
+    """
+    message_list_view = staticmethod(CreateRetrieveMessage.as_view())
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            thread_id = int(request.GET['thread_id'])
+            int(request.GET['after'])
+            timeout = float(request.GET.get('timeout', LONG_POLL_DEFAULT_TIMEOUT))
+            if not math.isfinite(timeout):
+                raise ValueError(timeout)
+        except (KeyError, ValueError):
+            return JsonResponse(
+                {'message': 'thread_id and after must be integers, timeout must be a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        timeout = min(max(timeout, 0), LONG_POLL_MAX_TIMEOUT)
+
+        # Replicas may not have the messages yet when the notification comes, so lists are read from the primary
+        with primary_reads():
+            return await self.wait(request, thread_id, timeout)
+
+    async def wait(self, request, thread_id, timeout):
+        # Subscribe before looking for messages so that a message posted in between is not missed
+        async with get_pubsub().subscribe(thread_channel(thread_id)) as subscription:
+            response = await sync_to_async(self.message_list_view)(request)
+            if response.status_code != status.HTTP_200_OK or response.data['results']:
+                return response
+            try:
+                await asyncio.wait_for(self.wait_for_message(subscription), timeout)
+            except asyncio.TimeoutError:
+                return response
+        return await sync_to_async(self.message_list_view)(request)
+
+    @staticmethod
+    async def wait_for_message(subscription):
+        while (await subscription.get())['type'] != events.MESSAGE_CREATED:
+            pass
+
+
+@extend_schema_view(
+    get=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='gzip',
+                location=OpenApiParameter.QUERY,
+                required=False,
+                type=OpenApiTypes.BOOL,
+                description='Compress the export with gzip',
+            ),
+        ],
+        responses={
+            (status.HTTP_200_OK, NDJSON_CONTENT_TYPE): OpenApiTypes.STR,
+            (status.HTTP_200_OK, GZIP_CONTENT_TYPE): OpenApiTypes.BINARY,
+        },
+    )
+)
+class ExportThreadView(generics.GenericAPIView):
+    """Export all messages of particular thread as NDJSON, one message per line in chronological order. Only
+    participants of the thread and staff can export it. The export is streamed, so it can be of any size"""
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return Thread.objects.all()
+        return Thread.objects.filter(Q(participant_one=user) | Q(participant_two=user))
+
+    def get(self, request, *args, **kwargs):
+        thread = self.get_object()
+        filename = f'thread-{thread.id}.ndjson'
+        stream = export_thread_messages(thread.id)
+        content_type = NDJSON_CONTENT_TYPE
+        if request.query_params.get('gzip') in ('true', '1'):
+            filename += '.gz'
+            stream = gzip_stream(stream)
+            content_type = GZIP_CONTENT_TYPE
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
 @extend_schema_view(
@@ -135,36 +326,186 @@ class CreateRetrieveMessage(generics.CreateAPIView, generics.ListAPIView):
     )
 )
 class MarkMessageAsReadView(generics.UpdateAPIView):
-    """Mark particular message as read"""
+    """Mark particular message, and the earlier messages of others in its thread, as read by authenticated user"""
     serializer_class = MessageSerializer
-    queryset = Message.objects.all()
     http_method_names = ["patch"]
 
+    def get_queryset(self):
+        user = self.request.user
+        return Message.objects.filter(
+            Q(thread__participant_one=user) | Q(thread__participant_two=user)).select_related('sender', 'thread')
+
     def perform_update(self, serializer):
-        serializer.save(
-            is_read=True,
-        )
+        message = serializer.instance
+        if Thread.objects.mark_read(message.thread_id, self.request.user, message.id):
+            events.publish_message_read(message)
+        if message.sender_id != self.request.user.pk:
+            message.is_read = True
+
+
+@extend_schema_view(
+    patch=extend_schema(
+        responses={
+            status.HTTP_200_OK: inline_serializer(
+                name='MarkThreadAsReadResponseSerializer',
+                fields={
+                    'thread': serializers.IntegerField(),
+                    'number_of_marked_messages': serializers.IntegerField(),
+                    'number_of_unread_messages': serializers.IntegerField(),
+                }
+            ),
+        },
+    )
+)
+class MarkThreadAsReadView(generics.GenericAPIView):
+    """Mark messages of the other participant of particular thread up to particular message as read by authenticated
+    user"""
+    serializer_class = MarkThreadAsReadSerializer
+    http_method_names = ["patch"]
+
+    def patch(self, request, pk, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        up_to = serializer.validated_data['up_to']
+        number_of_marked_messages = Thread.objects.mark_read(pk, request.user, up_to)
+        if number_of_marked_messages is None:
+            raise exceptions.NotFound()
+        if number_of_marked_messages:
+            events.publish_thread_read(pk, up_to)
+        # Messages of the other participant left unread by the user; own messages are for the other one to read
+        unread = Message.objects.filter(thread=pk).exclude(sender=request.user).unread()
+        return Response({
+            'thread': pk,
+            'number_of_marked_messages': number_of_marked_messages,
+            'number_of_unread_messages': unread.count(),
+        })
+
+
+def unread_counts_data(request, counts):
+    """Response data of the number of unread messages from (thread id, count) of threads with unread messages"""
+    data = {
+        'user': UserSerializer(request.user).data,
+        'number_of_unread_messages': sum(count for _, count in counts),
+    }
+    if request.query_params.get('per_thread') in ('true', '1'):
+        data['threads'] = [{'thread': thread_id, 'number_of_unread_messages': count} for thread_id, count in counts]
+    return data
 
 
 @extend_schema_view(
     get=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='per_thread',
+                location=OpenApiParameter.QUERY,
+                required=False,
+                type=OpenApiTypes.BOOL,
+                description='Include number of unread messages for each thread',
+            ),
+        ],
         responses={
             status.HTTP_200_OK: inline_serializer(
                 name='NumberOfUnreadMessagesSerializer',
                 fields={
                     'user': UserSerializer(),
                     'number_of_unread_messages': serializers.IntegerField(),
+                    'threads': inline_serializer(
+                        name='NumberOfUnreadMessagesPerThreadSerializer',
+                        fields={
+                            'thread': serializers.IntegerField(),
+                            'number_of_unread_messages': serializers.IntegerField(),
+                        },
+                        many=True,
+                        required=False,
+                    ),
                 }
             ),
         },
     )
 )
-class RetrieveNumberOfUnreadMessages(APIView):
+class RetrieveNumberOfUnreadMessages(ReplicaReadMixin, APIView):
     """Retrieve number of unread messages for authenticated user"""
 
     def get(self, request, *args, **kwargs):
-        user = UserSerializer(self.request.user).data
-        return Response({
-            'user': user,
-            'number_of_unread_messages': Message.objects.filter(sender=self.request.user, is_read=False).count()
-        })
+        counts = list(Thread.objects.unread_counts(self.request.user))
+        return Response(unread_counts_data(self.request, counts))
+
+
+@extend_schema_view(
+    post=extend_schema(responses={status.HTTP_204_NO_CONTENT: None}),
+)
+class PresenceHeartbeatView(generics.GenericAPIView):
+    """Report that authenticated user is looking at particular thread and whether they are typing. Clients send a
+    heartbeat at least every PRESENCE_TIMEOUT seconds while the thread is open and while the user types; the state
+    is kept in the presence store only, the database is not written"""
+    serializer_class = PresenceHeartbeatSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_presence_store().heartbeat(
+            serializer.validated_data['thread'], request.user.id, serializer.validated_data['typing'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        parameters=[PresenceQuerySerializer],
+        responses=ThreadPresenceSerializer(many=True),
+    ),
+)
+class RetrievePresenceView(generics.GenericAPIView):
+    """Retrieve online and typing state of the participants of threads of authenticated user"""
+    serializer_class = ThreadPresenceSerializer
+
+    def get(self, request, *args, **kwargs):
+        query = PresenceQuerySerializer(data=request.query_params, context=self.get_serializer_context())
+        query.is_valid(raise_exception=True)
+        participants = query.validated_data['participants']
+        states = get_presence_store().get_many([
+            (thread_id, user_id) for thread_id, pair in participants.items() for user_id in pair])
+        data = [
+            {
+                'thread': thread_id,
+                'participants': [self.to_presence(user_id, states[thread_id, user_id])
+                                 for user_id in participants[thread_id]],
+            }
+            for thread_id in query.validated_data['thread_id']
+        ]
+        return Response(self.get_serializer(data, many=True).data)
+
+    @staticmethod
+    def to_presence(user_id, state):
+        last_seen = state['last_seen']
+        if last_seen is not None:
+            last_seen = datetime.datetime.fromtimestamp(last_seen, tz=datetime.timezone.utc)
+        return {'user': user_id, **state, 'last_seen': last_seen}
+
+
+class AsyncRetrieveListOfThreadsView(AsyncAPIView):
+    """Async variant of RetrieveListOfThreadsView, without the response cache"""
+
+    async def get(self, request, *args, **kwargs):
+        paginator = ResultsSetPagination()
+        page = await paginator.apaginate_queryset(
+            Thread.objects.inbox(request.query_params.get('user'), request.user), request)
+        return paginator.get_paginated_response(FastInboxThreadSerializer(page, many=True).data).data
+
+
+class AsyncRetrieveMessageList(AsyncAPIView):
+    """Async variant of the message list of CreateRetrieveMessage"""
+
+    async def get(self, request, *args, **kwargs):
+        thread_id = request.query_params.get('thread_id')
+        paginator = MessagePagination()
+        page = await paginator.apaginate_queryset(
+            MessageHistory(Message.objects.thread_history(thread_id), thread_id), request)
+        return paginator.get_paginated_response(FastMessageSerializer(page, many=True).data).data
+
+
+class AsyncRetrieveNumberOfUnreadMessages(AsyncAPIView):
+    """Async variant of RetrieveNumberOfUnreadMessages"""
+
+    async def get(self, request, *args, **kwargs):
+        counts = [row async for row in Thread.objects.unread_counts(request.user)]
+        return unread_counts_data(request, counts)
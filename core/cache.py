@@ -0,0 +1,150 @@
+"""
+Versioned response cache for list endpoints that clients poll.
+
+Cached pages are keyed by view, query parameters, user and the current versions of the scopes the page depends
+on, e.g. ``user:<id>`` for data of a particular user. Writes bump the versions of the scopes they affect instead of
+deleting cached pages, so stale pages are never read again and simply expire. Versions start at a timestamp rather
+than at 1, so that an evicted version never comes back with a value that old pages were cached under.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.replicas import replica_reads
+
+KEY_PREFIX = 'response-cache'
+# Scope of data of all users, e.g. names shown in every thread list
+USERS_SCOPE = 'users'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def user_scope(user_id):
+    """Scope of threads and messages of a user"""
+    return f'user:{user_id}'
+
+
+def version_key(scope):
+    return f'{KEY_PREFIX}:version:{scope}'
+
+
+def get_versions(scopes):
+    """Return current versions of scopes, starting the ones that have none yet"""
+    cache = get_cache()
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    """Invalidate pages cached for scopes, at once and again when the current transaction is committed"""
+    scopes = set(scopes)
+
+    def bump():
+        cache = get_cache()
+        for scope in scopes:
+            try:
+                cache.incr(version_key(scope))
+            except ValueError:
+                cache.set(version_key(scope), time.time_ns(), timeout=None)
+
+    # The first bump keeps the writing transaction from reading its own stale pages; a concurrent request may
+    # still cache the data from before the commit under the new version, which the bump after the commit discards
+    bump()
+    transaction.on_commit(bump)
+
+
+def increment(key, cache=None):
+    """Atomically add one to a counter kept without expiry, in the response cache by default"""
+    if cache is None:
+        cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def record_hit(hit):
+    increment(HITS_KEY if hit else MISSES_KEY)
+
+
+def get_stats():
+    """Return numbers of hits and misses and the hit ratio"""
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+def compute_etag(data):
+    content = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()
+    return f'"{hashlib.md5(content, usedforsecurity=False).hexdigest()}"'
+
+
+class VersionedCacheMixin:
+    """
+    Cache successful responses of list views and answer conditional requests with 304 Not Modified.
+
+    Views list the scopes their pages depend on in get_cache_scopes(). Responses carry an ``ETag`` and an
+    ``X-Cache`` header telling whether the page came from the cache.
+    """
+
+    def get_cache_scopes(self):
+        raise NotImplementedError('Views using VersionedCacheMixin must define get_cache_scopes()')
+
+    def get_cache_key(self):
+        request = self.request
+        params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        versions = get_versions(self.get_cache_scopes())
+        # Pagination links are absolute, so the host is part of the key
+        raw_key = json.dumps([request.build_absolute_uri(request.path), params, request.user.pk, versions])
+        return f'{KEY_PREFIX}:page:{hashlib.md5(raw_key.encode(), usedforsecurity=False).hexdigest()}'
+
+    def list(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = self.get_cache_key()
+        entry = cache.get(key)
+        record_hit(entry is not None)
+        if entry is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = compute_etag(response.data)
+            timeout = settings.RESPONSE_CACHE_TIMEOUT
+            if replica_reads.get():
+                # A lagging replica may have served the page after the versions were bumped
+                timeout = min(timeout, settings.REPLICA_STICKINESS_SECONDS)
+            cache.set(key, (etag, response.data), timeout=timeout)
+            response['X-Cache'] = 'MISS'
+        else:
+            etag, data = entry
+            response = Response(data, headers={'X-Cache': 'HIT'})
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED, headers={'X-Cache': response['X-Cache']})
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,31 @@
+"""
+Tuning of SQLite connections by the SQLITE_PRAGMAS setting, applied to every new connection.
+
+Django opens SQLite databases with the library defaults: a rollback journal, under which readers and the writer block
+each other, full fsync on every commit and a small page cache. See the settings for the tuned values.
+"""
+import re
+
+from django.conf import settings
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+
+
+def sqlite_pragma_statements(pragmas):
+    statements = []
+    for name, value in pragmas.items():
+        if not PRAGMA_NAME.match(name):
+            raise ValueError(f'Invalid SQLite pragma name {name!r}')
+        if not isinstance(value, int) and not PRAGMA_NAME.match(str(value).lower()):
+            raise ValueError(f'Invalid value {value!r} of SQLite pragma {name}')
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """connection_created receiver applying SQLITE_PRAGMAS to SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in sqlite_pragma_statements(settings.SQLITE_PRAGMAS):
+            cursor.execute(statement)
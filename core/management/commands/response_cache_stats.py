@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Report hits, misses and the hit ratio of the response cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the numbers after reporting them',
+        )
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        self.stdout.write(
+            f'Hits: {stats["hits"]}, misses: {stats["misses"]}, hit ratio: {stats["hit_ratio"]:.1%}')
+        if options['reset']:
+            reset_stats()
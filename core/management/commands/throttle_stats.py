@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.throttling import get_rejected_counts, reset_rejected_counts
+
+
+class Command(BaseCommand):
+    help = 'Report numbers of requests rejected by the token-bucket throttles per scope'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the numbers after reporting them',
+        )
+
+    def handle(self, *args, **options):
+        for scope, count in get_rejected_counts().items():
+            self.stdout.write(f'{scope}: {count} rejected')
+        if options['reset']:
+            reset_rejected_counts()
@@ -0,0 +1,172 @@
+import heapq
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+from rest_framework.permissions import SAFE_METHODS
+
+from core.replicas import apin_to_primary, pin_to_primary
+
+logger = logging.getLogger('core.instrumentation')
+
+
+class QueryRecorder:
+    """Database execute wrapper recording the number and duration of queries and the slowest statements"""
+
+    def __init__(self, slowest=3):
+        self.slowest = slowest
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            item = (duration, self.count, sql)
+            if len(self.statements) < self.slowest:
+                heapq.heappush(self.statements, item)
+            elif self.slowest:
+                heapq.heappushpop(self.statements, item)
+
+    def slowest_statements(self):
+        return [(duration, sql) for duration, _, sql in sorted(self.statements, reverse=True)]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the SQL queries and the time spent on every request.
+
+    Adds a ``Server-Timing`` header with the database time and the total time, so they show up in the
+    browser developer tools, and logs a JSON line with the view, the query count and the slowest
+    statements to the ``core.instrumentation`` logger. Opt-in through the ``SQL_INSTRUMENTATION``
+    setting; the middleware removes itself from the chain when it is disabled. Supports both sync and
+    async requests, so that async views keep running on the event loop while they are instrumented.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slowest = getattr(settings, 'SQL_INSTRUMENTATION_SLOWEST_QUERIES', 3)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(self.slowest)
+        start = time.perf_counter()
+        with self.record_queries(recorder):
+            response = self.get_response(request)
+        return self.instrument(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(self.slowest)
+        start = time.perf_counter()
+        # Connections are per thread, and the async ORM API runs the queries of a request in the thread of its
+        # sync_to_async calls, so the recorder is installed on the connections of that thread
+        stack = await sync_to_async(self.record_queries)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.instrument(request, response, recorder, time.perf_counter() - start)
+
+    @staticmethod
+    def record_queries(recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    @staticmethod
+    def instrument(request, response, recorder, total):
+        """Add the Server-Timing header to the response and log the line of the request"""
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration * 1000:.2f};desc="{recorder.count} queries"',
+            f'total;dur={total * 1000:.2f}',
+        ))
+        resolver_match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'db_duration_ms': round(recorder.duration * 1000, 2),
+            'queries': recorder.count,
+            'slowest_queries': [
+                {'duration_ms': round(duration * 1000, 2), 'sql': sql}
+                for duration, sql in recorder.slowest_statements()
+            ],
+        }))
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pins users who send an unsafe request to the primary database for the REPLICA_STICKINESS_SECONDS setting, so
+    that their next reads see what they have written (core.replicas). Does nothing unless DATABASE_REPLICAS is set.
+    Supports both sync and async requests, so that it does not cost async views a thread hop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user_id = self.get_writer_id(request)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = await self.aget_writer_id(request)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    @staticmethod
+    def is_write(request):
+        return bool(settings.DATABASE_REPLICAS) and request.method not in SAFE_METHODS
+
+    @classmethod
+    def get_writer_id(cls, request):
+        # DRF views set the user they authenticated on the Django request
+        user = getattr(request, 'user', None)
+        if cls.is_write(request) and user and user.is_authenticated:
+            return user.pk
+        return None
+
+    @classmethod
+    async def aget_writer_id(cls, request):
+        if not cls.is_write(request):
+            return None
+        user = getattr(request, 'user', None)
+        # Unless a DRF view replaced it, the user of AuthenticationMiddleware is loaded from the session on first
+        # access, which is a query that has to go through the async API here
+        if isinstance(user, SimpleLazyObject):
+            user = await request.auser()
+        if user and user.is_authenticated:
+            return user.pk
+        return None
@@ -1,10 +1,33 @@
 from django.db import models
 
 
+class TimeStampField(models.DateTimeField):
+    """
+    DateTimeField whose auto_now and auto_now_add keep the value of instances marked with keep_timestamps(), so that
+    imported rows are inserted with their original times in a single write
+    """
+
+    def pre_save(self, model_instance, add):
+        if getattr(model_instance, '_keep_timestamps', False):
+            return getattr(model_instance, self.attname)
+        return super().pre_save(model_instance, add)
+
+    def deconstruct(self):
+        # Same column and behaviour as DateTimeField otherwise, so migrations refer to that
+        name, _, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.DateTimeField', args, kwargs
+
+
+def keep_timestamps(instance):
+    """Mark an instance to be saved with the created_at and updated_at it has instead of the current time"""
+    instance._keep_timestamps = True
+    return instance
+
+
 class TimeStampMixin(models.Model):
     """Mixin to add create datetime and update datetime to any model"""
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    created_at = TimeStampField(auto_now_add=True)
+    updated_at = TimeStampField(auto_now=True)
 
     class Meta:
         abstract = True
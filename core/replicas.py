@@ -0,0 +1,110 @@
+"""
+Routing of reads to read replicas with read-your-writes stickiness.
+
+Writes always go to the primary (the ``default`` database). Safe requests of views using ReplicaReadMixin, and of
+AsyncAPIView views, read from a random alias of the DATABASE_REPLICAS setting. A user who has just written reads
+from the primary for REPLICA_STICKINESS_SECONDS, which should cover the replication lag, so that they see their own
+writes (see core.middleware.ReplicaStickinessMiddleware). Pins are kept in the default cache, which has to be shared by
+all processes for them to apply to requests served by other processes.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+# Whether the reads of the current request go to a replica
+replica_reads = ContextVar('replica_reads', default=False)
+# Set by code that must not read from a replica, e.g. because it has been notified of a write
+primary_only = ContextVar('primary_only', default=False)
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send reads of a user to the primary for the stickiness window"""
+    cache.set(pin_key(user_id), True, timeout=settings.REPLICA_STICKINESS_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await cache.aset(pin_key(user_id), True, timeout=settings.REPLICA_STICKINESS_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return cache.get(pin_key(user_id), False)
+
+
+async def ais_pinned_to_primary(user_id):
+    return await cache.aget(pin_key(user_id), False)
+
+
+def replicas_enabled_for(request):
+    return bool(settings.DATABASE_REPLICAS) and request.method in SAFE_METHODS and not primary_only.get()
+
+
+def can_read_from_replica(request):
+    """Whether reads of an authenticated request may go to a replica"""
+    return replicas_enabled_for(request) and not is_pinned_to_primary(request.user.pk)
+
+
+async def acan_read_from_replica(request):
+    return replicas_enabled_for(request) and not await ais_pinned_to_primary(request.user.pk)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary within the block, whatever the request is"""
+    token = primary_only.set(True)
+    try:
+        yield
+    finally:
+        primary_only.reset(token)
+
+
+@contextmanager
+def request_reads():
+    """Scope of a request; reads go to the primary until the request enables replica reads"""
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """Database router sending enabled reads to replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and not primary_only.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Read from a replica on safe requests of users who are not pinned to the primary"""
+
+    def dispatch(self, request, *args, **kwargs):
+        with request_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        # Authenticates the user first
+        super().initial(request, *args, **kwargs)
+        if can_read_from_replica(request):
+            replica_reads.set(True)
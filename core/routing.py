@@ -0,0 +1,30 @@
+class ProtocolTypeRouter:
+    """ASGI application dispatching connections to other ASGI applications by scope type"""
+
+    def __init__(self, application_mapping):
+        self.application_mapping = application_mapping
+
+    async def __call__(self, scope, receive, send):
+        try:
+            application = self.application_mapping[scope['type']]
+        except KeyError:
+            raise ValueError(f'No application configured for scope type {scope["type"]!r}')
+        return await application(scope, receive, send)
+
+
+class URLRouter:
+    """ASGI application dispatching WebSocket connections to other ASGI applications by path"""
+
+    def __init__(self, urlpatterns):
+        self.urlpatterns = urlpatterns
+
+    async def __call__(self, scope, receive, send):
+        path = scope['path'].lstrip('/')
+        for pattern in self.urlpatterns:
+            match = pattern.resolve(path)
+            if match:
+                scope = dict(scope, url_route={'args': match.args, 'kwargs': match.kwargs})
+                return await match.func(scope, receive, send)
+        # Closing a WebSocket before accepting it rejects the handshake
+        await receive()
+        await send({'type': 'websocket.close'})
@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing a test when a block of code runs more queries than its budget.
+
+    Unlike ``assertNumQueries`` the budget is an upper bound, so views can get cheaper without touching
+    the tests while an N+1 regression still fails with the list of executed queries.
+    """
+
+    @contextmanager
+    def assertMaxNumQueries(self, budget, using='default'):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}' for number, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f'{executed} queries executed, the budget is {budget}\nCaptured queries were:\n{queries}')
+
+
+class FakeClock:
+    """Callable returning ``now``, a time in seconds that tests move forward instead of sleeping"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
@@ -1,5 +1,14 @@
-from django.test import SimpleTestCase
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase
 from django.urls import reverse
+from rest_framework import status
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.throttling import AnonRateThrottle
+
+from core.api.views import AsyncAPIView
+from user.factories import UserFactory
+from user.models import User
 
 
 class HealthTest(SimpleTestCase):
@@ -9,3 +18,63 @@ class HealthTest(SimpleTestCase):
         """
         response = self.client.get(reverse("health"))
         self.assertEqual(response.status_code, 200)
+
+
+class EmailHeaderAuthentication(BaseAuthentication):
+    """Synchronous authentication querying the database, without an aauthenticate() method"""
+
+    def authenticate(self, request):
+        email = request.META.get('HTTP_X_EMAIL')
+        if not email:
+            return None
+        return User.objects.get(email=email), None
+
+
+class OnePerMinuteThrottle(AnonRateThrottle):
+    rate = '1/min'
+
+
+class UserView(AsyncAPIView):
+    authentication_classes = [EmailHeaderAuthentication]
+
+    async def get(self, request, *args, **kwargs):
+        return {'user': request.user.is_authenticated and request.user.email}
+
+
+class AsyncAPIViewTests(TestCase):
+    """Test authentication, permissions and throttles of async API views"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = UserFactory()
+        self.factory = AsyncRequestFactory()
+
+    async def get(self, view_class, **headers):
+        return await view_class.as_view()(self.factory.get('/', headers=headers))
+
+    async def test_sync_authentication(self):
+        """Test authenticating with authentication classes without an async method"""
+        res = await self.get(UserView, x_email=self.user.email)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.content.decode(), f'{{"user":"{self.user.email}"}}')
+        self.assertEqual((await self.get(UserView)).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_permissions(self):
+        """Test that the permission classes are checked"""
+        view_class = type('AdminView', (UserView,), {'permission_classes': [IsAdminUser]})
+        res = await self.get(view_class, x_email=self.user.email)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        view_class = type('AnyView', (UserView,), {'permission_classes': [AllowAny]})
+        res = await self.get(view_class)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.content, b'{"user":false}')
+
+    async def test_throttles(self):
+        """Test that the throttle classes are checked"""
+        view_class = type('ThrottledView', (UserView,), {
+            'permission_classes': [AllowAny], 'throttle_classes': [OnePerMinuteThrottle]})
+        self.assertEqual((await self.get(view_class)).status_code, status.HTTP_200_OK)
+        res = await self.get(view_class)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '60')
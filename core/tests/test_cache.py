@@ -0,0 +1,179 @@
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import update_last_login
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import Message, Thread
+from core.cache import bump_versions, get_cache, get_stats, get_versions, user_scope
+from user.factories import UserFactory
+
+USER_LIST_URL = reverse('user:list')
+RETRIEVE_THREAD_LIST_URL = reverse('chat:retrieve_thread_list')
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+SEND_MESSAGES_URL = reverse('chat:send_messages')
+
+
+class ResponseCacheTests(TestCase):
+    """Test the versioned response cache of thread and user lists"""
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.user = UserFactory()
+        self.other_user = UserFactory()
+        self.thread = ThreadFactory(participant_one=self.user, participant_two=self.other_user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_thread_list(self, **headers):
+        return self.client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.user.id}, headers=headers)
+
+    def test_repeated_request_hit(self):
+        """Test that a repeated request is answered from the cache without queries"""
+        res = self.get_thread_list()
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            cached = self.get_thread_list()
+
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(cached['ETag'], res['ETag'])
+
+    def test_cache_keyed_by_query_params_and_user(self):
+        """Test that pages of other query parameters or of another user are not reused"""
+        self.get_thread_list()
+
+        res = self.client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.user.id, 'page': 1})
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        client = APIClient()
+        client.force_authenticate(self.other_user)
+        res = client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.user.id})
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_not_modified(self):
+        """Test that a request with the ETag of the current page gets 304 Not Modified"""
+        etag = self.get_thread_list()['ETag']
+
+        res = self.get_thread_list(if_none_match=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+    def test_new_message_invalidates_thread_list(self):
+        """Test that a new message invalidates thread lists of both participants"""
+        etag = self.get_thread_list()['ETag']
+        client = APIClient()
+        client.force_authenticate(self.other_user)
+        client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.other_user.id})
+
+        self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'thread': self.thread.id, 'text': 'Hi'})
+
+        res = self.get_thread_list(if_none_match=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'][0]['last_message']['text'], 'Hi')
+        res = client.get(RETRIEVE_THREAD_LIST_URL, {'user': self.other_user.id})
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_unrelated_message_keeps_thread_list(self):
+        """Test that a message in a thread of other users leaves the thread list cached"""
+        thread = ThreadFactory()
+        self.get_thread_list()
+
+        MessageFactory(thread=thread, sender=thread.participant_one, text='Hi')
+
+        self.assertEqual(self.get_thread_list()['X-Cache'], 'HIT')
+
+    def test_batch_send_and_mark_read_invalidate_thread_list(self):
+        """Test that bulk writes to a thread invalidate the thread list"""
+        self.get_thread_list()
+        self.client.post(SEND_MESSAGES_URL, {'thread': self.thread.id, 'texts': ['Hi', 'Bye']}, format='json')
+
+        res = self.get_thread_list()
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'][0]['number_of_unread_messages'], 2)
+
+        Thread.objects.mark_read(self.thread.id, self.other_user, Message.objects.latest('id').id)
+
+        res = self.get_thread_list()
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'][0]['number_of_unread_messages'], 0)
+
+    def test_user_update_invalidates_lists(self):
+        """Test that updating a user invalidates the user list and thread lists"""
+        self.client.get(USER_LIST_URL)
+        self.get_thread_list()
+
+        self.other_user.first_name = 'Renamed'
+        self.other_user.save()
+
+        res = self.client.get(USER_LIST_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [user['first_name'] for user in res.data['results']])
+        self.assertEqual(self.get_thread_list()['X-Cache'], 'MISS')
+
+    def test_user_update_keeps_unrelated_thread_lists(self):
+        """Test that updating a user leaves thread lists of users without threads with them cached"""
+        self.get_thread_list()
+
+        user = UserFactory()
+        user.first_name = 'Renamed'
+        user.save()
+
+        self.assertEqual(self.get_thread_list()['X-Cache'], 'HIT')
+
+    def test_login_keeps_lists(self):
+        """Test that recording a login of a user leaves the user list and thread lists cached"""
+        self.client.get(USER_LIST_URL)
+        self.get_thread_list()
+
+        update_last_login(None, self.other_user)
+
+        self.assertEqual(self.client.get(USER_LIST_URL)['X-Cache'], 'HIT')
+        self.assertEqual(self.get_thread_list()['X-Cache'], 'HIT')
+
+    def test_versions_bumped_again_on_commit(self):
+        """Test that versions are bumped at once and again after the commit"""
+        scope = user_scope(self.user.id)
+        version = get_versions([scope])[0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_versions([scope])
+            self.assertEqual(get_versions([scope])[0], version + 1)
+
+        self.assertEqual(get_versions([scope])[0], version + 2)
+
+    def test_hit_ratio(self):
+        """Test reporting of hits, misses and the hit ratio"""
+        for _ in range(4):
+            self.get_thread_list()
+
+        self.assertEqual(get_stats(), {'hits': 3, 'misses': 1, 'hit_ratio': 0.75})
+
+        out = StringIO()
+        call_command('response_cache_stats', '--reset', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Hits: 3, misses: 1, hit ratio: 75.0%')
+        self.assertEqual(get_stats()['hits'], 0)
+
+    def test_file_based_cache(self):
+        """Test caching and invalidation with the file-based cache backend"""
+        with tempfile.TemporaryDirectory() as location:
+            caches = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': location}}
+            with override_settings(CACHES=caches):
+                self.assertEqual(self.get_thread_list()['X-Cache'], 'MISS')
+                self.assertEqual(self.get_thread_list()['X-Cache'], 'HIT')
+
+                MessageFactory(thread=self.thread, sender=self.user)
+
+                self.assertEqual(self.get_thread_list()['X-Cache'], 'MISS')
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.db import sqlite_pragma_statements
+
+
+class SqlitePragmasTests(TestCase):
+    """Test tuning of SQLite connections"""
+
+    def get_pragma(self, cursor, name):
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+    def test_pragmas_applied(self):
+        """Test that pragmas of the settings are applied to the connection"""
+        with connection.cursor() as cursor:
+            self.assertEqual(self.get_pragma(cursor, 'busy_timeout'), 5000)
+            # NORMAL
+            self.assertEqual(self.get_pragma(cursor, 'synchronous'), 1)
+            self.assertEqual(self.get_pragma(cursor, 'cache_size'), -64 * 1024)
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'wal', 'busy_timeout': 1234})
+    def test_wal_on_new_connection(self):
+        """Test that a new connection to a database file switches it to WAL"""
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory, 'test.sqlite3')})
+            try:
+                with wrapper.cursor() as cursor:
+                    self.assertEqual(self.get_pragma(cursor, 'journal_mode'), 'wal')
+                    self.assertEqual(self.get_pragma(cursor, 'busy_timeout'), 1234)
+            finally:
+                wrapper.close()
+
+
+class SqlitePragmaStatementsTests(SimpleTestCase):
+    """Test building of pragma statements"""
+
+    def test_statements(self):
+        """Test statements of names and values"""
+        self.assertEqual(
+            sqlite_pragma_statements({'journal_mode': 'WAL', 'cache_size': -2000}),
+            ['PRAGMA journal_mode = WAL', 'PRAGMA cache_size = -2000'],
+        )
+
+    def test_invalid_pragmas(self):
+        """Test that names and values that are not plain words or integers are rejected"""
+        for pragmas in ({'journal_mode; DROP TABLE x': 'wal'}, {'journal_mode': 'wal; DROP TABLE x'}):
+            with self.subTest(pragmas=pragmas):
+                with self.assertRaises(ValueError):
+                    sqlite_pragma_statements(pragmas)
@@ -0,0 +1,81 @@
+import json
+import logging
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.middleware import QueryInstrumentationMiddleware
+from core.testing import QueryBudgetMixin
+from user.factories import UserFactory
+
+
+class QueryInstrumentationMiddlewareTests(TestCase):
+    """Test per-request SQL and timing instrumentation"""
+
+    @override_settings(SQL_INSTRUMENTATION=True)
+    def test_server_timing_header_and_log_line(self):
+        """Test the Server-Timing header and the log line of an instrumented request"""
+        client = APIClient()
+        client.force_authenticate(UserFactory())
+        with self.assertLogs('core.instrumentation', level='INFO') as logs:
+            res = client.get(reverse('user:list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'user:list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(len(record['slowest_queries']), 3)
+        self.assertRegex(
+            res['Server-Timing'], rf'^db;dur=[\d.]+;desc="{record["queries"]} queries", total;dur=[\d.]+$')
+
+    @override_settings(SQL_INSTRUMENTATION=True)
+    async def test_async_request(self):
+        """Test that requests to async views are instrumented by the async middleware"""
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(QueryInstrumentationMiddleware(get_response)))
+        token = await Token.objects.acreate(user=await sync_to_async(UserFactory)())
+        with self.assertLogs('core.instrumentation', level='INFO') as logs:
+            res = await self.async_client.get(reverse('chat:async_retrieve_number_of_unread_messages'),
+                                              headers={'Authorization': f'Token {token.key}'})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'chat:async_retrieve_number_of_unread_messages')
+        self.assertGreater(record['queries'], 0)
+        self.assertRegex(res['Server-Timing'], rf'^db;dur=[\d.]+;desc="{record["queries"]} queries"')
+
+    @override_settings(SQL_INSTRUMENTATION=True)
+    def test_log_line_is_written(self):
+        """Test that the logging settings write the log lines of the instrumentation"""
+        handler, = logging.getLogger('core.instrumentation').handlers
+        client = APIClient()
+        client.force_authenticate(UserFactory())
+        stream = StringIO()
+        with patch.object(handler, 'stream', stream):
+            client.get(reverse('user:list'))
+        self.assertEqual(json.loads(stream.getvalue())['view'], 'user:list')
+
+    def test_disabled_by_default(self):
+        """Test that requests are not instrumented unless enabled"""
+        res = self.client.get(reverse('health'))
+        self.assertNotIn('Server-Timing', res)
+
+
+class QueryBudgetMixinTests(QueryBudgetMixin, TestCase):
+    """Test the query budget assertion"""
+
+    def test_within_budget(self):
+        """Test that running fewer queries than the budget passes"""
+        with self.assertMaxNumQueries(2):
+            UserFactory.build()
+
+    def test_over_budget(self):
+        """Test that running more queries than the budget fails listing the queries"""
+        with self.assertRaisesRegex(AssertionError, r'queries executed, the budget is 1'):
+            with self.assertMaxNumQueries(1):
+                UserFactory.create_batch(2)
@@ -0,0 +1,113 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from chat.factories import ThreadFactory, MessageFactory
+from chat.models import Message
+from core.middleware import ReplicaStickinessMiddleware
+from core.replicas import ais_pinned_to_primary, ReplicaRouter
+from user.models import User
+
+USER_LIST_URL = reverse('user:list')
+CREATE_RETRIEVE_MESSAGE_URL = reverse('chat:create_retrieve_message')
+WAIT_FOR_MESSAGES_URL = reverse('chat:wait_for_messages')
+RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL = reverse('chat:retrieve_number_of_unread_messages')
+ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL = reverse('chat:async_retrieve_number_of_unread_messages')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKINESS_SECONDS=60)
+class ReplicaRoutingTests(TestCase):
+    """Test routing of reads to the replica database and read-your-writes stickiness"""
+    databases = {'default', 'replica'}
+
+    def setUp(self) -> None:
+        cache.clear()
+        # The replica lags behind: it has none of the messages and a user the primary does not have
+        self.thread = ThreadFactory()
+        self.user = self.thread.participant_one
+        self.message = MessageFactory(thread=self.thread, sender=self.user)
+        User.objects.using('replica').create(email='replica@example.com', first_name='Replica')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_number_of_unread_messages(self, client=None):
+        res = (client or self.client).get(RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data['number_of_unread_messages']
+
+    def send_message(self):
+        res = self.client.post(CREATE_RETRIEVE_MESSAGE_URL, {'thread': self.thread.id, 'text': 'Hi'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def test_safe_requests_read_from_replica(self):
+        """Test that list views read from the replica"""
+        self.assertEqual(self.get_number_of_unread_messages(), 0)
+        res = self.client.get(USER_LIST_URL)
+        self.assertEqual([user['email'] for user in res.data['results']], ['replica@example.com'])
+
+    def test_writes_go_to_primary(self):
+        """Test that writes go to the primary, also for instances read from the replica"""
+        message_id = self.send_message()
+
+        self.assertTrue(Message.objects.filter(id=message_id).exists())
+        self.assertFalse(Message.objects.using('replica').exists())
+        replica_user = User.objects.using('replica').get()
+        self.assertEqual(ReplicaRouter().db_for_write(User, instance=replica_user), 'default')
+
+    def test_read_your_writes(self):
+        """Test that a user who has written reads from the primary while others still read from the replica"""
+        self.send_message()
+
+        self.assertEqual(self.get_number_of_unread_messages(), 2)
+        other_client = APIClient()
+        other_client.force_authenticate(self.thread.participant_two)
+        self.assertEqual(other_client.get(USER_LIST_URL).data['count'], 1)
+
+    @override_settings(REPLICA_STICKINESS_SECONDS=0)
+    def test_stickiness_window(self):
+        """Test that users read from the replica again after the stickiness window"""
+        self.send_message()
+
+        self.assertEqual(self.get_number_of_unread_messages(), 0)
+
+    def test_long_poll_reads_from_primary(self):
+        """Test that the long-poll never misses messages the replica does not have yet"""
+        message = MessageFactory(thread=self.thread, sender=self.thread.participant_two)
+
+        res = self.client.get(WAIT_FOR_MESSAGES_URL, {'thread_id': self.thread.id, 'after': self.message.id})
+
+        self.assertEqual([item['id'] for item in res.data['results']], [message.id])
+
+    async def test_async_views_read_from_replica(self):
+        """Test that async views read from the replica and respect stickiness"""
+        token = await Token.objects.acreate(user=self.user)
+        headers = {'Authorization': f'Token {token.key}'}
+
+        res = await self.async_client.get(ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL, headers=headers)
+        self.assertEqual(res.json()['number_of_unread_messages'], 0)
+
+        await self.async_client.post(CREATE_RETRIEVE_MESSAGE_URL, {'thread': self.thread.id, 'text': 'Hi'},
+                                     headers=headers)
+
+        res = await self.async_client.get(ASYNC_RETRIEVE_NUMBER_OF_UNREAD_MESSAGES_URL, headers=headers)
+        self.assertEqual(res.json()['number_of_unread_messages'], 2)
+
+    async def test_async_session_user_is_pinned(self):
+        """Test that async writes of users authenticated by AuthenticationMiddleware load them with the async API"""
+        async def get_response(request):
+            return HttpResponse()
+
+        async def auser():
+            return self.user
+
+        request = AsyncRequestFactory().post('/')
+        request.user = SimpleLazyObject(lambda: self.fail('the user was loaded synchronously'))
+        request.auser = auser
+        await ReplicaStickinessMiddleware(get_response)(request)
+        self.assertTrue(await ais_pinned_to_primary(self.user.pk))
@@ -0,0 +1,145 @@
+"""
+Token-bucket throttles of write endpoints.
+
+A bucket holds up to ``capacity`` tokens and gains ``refill_rate`` tokens per second. Every request takes a token, or
+several for requests doing the work of several, and requests finding too few tokens in the bucket are rejected with
+429 Too Many Requests and a ``Retry-After`` header telling when enough of them are added. Capacities and rates of
+throttle scopes are set in THROTTLE_BUCKETS; scopes missing there are not throttled.
+
+Buckets live in the THROTTLE_CACHE_ALIAS cache, which has to be shared by all workers (e.g. Memcached or Redis) for
+the limits to hold across them, and are changed with the atomic incr() and decr() of the cache instead of a
+read-modify-write. For that the state of a bucket is a single number: the time at which it is full again (the
+theoretical arrival time of the generic cell rate algorithm). Taking a token moves it ``1 / refill_rate`` seconds
+later, and a token may be taken while it is at most ``capacity / refill_rate`` seconds ahead of now.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from core.cache import increment
+
+KEY_PREFIX = 'throttle'
+MICROSECONDS = 1_000_000
+
+
+def get_cache():
+    return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+def bucket_key(scope, ident):
+    return f'{KEY_PREFIX}:bucket:{scope}:{ident}'
+
+
+def rejected_key(scope):
+    return f'{KEY_PREFIX}:rejected:{scope}'
+
+
+def get_rejected_counts():
+    """Return numbers of rejected requests per throttle scope"""
+    keys = {scope: rejected_key(scope) for scope in settings.THROTTLE_BUCKETS}
+    counts = get_cache().get_many(keys.values())
+    return {scope: counts.get(key, 0) for scope, key in keys.items()}
+
+
+def reset_rejected_counts():
+    get_cache().delete_many([rejected_key(scope) for scope in settings.THROTTLE_BUCKETS])
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle with a token bucket per value of get_bucket_ident(), e.g. per user.
+
+    Subclasses set ``scope`` to an entry of THROTTLE_BUCKETS and define get_bucket_ident(), which returns None for
+    requests the throttle does not apply to. Requests take get_cost() tokens; throttles charging several buckets per
+    request override get_buckets() instead.
+    """
+    scope = None
+    timer = time.time
+
+    def __init__(self):
+        bucket = settings.THROTTLE_BUCKETS.get(self.scope)
+        self.capacity = bucket and bucket['capacity']
+        self.refill_rate = bucket and bucket['refill_rate']
+        self.wait_seconds = None
+
+    def get_bucket_ident(self, request, view):
+        raise NotImplementedError('subclasses of TokenBucketThrottle must provide a get_bucket_ident() method')
+
+    def get_cost(self, request, view):
+        """Return the number of tokens the request takes"""
+        return 1
+
+    def get_buckets(self, request, view):
+        """Return {bucket ident: number of tokens} of the buckets the request takes tokens from"""
+        ident = self.get_bucket_ident(request, view)
+        return {} if ident is None else {ident: self.get_cost(request, view)}
+
+    def allow_request(self, request, view):
+        if not self.capacity:
+            return True
+        buckets = self.get_buckets(request, view)
+        if not buckets:
+            return True
+        cache = get_cache()
+        # Times in integer microseconds, which incr() can add
+        now = int(self.timer() * MICROSECONDS)
+        interval = round(MICROSECONDS / self.refill_rate)
+        taken = []
+        for ident, cost in buckets.items():
+            key = bucket_key(self.scope, ident)
+            amount = interval * cost
+            wait = self.take_tokens(cache, key, now, amount, interval * self.capacity)
+            if wait > 0:
+                # Rejected requests do not use up tokens, of this bucket nor of the ones already taken from, so that
+                # clients retrying too early are not locked out for longer
+                for taken_key, taken_amount in [*taken, (key, amount)]:
+                    try:
+                        cache.decr(taken_key, taken_amount)
+                    except ValueError:
+                        pass
+                self.wait_seconds = wait / MICROSECONDS
+                increment(rejected_key(self.scope), cache=cache)
+                return False
+            taken.append((key, amount))
+        return True
+
+    def take_tokens(self, cache, key, now, amount, burst):
+        """
+        Take tokens worth ``amount`` microseconds from a bucket holding up to ``burst`` and return the microseconds to
+        wait until there are enough of them, which is not positive if they were taken.
+
+        A request taking more tokens than the capacity is allowed when the bucket is full and leaves it empty for
+        longer, so that large batches are limited to the refill rate instead of never being allowed.
+        """
+        full_at = self.take_token(cache, key, now, amount)
+        wait = min(full_at - now - burst, full_at - amount - now)
+        if wait <= 0:
+            # Keep the bucket until it is full again
+            cache.touch(key, math.ceil((full_at - now) / MICROSECONDS) + 1)
+        return wait
+
+    def take_token(self, cache, key, now, amount):
+        """Take tokens worth ``amount`` microseconds and return the time at which the bucket is full again"""
+        try:
+            full_at = cache.incr(key, amount)
+        except ValueError:
+            full_at = None
+        if full_at is None or full_at - amount < now:
+            # The bucket was full. Concurrent requests finding it full may all restart it from now, which lets a few
+            # of them through for free but never rejects a request that should have been allowed.
+            full_at = now + amount
+            cache.set(key, full_at, timeout=math.ceil(amount / MICROSECONDS) + 1)
+        return full_at
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Token bucket per authenticated user"""
+
+    def get_bucket_ident(self, request, view):
+        return request.user.pk
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.ReplicaStickinessMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -76,12 +79,75 @@ TEMPLATES = [
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'user.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Per-process cache of API tokens used by CachedTokenAuthentication
+TOKEN_CACHE_MAX_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
 WSGI_APPLICATION = "simple_chat.wsgi.application"
+ASGI_APPLICATION = "simple_chat.asgi.application"
+
+# Publish/subscribe backend pushing chat events to WebSocket clients. The in-memory backend only
+# reaches clients connected to the same process, so run a single ASGI worker with it.
+CHAT_PUBSUB_BACKEND = "chat.pubsub.InMemoryPubSub"
+
+# Store of online and typing state of users in threads (chat.presence). The in-memory store is per process; with
+# several workers use "chat.presence.CachePresenceStore", which keeps the state in a shared cache.
+CHAT_PRESENCE_BACKEND = "chat.presence.InMemoryPresenceStore"
+CHAT_PRESENCE_CACHE_ALIAS = "default"
+
+# Messages older than this number of days are deleted by the purge_messages command; None keeps them forever
+MESSAGE_RETENTION_DAYS = None
+
+# Token buckets of throttled endpoints (core.throttling): up to "capacity" requests at once, then "refill_rate"
+# requests per second. Buckets are kept in the THROTTLE_CACHE_ALIAS cache, which has to be shared by all workers for
+# the limits to hold across them.
+THROTTLE_BUCKETS = {
+    # Requests sending messages, per sender
+    "message_user": {"capacity": 30, "refill_rate": 2},
+    # Requests sending messages to a thread, by both of its participants
+    "message_thread": {"capacity": 20, "refill_rate": 1},
+}
+THROTTLE_CACHE_ALIAS = "default"
+
+# Caches. The local-memory cache is per process; with several workers use a shared backend, e.g.
+# "django.core.cache.backends.filebased.FileBasedCache" with a LOCATION directory, so that they see each
+# other's invalidations.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "simple-chat",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# Versioned cache of thread and user list responses (core.cache)
+RESPONSE_CACHE_ALIAS = "default"
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Per-request SQL and timing instrumentation (Server-Timing header and a log line per request)
+SQL_INSTRUMENTATION = False
+SQL_INSTRUMENTATION_SLOWEST_QUERIES = 3
+
+# Logging. Django's default configuration drops INFO records of application loggers, so the log lines of the SQL
+# instrumentation get a handler writing them to stderr.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "{message}", "style": "{"},
+    },
+    "handlers": {
+        "instrumentation": {"class": "logging.StreamHandler", "formatter": "message"},
+    },
+    "loggers": {
+        "core.instrumentation": {"handlers": ["instrumentation"], "level": "INFO", "propagate": False},
+    },
+}
 
 
 # Database
@@ -91,8 +157,45 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        # Seconds to keep connections open between requests instead of opening (and tuning, see SQLITE_PRAGMAS)
+        # one per request. 0 by default since an ASGI server runs the sync code of each request in a new thread, whose
+        # connection would never be reused or closed; simple_chat/wsgi.py opts in.
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # Read replica of the default database; point NAME to a copy kept up to date by the replication tool and list
+    # the alias in DATABASE_REPLICAS to route reads to it. Tests run against a separate test database.
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
+    },
+}
+
+# Read-replica routing (core.replicas). Safe requests of the list views read from a random alias of
+# DATABASE_REPLICAS; writes always go to the default database. Users who have written read from the default database
+# for REPLICA_STICKINESS_SECONDS afterwards, which should exceed the replication lag.
+DATABASE_ROUTERS = ["core.replicas.ReplicaRouter"]
+DATABASE_REPLICAS = []
+REPLICA_STICKINESS_SECONDS = 5
+
+# Pragmas applied to every new SQLite connection (core.db). Set to {} to use the SQLite defaults.
+SQLITE_PRAGMAS = {
+    # Milliseconds to wait for a lock held by another connection before failing with "database is locked"
+    "busy_timeout": 5000,
+    # With WAL, fsync at checkpoints only; a power loss may lose the last commits but not corrupt the database
+    "synchronous": "normal",
+    # Bytes of the database file read through memory mapping instead of read() calls
+    "mmap_size": 256 * 1024 * 1024,
+    # Page cache per connection, in KiB when negative
+    "cache_size": -64 * 1024,
+    "temp_store": "memory",
 }
+# Journal mode of served databases; "wal" lets readers and the writer not block each other. The mode is stored in the
+# database file, so only simple_chat/wsgi.py and asgi.py set it and management commands leave the file as it is.
+if os.environ.get("SQLITE_JOURNAL_MODE"):
+    SQLITE_PRAGMAS = {"journal_mode": os.environ["SQLITE_JOURNAL_MODE"], **SQLITE_PRAGMAS}
 
 
 # Password validation
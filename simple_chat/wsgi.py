@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "simple_chat.settings")
+os.environ.setdefault("SQLITE_JOURNAL_MODE", "wal")
+os.environ.setdefault("DATABASE_CONN_MAX_AGE", "60")
 
 application = get_wsgi_application()
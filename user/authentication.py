@@ -0,0 +1,151 @@
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header, TokenAuthentication
+
+from core.cache import get_cache, increment
+
+KEY_PREFIX = 'token-cache'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+class TokenCache:
+    """Bounded LRU cache of authenticated (user, token) pairs by token key with a time to live"""
+
+    def __init__(self, max_size, ttl, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.keys_by_user = defaultdict(set)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.timer():
+                self.entries.move_to_end(key)
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            return None
+
+    def set(self, key, user, token):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (self.timer() + self.ttl, (user, token))
+            self.keys_by_user[user.pk].add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def _remove(self, key):
+        _, (user, _) = self.entries.pop(key)
+        keys = self.keys_by_user[user.pk]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_user[user.pk]
+
+
+@functools.cache
+def get_token_cache():
+    return TokenCache(settings.TOKEN_CACHE_MAX_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def record_lookup(hit):
+    """Count a token cache lookup in the response cache, which unlike the token cache is shared by processes"""
+    increment(HITS_KEY if hit else MISSES_KEY)
+
+
+def get_stats():
+    """Return numbers of hits and misses and the hit ratio of the token caches of all processes"""
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication remembering recently used tokens in process memory, so that most requests
+    skip the token and user query. Entries are dropped when the token is deleted or the user is saved
+    (see user.signals) and otherwise expire after TOKEN_CACHE_TTL seconds, which bounds how long other
+    processes may keep accepting a revoked token.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        record_lookup(cached is not None)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(key, user, token)
+        else:
+            user, token = cached
+        # Views may change request.user, so every request gets its own copy of the cached user
+        return copy.copy(user), token
+
+    async def aauthenticate(self, request):
+        """Async counterpart of authenticate() for async views, see core.api.views.AsyncAPIView"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.'))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        record_lookup(cached is not None)
+        if cached is None:
+            token = await self.get_model().objects.select_related('user').filter(key=key).afirst()
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            user = token.user
+            cache.set(key, user, token)
+        else:
+            user, token = cached
+        return copy.copy(user), token
@@ -39,6 +39,18 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class FastUserSerializer(serializers.BaseSerializer):
+    """Read-only serializer rendering the same output as UserSerializer without per-field introspection"""
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'email': instance.email,
+            'first_name': instance.first_name,
+            'last_name': instance.last_name,
+        }
+
+
 class AuthTokenSerializer(serializers.Serializer):
     """Serializer for the user auth token"""
     email = serializers.EmailField()
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.cache import bump_versions, USERS_SCOPE
+from user.authentication import get_token_cache
+from user.models import User
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    get_token_cache().invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers deactivation as well as any profile update, e.g. through ManageUserView
+    get_token_cache().invalidate_user(instance.pk)
+
+
+def is_login_update(update_fields):
+    """Whether a save only records a login, which changes nothing shown in the user and thread lists"""
+    return update_fields is not None and set(update_fields) <= {'last_login'}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_users(sender, instance, update_fields=None, **kwargs):
+    # Thread lists showing the user are invalidated through the threads, see chat.signals
+    if not is_login_update(update_fields):
+        bump_versions([USERS_SCOPE])
@@ -1,10 +1,16 @@
-from django.test import TestCase
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from user.authentication import TokenCache, get_stats, get_token_cache, reset_stats
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -174,3 +180,93 @@ class PrivateUserApiTest(TestCase):
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test caching of token authentication"""
+
+    def setUp(self) -> None:
+        get_token_cache().clear()
+        reset_stats()
+        self.user = create_user(
+            email=TEST_EMAIL,
+            password='testpass',
+            first_name=TEST_FIRST_NAME,
+            last_name=TEST_LAST_NAME
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_is_cached(self):
+        """Test that only the first request with a token queries the database"""
+        with self.assertNumQueries(1):
+            self.client.get(ME_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(get_token_cache()), 1)
+        self.assertEqual(get_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_hit_ratio_command(self):
+        """Test reporting of hits, misses and the hit ratio"""
+        for _ in range(4):
+            self.client.get(ME_URL)
+
+        out = StringIO()
+        call_command('token_cache_stats', '--reset', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Hits: 3, misses: 1, hit ratio: 75.0%')
+        self.assertEqual(get_stats()['hits'], 0)
+
+    def test_deleted_token_is_invalidated(self):
+        """Test that a deleted token is no longer accepted"""
+        self.client.get(ME_URL)
+        self.token.delete()
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_invalidated(self):
+        """Test that a token of a deactivated user is no longer accepted"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_updated_user_is_invalidated(self):
+        """Test that profile updates are visible to the next request"""
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'first_name': 'New first name'})
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.data['first_name'], 'New first name')
+
+
+class TokenCacheTests(SimpleTestCase):
+    """Test LRU and TTL behaviour of the token cache"""
+
+    def setUp(self) -> None:
+        self.now = 0
+        self.cache = TokenCache(max_size=2, ttl=10, timer=lambda: self.now)
+        self.users = [get_user_model()(pk=pk) for pk in range(3)]
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the least recently used token is evicted when the cache is full"""
+        self.cache.set('a', self.users[0], 'token a')
+        self.cache.set('b', self.users[1], 'token b')
+        self.cache.get('a')
+        self.cache.set('c', self.users[2], 'token c')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), (self.users[0], 'token a'))
+
+    def test_entry_expires(self):
+        """Test that a token is looked up again after its time to live"""
+        self.cache.set('a', self.users[0], 'token a')
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_user(self):
+        """Test that all tokens of a user are dropped at once"""
+        self.cache.set('a', self.users[0], 'token a')
+        self.cache.set('b', self.users[0], 'token b')
+        self.cache.invalidate_user(self.users[0].pk)
+        self.assertEqual(len(self.cache), 0)
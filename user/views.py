@@ -11,6 +11,8 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
+from core.cache import USERS_SCOPE, VersionedCacheMixin
+from core.replicas import ReplicaReadMixin
 from .models import User
 from .pagination import ResultsSetPagination
 from .serializers import (
@@ -155,8 +157,11 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
         return self.request.user
 
 
-class ListUserView(generics.ListAPIView):
+class ListUserView(ReplicaReadMixin, VersionedCacheMixin, generics.ListAPIView):
     """Retrieve list of users in the system"""
     serializer_class = UserSerializer
     queryset = User.objects.all()
     pagination_class = ResultsSetPagination
+
+    def get_cache_scopes(self):
+        return [USERS_SCOPE]